@@ -1,64 +1,109 @@
+import base64
+import os
 import socket
 import sys
-from typing import Tuple
-import compress
+from itertools import count
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Dict, Optional, Tuple
 import json
-from encryption import EncryptionState
-from gitgud_types import Json
-
+from encryption import EncryptionState, ResumptionTicket
+from key_exchange import X25519KeyExchange
+from record_layer import supported_ciphers
+from framing import (
+    frame_message,
+    frame_stream_chunk,
+    frame_stream_end,
+    recv_exact,
+    recv_frame,
+    send_frame,
+)
+from compression import (
+    get_compression,
+    supported_compressions,
+    supported_dictionaries,
+)
+from content_cache import ContentCache
+from serialization import get_serializer, serializers, supported_serializations
+from gitgud_types import Json, ProgressCallback
 
 encryption_length_size = 3
 regular_length_size = 4
 file_token_length_size = 3
 file_length_size = 9
+# Most bytes asked from the socket by a single recv_into of a file
+recv_chunk_size = 256 * 1024
+session_length_size = 9
 
 
-def decompress_bytes_to_str(data: bytes) -> str:
+def decompress_message(data: bytes, features: Json) -> Json:
     """
-    Decompresses a byte string using the gzip algorithm and returns the decompressed string.
+    Decompresses a message with the compression negotiated on a connection and decodes it with the negotiated serialization.
 
     Parameters:
         data (bytes): The byte string to be decompressed.
+        features (Json): The features accepted by the server, JSON and plain gzip if nothing was negotiated.
 
     Returns:
-        str: The decompressed string.
+        Json: The decoded message.
 
     Raises:
-        ValueError: If the input data is not in a valid gzip format.
+        ValueError: If the input data is not in a valid format.
     """
-    return compress.decompress_bytes_to_str(compress.Algorithm.gzip, data)
+    return get_serializer(features).loads(get_compression(features).decompress(data))
 
 
-def decompress_bytes_to_bytes(data: bytes) -> bytes:
+def decompress_bytes_to_bytes(data: bytes, features: Json) -> bytes:
     """
-    Decompresses a byte string using the gzip algorithm and returns the decompressed bytes.
+    Decompresses a byte string with the compression negotiated on a connection and returns the decompressed bytes.
 
     Parameters:
         data (bytes): The byte string to be decompressed.
+        features (Json): The features accepted by the server, plain gzip if no compression was negotiated.
 
     Returns:
         bytes: The decompressed bytes.
 
     Raises:
-        ValueError: If the input data is not in a valid gzip format.
+        ValueError: If the input data is not in a valid format.
     """
-    return compress.decompress_bytes_to_bytes(compress.Algorithm.gzip, data)
+    return get_compression(features).decompress(data)
 
 
-def compress_str(data: str) -> bytes:
+def compress_message(message: Json, features: Json) -> bytes:
     """
-    Compresses a string using the gzip algorithm and returns the compressed bytes.
+    Encodes a message with the serialization negotiated on a connection and compresses it with the negotiated compression.
 
     Parameters:
-        data (str): The string to be compressed.
+        message (Json): The message to be sent.
+        features (Json): The features accepted by the server, JSON and plain gzip if nothing was negotiated.
 
     Returns:
         bytes: The compressed bytes.
+    """
+    return get_compression(features).compress(
+        get_serializer(features).dumps(message), incompressible=False
+    )
+
+
+def decode_file(response: Json, content: bytes) -> Any:
+    """
+    Decode structured content received by `ClientComm.run_file_request` (commits, diffs...).
+
+    Parameters:
+        response (Json): The response the content came with.
+        content (bytes): The content.
+
+    Returns:
+        Any: The decoded content, encoded with the serialization named by "fileFormat", JSON for servers that don't name one.
 
     Raises:
-        ValueError: If the input data is not a valid string.
+        ValueError: If the content isn't valid or the format isn't known.
     """
-    return compress.compress_str_to_bytes(compress.Algorithm.gzip, data)
+    file_format = response.get("fileFormat", "json")
+    if file_format not in serializers:
+        raise ValueError(f"Unknown file format {file_format}")
+    return serializers[file_format].loads(content)
 
 
 def recv(soc: socket.socket, length_size: int) -> bytes:
@@ -72,34 +117,86 @@ def recv(soc: socket.socket, length_size: int) -> bytes:
     Returns:
         bytes: The received data.
     """
-    length_of_data = int(soc.recv(length_size).decode())
-    return soc.recv(length_of_data)
+    length_of_data = int(recv_exact(soc, length_size).decode())
+    return bytes(recv_exact(soc, length_of_data))
 
 
-def recv_file(soc: socket.socket, length_size: int) -> bytes:
+def recv_file(
+    soc: socket.socket,
+    length_size: int,
+    on_progress: Optional[ProgressCallback] = None,
+) -> bytearray:
     """
-    Receives a file from a socket connection.
+    Receives a file from a socket connection into a buffer allocated once for the whole file.
 
     Args:
         soc (socket.socket): The socket object representing the connection.
         length_size (int): The size of the length prefix of the file.
+        on_progress (Optional[ProgressCallback], optional): Called with the bytes received so far and the total, returning False cancels. Defaults to None.
 
     Returns:
-        bytes: The received file data.
+        bytearray: The received file data.
 
     Raises:
         ValueError: If the received length prefix is not a valid integer.
         ConnectionError: If the connection is closed before receiving the entire file.
+        TransferCancelled: If `on_progress` cancelled the transfer.
     """
-    length_of_data = int(soc.recv(length_size).decode())
-    data = bytes()
-    while length_of_data > 0:
-        new_data = soc.recv(1024)
-        length_of_data -= len(new_data)
-        data += new_data
+    length_of_data = int(recv_exact(soc, length_size).decode())
+    data = bytearray(length_of_data)
+    view = memoryview(data)
+    received = 0
+    while received < length_of_data:
+        received_now = soc.recv_into(
+            view[received:], min(recv_chunk_size, length_of_data - received)
+        )
+        if received_now == 0:
+            raise ConnectionError("Connection closed")
+        received += received_now
+        report_progress(on_progress, received, length_of_data)
     return data
 
 
+def report_progress(
+    on_progress: Optional[ProgressCallback], received: int, total: int
+):
+    """
+    Report the progress of a transfer.
+
+    Parameters:
+        on_progress (Optional[ProgressCallback]): The callback to report to, if any.
+        received (int): The bytes received so far.
+        total (int): The size of the whole transfer.
+
+    Raises:
+        TransferCancelled: If the callback cancelled the transfer.
+    """
+    if on_progress is not None and not on_progress(received, total):
+        raise TransferCancelled("Transfer cancelled")
+
+
+def write_chunk(buffer: bytearray, received: int, chunk: bytes) -> int:
+    """
+    Write a streamed chunk into the buffer allocated for the whole file.
+
+    Parameters:
+        buffer (bytearray): The buffer of the file.
+        received (int): The bytes already written.
+        chunk (bytes): The decrypted and decompressed chunk.
+
+    Returns:
+        int: The bytes written including the chunk.
+
+    Raises:
+        ValueError: If the chunk doesn't fit in the announced size of the file.
+    """
+    end = received + len(chunk)
+    if end > len(buffer):
+        raise ValueError("Stream larger than announced")
+    buffer[received:end] = chunk
+    return end
+
+
 def send(soc: socket.socket, data: bytes, length_size: int):
     """
     Sends data over a socket connection by first sending the length of the data as a prefix.
@@ -113,43 +210,498 @@ def send(soc: socket.socket, data: bytes, length_size: int):
         None
     """
     length_bytes = str(len(data)).zfill(length_size).encode()
-    soc.send(length_bytes + data)
+    soc.sendall(length_bytes + data)
+
+
+def recv_message(
+    soc: socket.socket, encryption: EncryptionState, length_size: int
+) -> bytes:
+    """
+    Receives an encrypted message from the server,
+    in a binary frame if binary framing was negotiated and with a decimal length prefix otherwise.
+
+    Parameters:
+        soc (socket.socket): The socket of the connection.
+        encryption (EncryptionState): The encryption state of the connection, holding the negotiated features.
+        length_size (int): The size of the decimal length prefix.
+
+    Returns:
+        bytes: The encrypted message.
+    """
+    if encryption.features.get("framing") != "binary":
+        return recv(soc, length_size)
+
+    (kind, _, data) = recv_frame(soc)
+    if kind != frame_message:
+        raise ValueError("Unexpected frame kind")
+    return data
+
+
+def send_message(
+    soc: socket.socket, encryption: EncryptionState, data: bytes, length_size: int
+):
+    """
+    Sends an encrypted message to the server,
+    in a binary frame if binary framing was negotiated and with a decimal length prefix otherwise.
+
+    Parameters:
+        soc (socket.socket): The socket of the connection.
+        encryption (EncryptionState): The encryption state of the connection, holding the negotiated features.
+        data (bytes): The encrypted message.
+        length_size (int): The size of the decimal length prefix.
+
+    Returns:
+        None
+    """
+    if encryption.features.get("framing") == "binary":
+        send_frame(soc, frame_message, data)
+    else:
+        send(soc, data, length_size)
+
+
+class ResumptionRejected(ConnectionError):
+    """
+    Raised when the server didn't accept a resumption ticket, nothing sent on the connection was run.
+    """
+
+
+class TransferCancelled(Exception):
+    """
+    Raised when a progress callback cancels a file transfer.
+    """
+
+
+class PendingRequest:
+    def __init__(self, on_progress: Optional[ProgressCallback] = None) -> None:
+        """
+        Initializes a new instance of the PendingRequest class,
+        a request sent over a session that is waiting for its response.
+
+        Parameters:
+            on_progress (Optional[ProgressCallback], optional): Called as file content streams in, returning False cancels. Defaults to None.
+
+        Returns:
+            None
+        """
+        self.answered = Event()
+        self.response: Optional[Json] = None
+        # File content streamed after the response, allocated once its size is announced
+        self.file: Optional[bytearray] = None
+        self.received = 0
+        self.on_progress = on_progress
+        self.cancelled = False
+        self.last_activity = monotonic()
+
+
+class ClientSession:
+    def __init__(
+        self, soc: socket.socket, encryption: EncryptionState, timeout: float = 120
+    ) -> None:
+        """
+        Initializes a new instance of the ClientSession class.
+        A session is one encrypted connection that carries many requests, each tagged with a request id.
+        Responses may arrive in any order and are matched to their request by a receiving thread.
+
+        Parameters:
+            soc (socket.socket): A connected socket that negotiated a session.
+            encryption (EncryptionState): The encryption state of the socket.
+            timeout (float, optional): Seconds to wait for a response before failing the request. Defaults to 120.
+
+        Returns:
+            None
+        """
+        self.soc = soc
+        self.timeout = timeout
+        self.encryption = encryption
+        self.send_lock = Lock()
+        self.pending_lock = Lock()
+        self.pending: Dict[int, PendingRequest] = {}
+        # Start at 1, stream frames of requests sent without an id are tagged 0
+        self.request_ids = count(1)
+        self.closed = False
+        Thread(target=self._receive_responses, daemon=True).start()
+
+    def request(
+        self, data: Json, on_progress: Optional[ProgressCallback] = None
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Send a request over the session and wait for its response.
+
+        Parameters:
+            data (Json): The request to send.
+            on_progress (Optional[ProgressCallback], optional): Called as file content streams in, returning False cancels. Defaults to None.
+
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response to the request and the file content streamed after it, if any.
+
+        Raises:
+            ConnectionError: If the session closed before the response arrived.
+            TimeoutError: If nothing arrived for the request in time.
+            TransferCancelled: If `on_progress` cancelled the transfer.
+        """
+        request_id = next(self.request_ids)
+        pending = PendingRequest(on_progress)
+        with self.pending_lock:
+            if self.closed:
+                raise ConnectionError("Session closed")
+            self.pending[request_id] = pending
+
+        compressed_data = compress_message(
+            {**data, "requestId": request_id}, self.encryption.features
+        )
+        try:
+            # Records have to be sent in the order they were encrypted
+            with self.send_lock:
+                encrypted_data = self.encryption.encrypt(compressed_data)
+                send_message(
+                    self.soc, self.encryption, encrypted_data, session_length_size
+                )
+        except OSError:
+            self.close()
+
+        # Large files may take longer than the timeout, only give up when nothing arrives
+        while not pending.answered.wait(self.timeout):
+            if monotonic() - pending.last_activity >= self.timeout:
+                with self.pending_lock:
+                    self.pending.pop(request_id, None)
+                raise TimeoutError("Request timed out")
+        if pending.cancelled:
+            raise TransferCancelled("Transfer cancelled")
+        if pending.response is None:
+            raise ConnectionError("Session closed")
+        return (pending.response, pending.file)
+
+    def _receive_responses(self):
+        """
+        Receive responses until the connection closes and hand each one to the request waiting for it.
+        """
+        try:
+            while True:
+                if self.encryption.features.get("framing") != "binary":
+                    self._on_response(recv(self.soc, session_length_size))
+                    continue
+
+                (kind, request_id, data) = recv_frame(self.soc)
+                if kind == frame_message:
+                    self._on_response(data)
+                elif kind == frame_stream_chunk:
+                    self._on_stream_chunk(request_id, data)
+                elif kind == frame_stream_end:
+                    self._on_stream_end(request_id)
+        except Exception:
+            pass
+        finally:
+            self.close()
+
+    def _on_response(self, data: bytes):
+        """
+        Handle an encrypted response, finishing its request unless file content is streamed after it.
+
+        Parameters:
+            data (bytes): The encrypted response.
+        """
+        result = decompress_message(
+            self.encryption.decrypt(data), self.encryption.features
+        )
+        request_id = result.get("requestId")
+        with self.pending_lock:
+            pending = self.pending.get(request_id)
+        if pending is None:
+            return
+        pending.response = result
+        pending.last_activity = monotonic()
+        if result.get("stream"):
+            pending.file = bytearray(result["size"])
+        else:
+            self._finish(request_id)
+
+    def _on_stream_chunk(self, request_id: int, data: bytes):
+        """
+        Handle an encrypted chunk of file content streamed after a response.
+
+        Parameters:
+            request_id (int): The request the chunk belongs to.
+            data (bytes): The encrypted and compressed chunk.
+        """
+        # Decrypted even when dropped, records have to be decrypted in the order they arrive
+        compressed_chunk = self.encryption.decrypt(data)
+        with self.pending_lock:
+            pending = self.pending.get(request_id)
+        if pending is None or pending.file is None:
+            return
+        chunk = decompress_bytes_to_bytes(compressed_chunk, self.encryption.features)
+        pending.received = write_chunk(pending.file, pending.received, chunk)
+        pending.last_activity = monotonic()
+        try:
+            report_progress(pending.on_progress, pending.received, len(pending.file))
+        except TransferCancelled:
+            # The rest of the stream is dropped as it arrives, the session stays open
+            pending.cancelled = True
+            self._finish(request_id)
+
+    def _on_stream_end(self, request_id: int):
+        """
+        Handle the end of file content streamed after a response.
+
+        Parameters:
+            request_id (int): The request the stream belongs to.
+
+        Raises:
+            ValueError: If the stream ended before the announced size of the file.
+        """
+        with self.pending_lock:
+            pending = self.pending.get(request_id)
+        if pending is None:
+            return
+        if pending.file is not None and pending.received != len(pending.file):
+            raise ValueError("Stream shorter than announced")
+        self._finish(request_id)
+
+    def _finish(self, request_id: int):
+        """
+        Wake up the request waiting for its response.
+
+        Parameters:
+            request_id (int): The request that was answered.
+        """
+        with self.pending_lock:
+            pending = self.pending.pop(request_id, None)
+        if pending is not None:
+            pending.answered.set()
+
+    def close(self):
+        """
+        Close the session, requests still waiting for a response fail with a ConnectionError.
+        """
+        with self.pending_lock:
+            self.closed = True
+            waiting = list(self.pending.values())
+            self.pending.clear()
+        for pending in waiting:
+            pending.response = None
+            pending.answered.set()
+        self.soc.close()
 
 
 class ClientComm:
-    def __init__(self, addr: Tuple[str, int]) -> None:
+    def __init__(self, addr: Tuple[str, int], session: bool = False) -> None:
         """
         Initializes a new instance of the class.
 
         Args:
             addr (Tuple[str, int]): The IP address and port number of the server.
+            session (bool, optional): Send all requests over one persistent connection instead of a connection per request. Defaults to False.
 
         Returns:
             None
         """
         self.ip = addr
-
-    def _exchange_keys(self, soc: socket.socket) -> EncryptionState:
+        self.use_session = session
+        self.session: Optional[ClientSession] = None
+        self.session_lock = Lock()
+        # Set once the server turned out to be from before feature negotiation
+        self.legacy_server = False
+        self.content_cache = ContentCache()
+        # Handed out by the server after a full key exchange, lets later connections skip it
+        self.ticket: Optional[ResumptionTicket] = None
+
+    def _exchange_keys(
+        self,
+        soc: socket.socket,
+        offer: Optional[Json] = None,
+        wait_accept=True,
+        resume=True,
+    ) -> EncryptionState:
         """
         A function to exchange keys with a socket using encryption and return the encryption state.
+        When there is a resumption ticket and features are offered, the ticket is sent instead of exchanging keys.
 
         Parameters:
             soc (socket.socket): The socket to exchange keys with.
+            offer (Optional[Json]): Protocol features to offer the server, the accepted ones are saved in the encryption state.
+            wait_accept (bool, optional): Wait for the server to accept a resumption ticket,
+                False to send a request right away and call `_finish_resumption` before reading the response. Defaults to True.
+            resume (bool, optional): Present the resumption ticket if there is one. Defaults to True.
 
         Returns:
             EncryptionState: The encryption state after key exchange.
+
+        Raises:
+            ResumptionRejected: If the server rejected the resumption ticket.
         """
         encryption = EncryptionState()
         initial_encryption_data = recv(soc, encryption_length_size).decode()
         encryption.parse_initial_message(initial_encryption_data)
 
-        mixed_client_key = str(encryption.get_mixed_key()).encode()
-        send(soc, mixed_client_key, encryption_length_size)
+        ticket = self.ticket if resume else None
+        if offer is not None and ticket is not None:
+            # Only the cipher, compression and serialization picked in the key exchange are offered
+            # so the accepted features are known up front
+            offer = {
+                k: v
+                for (k, v) in offer.items()
+                if k not in ("cipher", "compression", "serialization")
+            }
+            if ticket.cipher is not None:
+                offer["cipher"] = [ticket.cipher]
+            if ticket.compression is not None:
+                offer["compression"] = [ticket.compression["algorithm"]]
+            if ticket.serialization is not None:
+                offer["serialization"] = [ticket.serialization]
+            nonce = os.urandom(16)
+            encryption.resume(ticket, nonce)
+            send(
+                soc,
+                ";".join(
+                    [
+                        "resume",
+                        ticket.ticket,
+                        base64.urlsafe_b64encode(nonce).decode(),
+                        json.dumps(offer),
+                    ]
+                ).encode(),
+                encryption_length_size,
+            )
+            # The server that issued the ticket accepted this client's offers before,
+            # the dictionary versions are only offered, the accepted one is part of the compression
+            encryption.features = {
+                k: v for (k, v) in offer.items() if k != "compressionDictionary"
+            }
+            if ticket.cipher is not None:
+                encryption.features["cipher"] = ticket.cipher
+            if ticket.compression is not None:
+                encryption.features["compression"] = ticket.compression
+            if ticket.serialization is not None:
+                encryption.features["serialization"] = ticket.serialization
+            encryption.start_record_layer()
+            encryption.awaiting_accept = True
+            if wait_accept:
+                self._finish_resumption(soc, encryption)
+            return encryption
+
+        mixed_client_key = str(encryption.get_mixed_key())
+        if offer is None:
+            encryption.exchange_keys()
+            send(soc, mixed_client_key.encode(), encryption_length_size)
+            return encryption
+
+        # The modpow key is still sent for servers that don't know X25519
+        key_exchange = X25519KeyExchange()
+        offer = {
+            **offer,
+            "keyExchange": key_exchange.name,
+            "publicKey": key_exchange.public_key(),
+        }
+        send(
+            soc,
+            f"{mixed_client_key};{json.dumps(offer)}".encode(),
+            encryption_length_size,
+        )
+        accepted = json.loads(recv(soc, encryption_length_size).decode())
+        if accepted.pop("keyExchange", None) == key_exchange.name:
+            encryption.set_key(key_exchange.shared_key(accepted.pop("publicKey")))
+        else:
+            encryption.exchange_keys()
+        new_ticket = accepted.pop("ticket", None)
+        if new_ticket is not None:
+            self.ticket = ResumptionTicket(
+                new_ticket,
+                encryption.get_resumption_secret(),
+                accepted.get("cipher"),
+                accepted.get("compression"),
+                accepted.get("serialization"),
+            )
+        encryption.features = accepted
+        encryption.start_record_layer()
         return encryption
 
+    def _finish_resumption(self, soc: socket.socket, encryption: EncryptionState):
+        """
+        Read the server's answer to a resumption ticket, dropping the ticket if it was rejected.
+
+        Parameters:
+            soc (socket.socket): The resumed socket.
+            encryption (EncryptionState): The encryption state of the socket.
+
+        Raises:
+            ResumptionRejected: If the server rejected the ticket or accepted other features than offered.
+        """
+        encryption.awaiting_accept = False
+        try:
+            accepted = json.loads(recv(soc, encryption_length_size).decode())
+        except (OSError, ValueError):
+            accepted = {}
+        if not accepted.pop("resumed", False) or accepted != encryption.features:
+            self.ticket = None
+            raise ResumptionRejected("Resumption ticket rejected")
+
+    def _connect(
+        self, offer: Json, wait_accept=True
+    ) -> Tuple[socket.socket, EncryptionState]:
+        """
+        Connect to the server and exchange keys, offering protocol features.
+        Servers from before feature negotiation hang up on an offer,
+        in that case the connection is retried without one and offers aren't sent again.
+        A rejected resumption ticket is dropped and the connection retried with a full key exchange.
+
+        Parameters:
+            offer (Json): Protocol features to offer the server.
+            wait_accept (bool, optional): Wait for the server to accept a resumption ticket, see `_exchange_keys`. Defaults to True.
+
+        Returns:
+            Tuple[socket.socket, EncryptionState]: The connected socket and its encryption state.
+        """
+        soc = socket.create_connection(self.ip)
+        if self.legacy_server:
+            return (soc, self._exchange_keys(soc))
+        if self.ticket is not None:
+            try:
+                return (soc, self._exchange_keys(soc, offer, wait_accept))
+            except ResumptionRejected:
+                soc.close()
+                soc = socket.create_connection(self.ip)
+        try:
+            # Another connection may have stored a new ticket meanwhile, a rejection here isn't a legacy server
+            return (soc, self._exchange_keys(soc, offer, resume=False))
+        except (ValueError, ConnectionError):
+            soc.close()
+            self.legacy_server = True
+
+        soc = socket.create_connection(self.ip)
+        return (soc, self._exchange_keys(soc))
+
+    def _get_session(self) -> Optional[ClientSession]:
+        """
+        Get the open session, connecting a new one if there is none or it was closed.
+
+        Returns:
+            Optional[ClientSession]: The session, None if the server doesn't support sessions.
+        """
+        with self.session_lock:
+            if self.session is None or self.session.closed:
+                (soc, encryption) = self._connect(
+                    {
+                        "session": True,
+                        "framing": "binary",
+                        "inlineStream": True,
+                        "cipher": supported_ciphers,
+                        "compression": supported_compressions,
+                        "compressionDictionary": supported_dictionaries,
+                        "serialization": supported_serializations,
+                        "resumption": True,
+                    }
+                )
+                if not encryption.features.get("session"):
+                    soc.close()
+                    self.use_session = False
+                    return None
+                self.session = ClientSession(soc, encryption)
+            return self.session
+
     def run_request(self, data: Json) -> Json:
         """
-        Runs a request with the provided data using socket communication.
+        Runs a request with the provided data using socket communication,
+        over the persistent session when sessions are enabled and a new connection otherwise.
         
         Parameters:
             data (Json): The data to be sent in JSON format.
@@ -157,38 +709,229 @@ class ClientComm:
         Returns:
             Json: The response data received after processing the request.
         """
-        soc = socket.socket()
-        soc.connect(self.ip)
+        return self._run(data)[0]
 
-        encryption = self._exchange_keys(soc)
-        compressed_data = compress_str(json.dumps(data))
-        encrypted_data = encryption.encrypt(compressed_data)
-        send(soc, encrypted_data, regular_length_size)
-        response = recv(soc, regular_length_size)
-        soc.close()
+    def run_file_request(
+        self, data: Json, on_progress: Optional[ProgressCallback] = None
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Runs a request that answers with file content (viewFile, commits, diff...).
+        The content is streamed on the request's own connection when the server supports it,
+        older servers send a token and port for a separate file transfer instead.
+        Content the server tagged with a hash is cached, asking for it again only sends the hash back
+        and the server answers "notModified" if it didn't change.
+        Structured content (commits, diffs...) is encoded with the serialization named by "fileFormat" in the response, see `decode_file`.
 
-        result = decompress_bytes_to_str(encryption.decrypt(response))
-        return json.loads(result)
+        Parameters:
+            data (Json): The data to be sent in JSON format.
+            on_progress (Optional[ProgressCallback], optional): Called with the bytes received so far and the total, returning False cancels. Defaults to None.
 
-    def file_request(self, token: str, port: int) -> bytes:
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response and the file content, None if the request failed.
+
+        Raises:
+            TransferCancelled: If `on_progress` cancelled the transfer.
+        """
+        cached = self.content_cache.get(data)
+        request = data if cached is None else {**data, "have": [cached[0]]}
+        (response, file) = self._run(request, on_progress)
+        if "error" in response:
+            return (response, None)
+        if cached is not None and response.get("notModified"):
+            if cached[2] is not None:
+                response = {**response, "fileFormat": cached[2]}
+            return (response, cached[1])
+        if file is None and "token" in response and "port" in response:
+            file = self.file_request(response["token"], response["port"], on_progress)
+        if file is not None and "contentHash" in response:
+            file = bytes(file)
+            self.content_cache.put(
+                data, response["contentHash"], file, response.get("fileFormat")
+            )
+        return (response, file)
+
+    def download_file(
+        self,
+        data: Json,
+        range_size: int = 4 * 1024 * 1024,
+        file: Optional[bytearray] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Tuple[Json, Optional[bytearray]]:
+        """
+        Download a file with viewFile requests of one range each,
+        a failed download can be resumed by passing back the content received so far.
+
+        Parameters:
+            data (Json): The viewFile request, its "offset" and "length" are set for every range.
+            range_size (int, optional): The most bytes to request at once. Defaults to 4 MiB.
+            file (Optional[bytearray], optional): Content received by an earlier download of the same file. Defaults to None.
+            on_progress (Optional[ProgressCallback], optional): Called with the bytes of the file received so far and its size, returning False cancels. Defaults to None.
+
+        Returns:
+            Tuple[Json, Optional[bytearray]]: The last response and the whole file, None if a request failed.
+
+        Raises:
+            TransferCancelled: If `on_progress` cancelled the download, `file` holds the ranges received until then.
+        """
+        if file is None:
+            file = bytearray()
+        file_size: Optional[int] = None
+        while True:
+            offset = len(file)
+            range_progress: Optional[ProgressCallback] = None
+            if on_progress is not None:
+                progress = on_progress
+                known_size = file_size
+
+                def range_progress(received: int, total: int) -> bool:
+                    size = known_size if known_size is not None else offset + total
+                    return progress(offset + received, size)
+
+            request = {**data, "offset": offset, "length": range_size}
+            (response, content) = self.run_file_request(request, range_progress)
+            if content is None:
+                return (response, None)
+            file_size = response["fileSize"]
+            file += content
+            if not content or len(file) >= response["fileSize"]:
+                return (response, file)
+
+    def _run(
+        self, data: Json, on_progress: Optional[ProgressCallback] = None
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Send a request and receive its response and the file content streamed after it, if any.
+
+        Parameters:
+            data (Json): The data to be sent in JSON format.
+            on_progress (Optional[ProgressCallback], optional): Called as file content streams in, returning False cancels. Defaults to None.
+
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response and the streamed file content.
+        """
+        if self.use_session:
+            session = self._get_session()
+            if session is not None:
+                return session.request(data, on_progress)
+
+        try:
+            return self._run_on_connection(data, on_progress)
+        except ResumptionRejected:
+            # Nothing ran on the server, the ticket is dropped so this is a full key exchange
+            return self._run_on_connection(data, on_progress)
+
+    def _run_on_connection(
+        self, data: Json, on_progress: Optional[ProgressCallback] = None
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Send a request on a connection of its own and receive its response and the file content streamed after it, if any.
+        On a resumed connection the request is sent without waiting for the server to accept the ticket.
+
+        Parameters:
+            data (Json): The data to be sent in JSON format.
+            on_progress (Optional[ProgressCallback], optional): Called as file content streams in, returning False cancels. Defaults to None.
+
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response and the streamed file content.
+
+        Raises:
+            ResumptionRejected: If the server rejected the resumption ticket.
+        """
+        (soc, encryption) = self._connect(
+            {
+                "framing": "binary",
+                "inlineStream": True,
+                "resumption": True,
+                "cipher": supported_ciphers,
+                "compression": supported_compressions,
+                "compressionDictionary": supported_dictionaries,
+                "serialization": supported_serializations,
+            },
+            wait_accept=False,
+        )
+        try:
+            compressed_data = compress_message(data, encryption.features)
+            encrypted_data = encryption.encrypt(compressed_data)
+            try:
+                send_message(soc, encryption, encrypted_data, regular_length_size)
+            except OSError:
+                # A server rejecting the ticket may hang up before the request is sent
+                if not encryption.awaiting_accept:
+                    raise
+            if encryption.awaiting_accept:
+                self._finish_resumption(soc, encryption)
+            response = recv_message(soc, encryption, regular_length_size)
+            result = decompress_message(encryption.decrypt(response), encryption.features)
+            if not result.get("stream"):
+                return (result, None)
+
+            file = bytearray(result["size"])
+            received = 0
+            while True:
+                (kind, _, chunk) = recv_frame(soc)
+                if kind == frame_stream_end:
+                    if received != len(file):
+                        raise ValueError("Stream shorter than announced")
+                    return (result, file)
+                if kind != frame_stream_chunk:
+                    raise ValueError("Unexpected frame kind")
+                content = decompress_bytes_to_bytes(
+                    encryption.decrypt(chunk), encryption.features
+                )
+                received = write_chunk(file, received, content)
+                # Cancelling closes the connection, dropping the rest of the stream
+                report_progress(on_progress, received, len(file))
+        finally:
+            soc.close()
+
+    def file_request(
+        self, token: str, port: int, on_progress: Optional[ProgressCallback] = None
+    ) -> bytes:
         """
         Runs a file request using the provided token and port number.
 
         Parameters:
             token (str): The token to be used for the file request.
             port (int): The port number to connect to.
+            on_progress (Optional[ProgressCallback], optional): Called with the bytes received so far and the total, returning False cancels. Defaults to None.
 
         Returns:
             bytes: The decrypted file content.
+
+        Raises:
+            TransferCancelled: If `on_progress` cancelled the transfer.
         """
         soc = socket.socket()
         soc.connect((self.ip[0], port))
-
-        encryption = self._exchange_keys(soc)
-        send(soc, encryption.encrypt(token.encode()), file_token_length_size)
-        file = recv_file(soc, file_length_size)
-
-        return decompress_bytes_to_bytes(encryption.decrypt(file))
+        # A server that negotiated features on the main connection answers an offer on a transfer too,
+        # the offer carries the X25519 key, only legacy servers get the bare modpow exchange
+        offer: Optional[Json] = None
+        if not self.legacy_server:
+            offer = {
+                "cipher": supported_ciphers,
+                "compression": supported_compressions,
+                "compressionDictionary": supported_dictionaries,
+            }
+        try:
+            encryption = self._exchange_keys(soc, offer, wait_accept=False)
+            try:
+                send(soc, encryption.encrypt(token.encode()), file_token_length_size)
+            except OSError:
+                # A server rejecting the ticket may hang up before the token is sent
+                if not encryption.awaiting_accept:
+                    raise
+            if encryption.awaiting_accept:
+                self._finish_resumption(soc, encryption)
+            file = recv_file(soc, file_length_size, on_progress)
+        except ResumptionRejected:
+            # The token wasn't claimed, retry with a full key exchange
+            return self.file_request(token, port, on_progress)
+        finally:
+            soc.close()
+
+        return decompress_bytes_to_bytes(
+            encryption.decrypt(bytes(file)), encryption.features
+        )
 
 
 if __name__ == "__main__":
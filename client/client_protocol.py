@@ -8,6 +8,7 @@ if sys.version_info[0] == 3 and sys.version_info[1] < 8:
     TypedDict = A
 else:
     from typing import TypedDict
+from typing import List, Optional
 from gitgud_types import Json
 
 
@@ -98,7 +99,14 @@ def pack_project_directory(
     }
 
 
-def pack_file_request(repo: str, connection_token: str, file_path: str, branch: str):
+def pack_file_request(
+    repo: str,
+    connection_token: str,
+    file_path: str,
+    branch: str,
+    offset: Optional[int] = None,
+    length: Optional[int] = None,
+):
     """
     Packs the given repository, connection token, file path, and branch into a JSON object with a "type" key set to "viewFile".
 
@@ -107,6 +115,8 @@ def pack_file_request(repo: str, connection_token: str, file_path: str, branch:
         connection_token (str): The connection token.
         file_path (str): The file path.
         branch (str): The branch name.
+        offset (Optional[int], optional): Where to start reading the file. Defaults to the start of the file.
+        length (Optional[int], optional): The most bytes to read. Defaults to the rest of the file.
 
     Returns:
         dict: A JSON object with the following keys:
@@ -115,14 +125,21 @@ def pack_file_request(repo: str, connection_token: str, file_path: str, branch:
             - connectionToken (str): The connection token.
             - filePath (str): The file path.
             - branch (str): The branch name.
+            - offset (int): Only when given, where to start reading the file.
+            - length (int): Only when given, the most bytes to read.
     """
-    return {
+    request: Json = {
         "type": "viewFile",
         "repo": repo,
         "connectionToken": connection_token,
         "filePath": file_path,
         "branch": branch,
     }
+    if offset is not None:
+        request["offset"] = offset
+    if length is not None:
+        request["length"] = length
+    return request
 
 
 def pack_validate_token(token: str):
@@ -477,6 +494,51 @@ def pack_pr_commits(id: int, page: int, connection_token: str) -> Json:
     }
 
 
+def pack_batch(
+    requests: List[Json], connection_token: str, repo: Optional[str] = None
+) -> Json:
+    """
+    Packs the given requests into a JSON object with a "type" key set to "batch", run by the server in one round trip.
+    The requests don't need a connection token, the one of the batch is used, nor a repository when the batch has one.
+
+    Parameters:
+        requests (List[Json]): The requests, files can't be requested in a batch.
+        connection_token (str): The connection token.
+        repo (Optional[str], optional): The repository of the requests, validated once for all of them. Defaults to None.
+
+    Returns:
+        Json: A JSON object with the following keys:
+            - type (str): The type of the request, set to "batch".
+            - requests (List[Json]): The requests.
+            - connectionToken (str): The connection token.
+            - repo (str): Only when given, the repository name.
+    """
+    request: Json = {
+        "type": "batch",
+        "requests": requests,
+        "connectionToken": connection_token,
+    }
+    if repo is not None:
+        request["repo"] = repo
+    return request
+
+
+def pack_server_stats(connection_token: str) -> Json:
+    """
+    Packs the given connection token into a JSON object with a "type" key set to "serverStats",
+    answered only for users the server lists in STATS_USERS.
+
+    Parameters:
+        connection_token (str): The connection token.
+
+    Returns:
+        Json: A JSON object with the following keys:
+            - type (str): The type of the request, set to "serverStats".
+            - connectionToken (str): The connection token.
+    """
+    return {"type": "serverStats", "connectionToken": connection_token}
+
+
 class PullRequest(TypedDict):
     username: str
     title: str
@@ -0,0 +1,369 @@
+import os
+import re
+import zlib
+from threading import local
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import compress
+
+from gitgud_types import Json
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# First byte of a payload compressed with a negotiated codec, says how the rest of it is stored
+stored_codec_id = 0
+
+# Payloads this small are stored, the codec's header would eat the savings
+default_min_size = 256
+# Payloads compressed with the negotiated zstd dictionary, its version is agreed in the handshake
+dictionary_codec_id = 4
+# With a dictionary even short messages shrink
+dictionary_min_size = 32
+# The dictionary is trained on protocol messages, larger payloads are compressed without it
+dictionary_max_size = 64 * 1024
+dictionary_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "dictionaries"
+)
+
+# Formats that are compressed already, recognised by their first bytes
+incompressible_magic: Tuple[bytes, ...] = (
+    b"\x89PNG",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",  # gif
+    b"PK\x03\x04",  # zip, jar, docx...
+    b"\x1f\x8b",  # gzip
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"\x04\x22\x4d\x18",  # lz4
+    b"\xfd7zXZ\x00",  # xz
+    b"BZh",  # bz2
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"OggS",  # ogg
+    b"fLaC",  # flac
+    b"ID3",  # mp3
+)
+# Content larger than this has a sample compressed to tell if it's worth compressing
+sample_size = 4096
+# A sample that doesn't shrink below this ratio is taken as incompressible
+incompressible_ratio = 0.9
+
+
+class Codec:
+    """
+    A compression algorithm that can be negotiated in the handshake.
+    """
+
+    name = ""
+    codec_id = 0
+    default_level = 0
+
+    def compress(self, data: bytes, level: int) -> bytes:
+        """
+        Parameters:
+            data (bytes): The data to compress.
+            level (int): The compression level, higher is smaller and slower.
+
+        Returns:
+            bytes: The compressed data.
+        """
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Parameters:
+            data (bytes): The compressed data.
+
+        Returns:
+            bytes: The decompressed data.
+        """
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    """
+    The algorithm of the original protocol, always available.
+    """
+
+    name = "gzip"
+    codec_id = 1
+    default_level = 6
+
+    def compress(self, data: bytes, level: int) -> bytes:
+        return compress.compress_bytes_to_bytes(
+            compress.Algorithm.gzip, data, compresslevel=level
+        )
+
+    def decompress(self, data: bytes) -> bytes:
+        return compress.decompress_bytes_to_bytes(compress.Algorithm.gzip, data)
+
+
+class Lz4Codec(Codec):
+    """
+    Much faster than gzip for a somewhat larger output, needs the lz4 package.
+    """
+
+    name = "lz4"
+    codec_id = 2
+    default_level = 0
+
+    def compress(self, data: bytes, level: int) -> bytes:
+        return lz4.frame.compress(data, compression_level=level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+class ZstdCodec(Codec):
+    """
+    Smaller and faster than gzip at its default level, needs the zstandard package.
+    """
+
+    name = "zstd"
+    codec_id = 3
+    default_level = 3
+
+    def compress(self, data: bytes, level: int) -> bytes:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+# Name -> Codec of the codecs that can be used here, in order of preference
+codecs: Dict[str, Codec] = {}
+if zstandard is not None:
+    codecs[ZstdCodec.name] = ZstdCodec()
+if lz4 is not None:
+    codecs[Lz4Codec.name] = Lz4Codec()
+codecs[GzipCodec.name] = GzipCodec()
+codecs_by_id: Dict[int, Codec] = {codec.codec_id: codec for codec in codecs.values()}
+supported_compressions: List[str] = list(codecs)
+
+
+def dictionary_path(version: int) -> str:
+    """
+    Parameters:
+        version (int): The version of the dictionary.
+
+    Returns:
+        str: The path of the dictionary file, dictionaries are retrained under a new version and old versions are kept.
+    """
+    return os.path.join(dictionary_dir, f"protocol-v{version}.zdict")
+
+
+def find_dictionaries() -> List[int]:
+    """
+    Returns:
+        List[int]: The versions of the zstd dictionaries that can be used here, newest first.
+    """
+    if zstandard is None or not os.path.isdir(dictionary_dir):
+        return []
+    versions = []
+    for name in os.listdir(dictionary_dir):
+        match = re.fullmatch(r"protocol-v(\d+)\.zdict", name)
+        if match is not None:
+            versions.append(int(match.group(1)))
+    return sorted(versions, reverse=True)
+
+
+supported_dictionaries: List[int] = find_dictionaries()
+
+
+@lru_cache(maxsize=None)
+def load_dictionary(version: int, level: int) -> "zstandard.ZstdCompressionDict":
+    """
+    Load a zstd dictionary, prepared for a compression level.
+
+    Parameters:
+        version (int): The version of the dictionary, one of `supported_dictionaries`.
+        level (int): The compression level to prepare it for.
+
+    Returns:
+        zstandard.ZstdCompressionDict: The dictionary.
+    """
+    with open(dictionary_path(version), "rb") as f:
+        dictionary = zstandard.ZstdCompressionDict(f.read())
+    dictionary.precompute_compress(level=level)
+    return dictionary
+
+
+def looks_incompressible(data: bytes) -> bool:
+    """
+    Tell if content isn't worth compressing, because it's in a compressed format
+    or a sample of it barely shrinks.
+
+    Parameters:
+        data (bytes): The content.
+
+    Returns:
+        bool: True if the content should be stored as is.
+    """
+    if data.startswith(incompressible_magic):
+        return True
+    if len(data) < 4 * sample_size:
+        return False
+
+    middle = len(data) // 2
+    sample = bytes(data[:sample_size]) + bytes(data[middle : middle + sample_size])
+    return len(zlib.compress(sample, 1)) > incompressible_ratio * len(sample)
+
+
+class Compression:
+    def __init__(
+        self,
+        algorithm: Optional[str] = None,
+        level: Optional[int] = None,
+        min_size: int = default_min_size,
+        dictionary: Optional[int] = None,
+    ):
+        """
+        Initializes a new instance of the Compression class,
+        the compression used on a connection.
+
+        Without an algorithm it's the original protocol, every payload is gzipped as is.
+        With one every payload starts with the id of the codec it was compressed with,
+        `stored_codec_id` for payloads that were too small or incompressible.
+
+        Parameters:
+            algorithm (Optional[str], optional): The negotiated codec, one of `codecs`. Defaults to None.
+            level (Optional[int], optional): The negotiated level, the codec's default if None. Defaults to None.
+            min_size (int, optional): Payloads smaller than this are stored. Defaults to `default_min_size`.
+            dictionary (Optional[int], optional): Version of the zstd dictionary payloads up to `dictionary_max_size` are compressed with,
+                needs zstd to be the algorithm. Defaults to None.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the algorithm or the dictionary isn't available.
+        """
+        self.codec: Optional[Codec] = None
+        self.level = 0
+        if algorithm is not None:
+            if algorithm not in codecs:
+                raise ValueError(f"Unsupported compression {algorithm}")
+            self.codec = codecs[algorithm]
+            self.level = self.codec.default_level if level is None else level
+        self.min_size = min_size
+        self.dictionary: Optional["zstandard.ZstdCompressionDict"] = None
+        if dictionary is not None:
+            if algorithm != ZstdCodec.name or dictionary not in supported_dictionaries:
+                raise ValueError(f"Unsupported compression dictionary {dictionary}")
+            self.dictionary = load_dictionary(dictionary, self.level)
+        # zstd contexts can't be shared between threads, they're reused within one since setting up a dictionary is slow
+        self.contexts = local()
+
+    def compress(self, data: bytes, incompressible: Optional[bool] = None) -> bytes:
+        """
+        Compress a payload.
+
+        Parameters:
+            data (bytes): The payload.
+            incompressible (Optional[bool], optional): Whether the payload is stored as is,
+                detected with `looks_incompressible` if None. Defaults to None.
+
+        Returns:
+            bytes: The compressed payload.
+        """
+        if self.codec is None:
+            return compress.compress_bytes_to_bytes(compress.Algorithm.gzip, data)
+
+        if incompressible is None:
+            incompressible = looks_incompressible(data)
+        if len(data) >= self.min_size and not incompressible:
+            if self.dictionary is not None and len(data) <= dictionary_max_size:
+                codec_id = dictionary_codec_id
+                compressed = self._dictionary_compressor().compress(data)
+            else:
+                codec_id = self.codec.codec_id
+                compressed = self.codec.compress(data, self.level)
+            if len(compressed) < len(data):
+                return bytes([codec_id]) + compressed
+        return bytes([stored_codec_id]) + data
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Decompress a payload.
+
+        Parameters:
+            data (bytes): The compressed payload.
+
+        Returns:
+            bytes: The payload.
+
+        Raises:
+            ValueError: If the payload was compressed with a codec that isn't available.
+        """
+        if self.codec is None:
+            return compress.decompress_bytes_to_bytes(compress.Algorithm.gzip, data)
+
+        codec_id = data[0]
+        if codec_id == stored_codec_id:
+            return bytes(data[1:])
+        if codec_id == dictionary_codec_id and self.dictionary is not None:
+            return self._dictionary_decompressor().decompress(bytes(data[1:]))
+        if codec_id not in codecs_by_id:
+            raise ValueError(f"Unsupported compression codec {codec_id}")
+        return codecs_by_id[codec_id].decompress(bytes(data[1:]))
+
+    def _dictionary_compressor(self) -> "zstandard.ZstdCompressor":
+        """
+        Returns:
+            zstandard.ZstdCompressor: The compressor with the dictionary of the current thread.
+        """
+        if not hasattr(self.contexts, "compressor"):
+            self.contexts.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self.dictionary
+            )
+        return self.contexts.compressor
+
+    def _dictionary_decompressor(self) -> "zstandard.ZstdDecompressor":
+        """
+        Returns:
+            zstandard.ZstdDecompressor: The decompressor with the dictionary of the current thread.
+        """
+        if not hasattr(self.contexts, "decompressor"):
+            self.contexts.decompressor = zstandard.ZstdDecompressor(
+                dict_data=self.dictionary
+            )
+        return self.contexts.decompressor
+
+
+@lru_cache(maxsize=None)
+def _get_compression(
+    algorithm: Optional[str],
+    level: Optional[int],
+    min_size: int,
+    dictionary: Optional[int],
+) -> Compression:
+    return Compression(algorithm, level, min_size, dictionary)
+
+
+def get_compression(features: Json) -> Compression:
+    """
+    Get the compression of a connection out of its negotiated features.
+
+    Parameters:
+        features (Json): The features negotiated on the connection.
+
+    Returns:
+        Compression: The compression to use, the original gzip if none was negotiated.
+    """
+    accepted = features.get("compression")
+    if not isinstance(accepted, dict):
+        return _get_compression(None, None, default_min_size, None)
+    return _get_compression(
+        accepted["algorithm"],
+        accepted.get("level"),
+        accepted.get("minSize", default_min_size),
+        accepted.get("dictionary"),
+    )
@@ -0,0 +1,92 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+from gitgud_types import Json
+
+
+def cache_key(request: Json) -> str:
+    """
+    The key content of a request is cached under, the request without its per login and per request fields.
+
+    Parameters:
+        request (Json): The request that answers with file content.
+
+    Returns:
+        str: The key of the request.
+    """
+    return json.dumps(
+        {
+            k: v
+            for (k, v) in request.items()
+            if k not in ("connectionToken", "requestId", "have")
+        },
+        sort_keys=True,
+    )
+
+
+class ContentCache:
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        """
+        Initializes a new instance of the ContentCache class,
+        file content received from the server kept by the request that returned it, the content hash the server tagged it with
+        and the serialization structured content was encoded with ("fileFormat").
+        The hashes are sent with later requests so the server answers "notModified" instead of sending the content again.
+
+        Parameters:
+            max_size (int, optional): Most bytes of content kept, the least recently used content is dropped first. Defaults to 64 MiB.
+
+        Returns:
+            None
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.lock = Lock()
+        # Request key -> (Content hash, Content, File format)
+        self.entries: OrderedDict[str, Tuple[str, bytes, Optional[str]]] = OrderedDict()
+
+    def get(self, request: Json) -> Optional[Tuple[str, bytes, Optional[str]]]:
+        """
+        Get the cached content of a request.
+
+        Parameters:
+            request (Json): The request.
+
+        Returns:
+            Optional[Tuple[str, bytes, Optional[str]]]: The content hash, content and file format, None if nothing is cached.
+        """
+        key = cache_key(request)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(
+        self,
+        request: Json,
+        content_hash: str,
+        content: bytes,
+        file_format: Optional[str] = None,
+    ):
+        """
+        Cache the content returned by a request.
+
+        Parameters:
+            request (Json): The request.
+            content_hash (str): The hash the server tagged the content with.
+            content (bytes): The content.
+            file_format (Optional[str], optional): The serialization of structured content, None for plain files. Defaults to None.
+        """
+        if len(content) > self.max_size:
+            return
+        key = cache_key(request)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (content_hash, content, file_format)
+            self.size += len(content)
+            while self.size > self.max_size:
+                (_, (_, dropped, _)) = self.entries.popitem(last=False)
+                self.size -= len(dropped)
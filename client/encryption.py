@@ -1,22 +1,68 @@
 import base64
-import random
+import hashlib
 from typing import Optional, cast
 from cryptography.fernet import Fernet
+from gitgud_types import Json
+from key_exchange import ModPowKeyExchange
+from record_layer import RecordLayer
 
 
-def diffie_helman(num: int, g: int, p: int) -> int:
+def resumption_secret(key: bytes) -> bytes:
     """
-    Calculate the Diffie-Hellman key exchange using the given parameters.
+    Derive the secret of a resumption ticket from the key of a full key exchange, the server derives the same secret.
 
     Parameters:
-        num (int): The private key exponent.
-        g (int): The generator.
-        p (int): The prime modulus.
+        key (bytes): The shared key of the key exchange.
 
     Returns:
-        int: The calculated Diffie-Hellman key.
+        bytes: The resumption secret.
     """
-    return (g**num) % p
+    return hashlib.sha256(b"gitgud resumption" + key).digest()
+
+
+def resumed_key(secret: bytes, client_nonce: bytes, server_hello: bytes) -> bytes:
+    """
+    Derive the key of a resumed connection, unique to the connection through both the client's nonce and the server's hello.
+
+    Parameters:
+        secret (bytes): The resumption secret of the ticket.
+        client_nonce (bytes): The random nonce sent with the ticket.
+        server_hello (bytes): The initial public message the server sent on the connection.
+
+    Returns:
+        bytes: The 32 byte key of the connection.
+    """
+    return hashlib.sha256(secret + client_nonce + server_hello).digest()
+
+
+class ResumptionTicket:
+    def __init__(
+        self,
+        ticket: str,
+        secret: bytes,
+        cipher: Optional[str],
+        compression: Optional[Json],
+        serialization: Optional[str],
+    ):
+        """
+        Initializes a new instance of the ResumptionTicket class,
+        a ticket the server handed out after a full key exchange and the secret it protects.
+
+        Parameters:
+            ticket (str): The ticket, opaque to the client.
+            secret (bytes): The resumption secret derived from the key exchange.
+            cipher (Optional[str]): The cipher the server picked in the key exchange, offered alone when resuming.
+            compression (Optional[Json]): The compression the server picked in the key exchange, its algorithm is offered alone when resuming.
+            serialization (Optional[str]): The serialization the server picked in the key exchange, offered alone when resuming.
+
+        Returns:
+            None
+        """
+        self.ticket = ticket
+        self.secret = secret
+        self.cipher = cipher
+        self.compression = compression
+        self.serialization = serialization
 
 
 class EncryptionState:
@@ -28,7 +74,7 @@ class EncryptionState:
         """
         Initializes a new instance of the class.
 
-        This constructor sets the `p` attribute to `None`, the `g` attribute to `None`, the `secret_key` attribute to a random integer between 0 and 1000, the `encryption_key` attribute to `None`, and the `fernet` attribute to `None`.
+        This constructor sets the `p` attribute to `None`, the `g` attribute to `None`, the original modpow key exchange to `None` until the server sends its parameters, the `key` attribute to `None`, the `fernet` attribute to `None` and the features accepted by the server to none.
 
         Parameters:
             None
@@ -38,13 +84,20 @@ class EncryptionState:
         """
         self.p: Optional[int] = None
         self.g: Optional[int] = None
-        self.secret_key = random.randint(0, 1000)
-        self.encryption_key: Optional[int] = None
+        self.modpow_exchange: Optional[ModPowKeyExchange] = None
+        self.key: Optional[bytes] = None
         self.fernet: Fernet
+        self.features: Json = {}
+        self.server_mixed_key: Optional[int] = None
+        self.server_hello = b""
+        # Set on a resumed connection until the server's answer to the ticket was read
+        self.awaiting_accept = False
+        # Replaces Fernet when the server accepted a cipher
+        self.record_layer: Optional[RecordLayer] = None
 
     def encrypt(self, data: bytes) -> bytes:
         """
-        Encrypts the given data using the Fernet encryption algorithm.
+        Encrypts the given data using the negotiated record layer, or the Fernet encryption algorithm if there is none.
 
         Parameters:
             data (bytes): The data to be encrypted.
@@ -52,11 +105,13 @@ class EncryptionState:
         Returns:
             bytes: The encrypted data.
         """
+        if self.record_layer is not None:
+            return self.record_layer.seal(data)
         return self.fernet.encrypt(data)
 
     def decrypt(self, data: bytes) -> bytes:
         """
-        Decrypts the given data using the Fernet encryption algorithm.
+        Decrypts the given data using the negotiated record layer, or the Fernet encryption algorithm if there is none.
 
         Args:
             data (bytes): The data to be decrypted.
@@ -64,19 +119,35 @@ class EncryptionState:
         Returns:
             bytes: The decrypted data.
         """
+        if self.record_layer is not None:
+            return self.record_layer.open(data)
         return self.fernet.decrypt(data)
 
+    def start_record_layer(self):
+        """
+        Switch from Fernet to the record layer if the server accepted a cipher, call once the features and the key are set.
+        """
+        if "cipher" in self.features:
+            self.record_layer = RecordLayer(
+                self.features["cipher"], cast(bytes, self.key), False
+            )
+
+    def set_key(self, key: bytes):
+        """
+        Set the key shared with the server by a key exchange.
+
+        Parameters:
+            key (bytes): The 32 byte shared key.
+        """
+        self.key = key
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+
     def set_encryption_key(self, server_mixed_key_bytes: int):
         """
         Set S value on server based on client mixed key
         """
-        self.encryption_key = diffie_helman(
-            self.secret_key, server_mixed_key_bytes, cast(int, self.p)
-        )
-        key = base64.urlsafe_b64encode(
-            self.encryption_key.to_bytes(32, byteorder="big")
-        )
-        self.fernet = Fernet(key)
+        modpow_exchange = cast(ModPowKeyExchange, self.modpow_exchange)
+        self.set_key(modpow_exchange.shared_key(str(server_mixed_key_bytes)))
 
     def parse_initial_message(self, data: str):
         """
@@ -91,10 +162,37 @@ class EncryptionState:
         [mixed_key, p, g] = data.split(";")
         self.p = int(p)
         self.g = int(g)
-        self.set_encryption_key(int(mixed_key))
+        self.modpow_exchange = ModPowKeyExchange(self.p, self.g)
+        self.server_mixed_key = int(mixed_key)
+        self.server_hello = data.encode()
+
+    def exchange_keys(self):
+        """
+        Derive the key from the server's mixed key received in the initial message.
+        """
+        self.set_encryption_key(cast(int, self.server_mixed_key))
+
+    def resume(self, ticket: ResumptionTicket, nonce: bytes):
+        """
+        Derive the key from a resumption ticket instead of the key exchange.
+
+        Parameters:
+            ticket (ResumptionTicket): The ticket of an earlier connection.
+            nonce (bytes): A random nonce, sent to the server with the ticket.
+        """
+        self.set_key(resumed_key(ticket.secret, nonce, self.server_hello))
+
+    def get_resumption_secret(self) -> bytes:
+        """
+        Get the secret of the ticket the server hands out after this key exchange.
+
+        Returns:
+            bytes: The resumption secret.
+        """
+        return resumption_secret(cast(bytes, self.key))
 
     def get_mixed_key(self):
         """
         Get public A from private a
         """
-        return diffie_helman(self.secret_key, cast(int, self.g), cast(int, self.p))
+        return int(cast(ModPowKeyExchange, self.modpow_exchange).public_key())
@@ -0,0 +1,109 @@
+import socket
+import struct
+from typing import Tuple
+
+# Length of the payload (u32), kind of frame (u8), id of the request the frame belongs to, 0 when unused (u32)
+frame_header = struct.Struct(">IBI")
+max_frame_size = 256 * 1024 * 1024
+
+frame_message = 1
+# File content streamed after a response, each chunk is compressed and encrypted on its own
+frame_stream_chunk = 2
+frame_stream_end = 3
+stream_chunk_size = 64 * 1024
+
+
+def recv_exact(soc: socket.socket, length: int) -> bytearray:
+    """
+    Receives exactly `length` bytes from a socket into a preallocated buffer, looping over short reads.
+
+    Parameters:
+        soc (socket.socket): The socket to receive data from.
+        length (int): The number of bytes to receive.
+
+    Returns:
+        bytearray: The data received from the socket.
+
+    Raises:
+        ConnectionError: If the connection is closed before all the data arrived.
+    """
+    data = bytearray(length)
+    view = memoryview(data)
+    received = 0
+    while received < length:
+        received_now = soc.recv_into(view[received:], length - received)
+        if received_now == 0:
+            raise ConnectionError("Connection closed")
+        received += received_now
+    return data
+
+
+def pack_frame_header(kind: int, length: int, request_id: int = 0) -> bytes:
+    """
+    Packs the binary header of a frame.
+
+    Parameters:
+        kind (int): The kind of the frame.
+        length (int): The length of the payload of the frame.
+        request_id (int, optional): The request the frame belongs to. Defaults to 0.
+
+    Returns:
+        bytes: The header.
+
+    Raises:
+        ValueError: If the payload is larger than a frame allows.
+    """
+    if length > max_frame_size:
+        raise ValueError("Frame too large")
+    return frame_header.pack(length, kind, request_id)
+
+
+def unpack_frame_header(header: bytes) -> Tuple[int, int, int]:
+    """
+    Unpacks the binary header of a frame.
+
+    Parameters:
+        header (bytes): The header, `frame_header.size` bytes long.
+
+    Returns:
+        Tuple[int, int, int]: The kind, request id and payload length of the frame.
+
+    Raises:
+        ValueError: If the frame is larger than a frame allows.
+    """
+    (length, kind, request_id) = frame_header.unpack(header)
+    if length > max_frame_size:
+        raise ValueError("Frame too large")
+    return (kind, request_id, length)
+
+
+def send_frame(soc: socket.socket, kind: int, data: bytes, request_id: int = 0):
+    """
+    Sends a frame over a socket.
+
+    Parameters:
+        soc (socket.socket): The socket to send the frame over.
+        kind (int): The kind of the frame.
+        data (bytes): The payload of the frame.
+        request_id (int, optional): The request the frame belongs to. Defaults to 0.
+
+    Returns:
+        None
+    """
+    soc.sendall(pack_frame_header(kind, len(data), request_id) + data)
+
+
+def recv_frame(soc: socket.socket) -> Tuple[int, int, bytes]:
+    """
+    Receives a frame from a socket.
+
+    Parameters:
+        soc (socket.socket): The socket to receive the frame from.
+
+    Returns:
+        Tuple[int, int, bytes]: The kind, request id and payload of the frame.
+    """
+    (kind, request_id, length) = unpack_frame_header(
+        recv_exact(soc, frame_header.size)
+    )
+    return (kind, request_id, bytes(recv_exact(soc, length)))
@@ -3,3 +3,5 @@ from typing import Dict, Any, Tuple, Callable
 Json = Dict[str, Any]
 Address = Tuple[str, int]
 Action = Callable[[Json], Json]
+# Bytes received so far and the total of a transfer, returns False to cancel it
+ProgressCallback = Callable[[int, int], bool]
@@ -5,8 +5,7 @@ from typing import Callable, List, cast
 from base_screen import BaseScreen
 from gui.diff import Diff
 from gitgud_types import Json
-from gui_run_request import gui_request_file
-import json
+from gui_run_request import gui_request_value
 
 from client_protocol import Commit, pack_diff
 from main import MainFrame
@@ -96,10 +95,10 @@ class Commits(BaseScreen):
 
         commit = cast(Commit, self.commits[index])
 
-        def on_finished(diff: bytes):
+        def on_finished(diff: Json):
             self.GetParent().push_screen(lambda: Diff(self.GetParent(), diff))
 
-        gui_request_file(
+        gui_request_value(
             self,
             pack_diff(self.repo, self.connection_token, commit["hash"]),
             on_finished,
@@ -117,14 +116,14 @@ class Commits(BaseScreen):
         Returns:
             None
         """
-        def on_finished(result: bytes):
+        def on_finished(result: Json):
 
-            commits = cast(List[Commit], json.loads(result)["commits"])
+            commits = cast(List[Commit], result["commits"])
             self.commits = commits
             self.commits_list.Clear()
             self.commits_list.Append(commits_as_str(commits))
 
-        gui_request_file(
+        gui_request_value(
             self,
             self.pack_request(self.page),
             on_finished,
@@ -6,17 +6,16 @@ import wx.richtext
 from base_screen import BaseScreen
 from gitgud_types import Json
 from main import MainFrame
-import json
 
 
 class Diff(BaseScreen):
-    def __init__(self, parent: MainFrame, diff: bytes):
+    def __init__(self, parent: MainFrame, diff: Json):
         """
         Initializes a new instance of the Diff class.
 
         Args:
             parent (MainFrame): The parent frame of the Diff.
-            diff (bytes): The diff data.
+            diff (Json): The diff data, decoded.
 
         Initializes the Diff with the given parent frame and diff data.
         Sets the diff attribute to the provided diff data.
@@ -30,10 +29,7 @@ class Diff(BaseScreen):
     @override
     def add_children(self, main_sizer):
 
-        try:
-            diff: Optional[Json] = json.loads(self.diff.decode())
-        except (UnicodeDecodeError, ValueError, json.JSONDecodeError):
-            diff: Optional[Json] = None
+        diff = self.diff
 
         self.diff_richtextctrl = wx.richtext.RichTextCtrl(
             self, style=wx.VSCROLL | wx.HSCROLL | wx.NO_BORDER
@@ -7,7 +7,7 @@ from gitgud_types import Json
 from gui.commits import Commits
 from gui.diff import Diff
 from gui.pr_editor import PullRequestEditor
-from gui_run_request import gui_request_file, gui_run_request
+from gui_run_request import gui_request_value, gui_run_request
 
 from client_protocol import (
     PullRequest,
@@ -134,10 +134,10 @@ class PullRequests(BaseScreen):
         pr_index: int = self.pr_list.GetSelection()
         pr = self.prs[pr_index]
 
-        def on_finished(diff: bytes):
+        def on_finished(diff: Json):
             self.GetParent().push_screen(lambda: Diff(self.GetParent(), diff))
 
-        gui_request_file(
+        gui_request_value(
             self, pack_pull_request_diff(pr["id"], self.connection_token), on_finished
         )
 
@@ -1,32 +1,108 @@
-from typing import Callable, cast
+from typing import Any, Callable, List, Optional, cast
 from base_screen import BaseScreen
+from client_comm import TransferCancelled, decode_file
 from gitgud_types import Json
-from threading import Thread
+from threading import Event, Thread
 import wx
 
+# Smaller transfers finish before a progress dialog is worth showing
+progress_dialog_min_size = 1024 * 1024
+
 
 def gui_request_file(
     panel: BaseScreen, request: Json, on_finished: Callable[[bytes], None]
 ):
     """
     A function that sends a file request to the GUI, runs the request, and calls the on_finished callback with the file content.
+    Transfers larger than `progress_dialog_min_size` show a progress dialog that can cancel them.
 
     Parameters:
         panel (BaseScreen): The panel to send the request.
         request (Json): The request to send.
         on_finished (Callable[[bytes], None]): The callback function to call with the file content.
     """
+    run_file_request(panel, request, lambda _, content: content, on_finished)
+
+
+def gui_request_value(
+    panel: BaseScreen, request: Json, on_finished: Callable[[Any], None]
+):
+    """
+    Like `gui_request_file` for requests answering with structured content (commits, diffs...),
+    the content is decoded with the serialization it was sent in before calling on_finished.
+
+    Parameters:
+        panel (BaseScreen): The panel to send the request.
+        request (Json): The request to send.
+        on_finished (Callable[[Any], None]): The callback function to call with the decoded content.
+    """
+    run_file_request(panel, request, decode_file, on_finished)
+
 
+def run_file_request(
+    panel: BaseScreen,
+    request: Json,
+    decode: Callable[[Json, bytes], Any],
+    on_finished: Callable[[Any], None],
+):
+    """
+    Run a file request on a thread of its own, showing a progress dialog for large transfers.
+
+    Parameters:
+        panel (BaseScreen): The panel to send the request.
+        request (Json): The request to send.
+        decode (Callable[[Json, bytes], Any]): Turns the response and the file content into what on_finished gets, runs on the request's thread.
+        on_finished (Callable[[Any], None]): The callback function to call on the GUI thread.
+    """
     parent = panel.GetParent()
+    cancelled = Event()
+    dialog: Optional[wx.ProgressDialog] = None
+
+    def update_dialog(received: int, total: int):
+        # Runs on the GUI thread
+        nonlocal dialog
+        if cancelled.is_set():
+            return
+        if dialog is None:
+            dialog = wx.ProgressDialog(
+                "Downloading",
+                "Receiving file...",
+                maximum=total,
+                parent=parent,
+                style=wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME,
+            )
+        (keep_going, _) = dialog.Update(min(received, total))
+        if not keep_going:
+            cancelled.set()
+
+    def close_dialog():
+        if dialog is not None:
+            dialog.Destroy()
+
+    def on_progress(received: int, total: int) -> bool:
+        if total >= progress_dialog_min_size:
+            wx.CallAfter(update_dialog, received, total)
+        return not cancelled.is_set()
 
     def run_request(request: Json):
-        result = parent.client_com.run_request(request)
-        if "error" in result:
-            wx.CallAfter(wx.MessageBox, f"Error: {result['error']}")
+        try:
+            (result, file_content) = parent.client_com.run_file_request(
+                request, on_progress
+            )
+        except TransferCancelled:
+            return
+        finally:
+            wx.CallAfter(close_dialog)
+        if "error" in result or file_content is None:
+            wx.CallAfter(wx.MessageBox, f"Error: {result.get('error')}")
+            return
+        try:
+            value = decode(result, file_content)
+        except ValueError as e:
+            wx.CallAfter(wx.MessageBox, f"Error: Invalid response {e}")
             return
 
-        file_content = parent.client_com.file_request(result["token"], result["port"])
-        wx.CallAfter(on_finished, file_content)
+        wx.CallAfter(on_finished, value)
 
     Thread(target=run_request, args=(request,)).start()
 
@@ -58,3 +134,29 @@ def gui_run_request(
             wx.CallAfter(on_finished, result)
 
     Thread(target=run_request, args=(request,)).start()
+
+
+def gui_run_batch(
+    panel: BaseScreen,
+    batch: Json,
+    on_finished: Callable[[List[Json]], None],
+    message_box_error=True,
+):
+    """
+    Run many requests in one round trip (`pack_batch`) in a GUI environment and handle the responses asynchronously.
+
+    Parameters:
+        panel (BaseScreen): The screen panel where the requests will be executed.
+        batch (Json): The batch request, packed by `pack_batch`.
+        on_finished (Callable[[List[Json]], None]): A callback function to handle the responses of the requests in order,
+        a failed request's response has an "error" key.
+        message_box_error (bool, optional): A flag to show an error message in a message box when the whole batch fails. Defaults to True.
+    """
+
+    def on_batch_finished(result: Json):
+        if "error" in result:
+            on_finished([result] * len(batch["requests"]))
+        else:
+            on_finished(result["responses"])
+
+    gui_run_request(panel, batch, on_batch_finished, message_box_error)
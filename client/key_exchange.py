@@ -0,0 +1,144 @@
+import base64
+import random
+from typing import Dict, Optional, Type
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import (
+    X25519PrivateKey,
+    X25519PublicKey,
+)
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+def diffie_helman(num: int, g: int, p: int) -> int:
+    """
+    Calculate the Diffie-Hellman key exchange using the given parameters.
+
+    Parameters:
+        num (int): The private key exponent.
+        g (int): The generator.
+        p (int): The prime modulus.
+
+    Returns:
+        int: The calculated Diffie-Hellman key.
+    """
+    # Reduces modulo p on every step instead of building g**num first
+    return pow(g, num, p)
+
+
+class KeyExchange:
+    """
+    A key exchange backend, one instance per connection holding its private key.
+    """
+
+    name = ""
+    cached_public_key: Optional[str] = None
+
+    def public_key(self) -> str:
+        """
+        Returns:
+            str: The public key to send to the peer, computed once.
+        """
+        if self.cached_public_key is None:
+            self.cached_public_key = self.compute_public_key()
+        return self.cached_public_key
+
+    def compute_public_key(self) -> str:
+        """
+        Returns:
+            str: The public key to send to the peer.
+        """
+        raise NotImplementedError
+
+    def shared_key(self, peer_public_key: str) -> bytes:
+        """
+        Derive the key shared with the peer.
+
+        Parameters:
+            peer_public_key (str): The public key the peer sent.
+
+        Returns:
+            bytes: The 32 byte shared key.
+        """
+        raise NotImplementedError
+
+
+class ModPowKeyExchange(KeyExchange):
+    """
+    https://en.wikipedia.org/wiki/Diffie%E2%80%93Hellman_key_exchange
+    Kept for the original protocol's parameters, used with servers that don't accept another key exchange.
+    """
+
+    name = "modpow"
+
+    def __init__(self, p: int, g: int):
+        """
+        Initializes a new instance of the ModPowKeyExchange class.
+
+        Parameters:
+            p (int): The prime modulus.
+            g (int): The generator.
+
+        Returns:
+            None
+        """
+        self.p = p
+        self.g = g
+        self.secret_key = random.randint(0, 1000)
+
+    def compute_public_key(self) -> str:
+        """
+        Get public A from private a, as a decimal integer
+        """
+        return str(diffie_helman(self.secret_key, self.g, self.p))
+
+    def shared_key(self, peer_public_key: str) -> bytes:
+        """
+        Get S from the peer's public B, as 32 big endian bytes
+        """
+        shared = diffie_helman(self.secret_key, int(peer_public_key), self.p)
+        return shared.to_bytes(32, byteorder="big")
+
+
+class X25519KeyExchange(KeyExchange):
+    """
+    https://en.wikipedia.org/wiki/Curve25519
+    """
+
+    name = "x25519"
+
+    def __init__(self):
+        """
+        Initializes a new instance of the X25519KeyExchange class with a new private key.
+
+        Returns:
+            None
+        """
+        self.private_key = X25519PrivateKey.generate()
+
+    def compute_public_key(self) -> str:
+        """
+        Get the raw 32 byte public key, url safe base64 encoded
+        """
+        public_bytes = self.private_key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        return base64.urlsafe_b64encode(public_bytes).decode()
+
+    def shared_key(self, peer_public_key: str) -> bytes:
+        """
+        Run X25519 with the peer's key and derive the shared key from the result with HKDF-SHA256
+        """
+        peer = X25519PublicKey.from_public_bytes(
+            base64.urlsafe_b64decode(peer_public_key)
+        )
+        shared = self.private_key.exchange(peer)
+        return HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"gitgud x25519"
+        ).derive(shared)
+
+
+# Backends the client can offer by name, the original modpow exchange is used when none is accepted
+key_exchanges: Dict[str, Type[KeyExchange]] = {
+    X25519KeyExchange.name: X25519KeyExchange,
+}
@@ -13,7 +13,7 @@ if __name__ == "__main__":
     port = int(cast(str, os.getenv("SERVER_PORT")))
     ip = cast(str, os.getenv("SERVER_IP"))
 
-    client_com = ClientComm((ip, port))
+    client_com = ClientComm((ip, port), session=True)
 
     app = wx.App(False)
 
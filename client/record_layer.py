@@ -0,0 +1,115 @@
+from threading import Lock
+from typing import Callable, Dict, List, Union
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+Cipher = Union[AESGCM, ChaCha20Poly1305]
+
+# Name -> Cipher, in order of preference
+ciphers: Dict[str, Callable[[bytes], Cipher]] = {
+    "aesgcm": AESGCM,
+    "chacha20poly1305": ChaCha20Poly1305,
+}
+supported_ciphers: List[str] = list(ciphers)
+
+nonce_size = 12
+max_records = 2**64
+
+
+def direction_key(key: bytes, direction: bytes) -> bytes:
+    """
+    Derive the key of one direction of a connection, so both directions can count their nonces from 0.
+
+    Parameters:
+        key (bytes): The key shared by the client and the server.
+        direction (bytes): b"client" for records sent by the client, b"server" for records sent by the server.
+
+    Returns:
+        bytes: The 32 byte key of the direction.
+    """
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"gitgud record layer " + direction,
+    ).derive(key)
+
+
+class RecordLayer:
+    def __init__(self, cipher: str, key: bytes, is_server: bool):
+        """
+        Initializes a new instance of the RecordLayer class.
+        Every message is sealed as one AEAD record, the ciphertext followed by a 16 byte tag.
+        The nonce is a counter of the records sent in each direction and isn't sent,
+        records have to be opened in the order they were sealed,
+        so callers seal and send under one lock and open in the order records arrive.
+
+        Parameters:
+            cipher (str): The name of the negotiated cipher, one of `ciphers`.
+            key (bytes): The key shared by the client and the server.
+            is_server (bool): True on the server side of the connection.
+
+        Returns:
+            None
+        """
+        (send_direction, receive_direction) = (
+            (b"server", b"client") if is_server else (b"client", b"server")
+        )
+        self.sealer = ciphers[cipher](direction_key(key, send_direction))
+        self.opener = ciphers[cipher](direction_key(key, receive_direction))
+        self.lock = Lock()
+        self.sent = 0
+        self.received = 0
+
+    def seal(self, data: bytes) -> bytes:
+        """
+        Encrypt and authenticate a record with the next send nonce.
+
+        Parameters:
+            data (bytes): The plaintext.
+
+        Returns:
+            bytes: The ciphertext and tag.
+        """
+        with self.lock:
+            nonce = self._next_nonce(self.sent)
+            self.sent += 1
+        return self.sealer.encrypt(nonce, data, None)
+
+    def open(self, data: bytes) -> bytes:
+        """
+        Decrypt and verify a record with the next receive nonce.
+
+        Parameters:
+            data (bytes): The ciphertext and tag.
+
+        Returns:
+            bytes: The plaintext.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If the record was tampered with, replayed or reordered.
+        """
+        with self.lock:
+            nonce = self._next_nonce(self.received)
+            self.received += 1
+        return self.opener.decrypt(nonce, data, None)
+
+    @staticmethod
+    def _next_nonce(counter: int) -> bytes:
+        """
+        Build the nonce of a record from its counter.
+
+        Parameters:
+            counter (int): The number of records before it in the same direction.
+
+        Returns:
+            bytes: The nonce.
+
+        Raises:
+            OverflowError: If the connection sent more records than nonces exist.
+        """
+        if counter >= max_records:
+            raise OverflowError("Record counter exhausted, reconnect")
+        return counter.to_bytes(nonce_size, byteorder="big")
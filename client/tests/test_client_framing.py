@@ -0,0 +1,124 @@
+import socket
+from threading import Thread
+from typing import Dict, List
+
+import pytest
+
+import framing
+from client_comm import ClientSession, compress_message, decompress_message
+from compression import get_compression
+from framing import (
+    frame_header,
+    frame_message,
+    frame_stream_chunk,
+    frame_stream_end,
+    pack_frame_header,
+    recv_frame,
+    send_frame,
+)
+from gitgud_types import Json
+
+
+def test_round_trip():
+    a, b = socket.socketpair()
+    with a, b:
+        send_frame(a, frame_message, b"request", 9)
+        send_frame(a, frame_stream_end, b"")
+        assert recv_frame(b) == (frame_message, 9, b"request")
+        assert recv_frame(b) == (frame_stream_end, 0, b"")
+
+
+def test_rejects_frames_over_max_size(monkeypatch):
+    monkeypatch.setattr(framing, "max_frame_size", 10)
+    with pytest.raises(ValueError):
+        pack_frame_header(frame_message, 11)
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(frame_header.pack(11, frame_message, 0))
+        with pytest.raises(ValueError):
+            recv_frame(b)
+
+
+def test_truncated_header():
+    a, b = socket.socketpair()
+    with b:
+        a.sendall(pack_frame_header(frame_message, 4)[:3])
+        a.close()
+        with pytest.raises(ConnectionError):
+            recv_frame(b)
+
+
+class PlainEncryption:
+    """
+    An encryption state that doesn't encrypt, the session only needs its features.
+    """
+
+    features: Json = {"session": True, "framing": "binary"}
+
+    def encrypt(self, data: bytes) -> bytes:
+        return data
+
+    def decrypt(self, data: bytes) -> bytes:
+        return data
+
+
+def test_session_matches_responses_to_requests_by_id():
+    client, server = socket.socketpair()
+    features = PlainEncryption.features
+    session = ClientSession(client, PlainEncryption(), timeout=5)  # type: ignore
+    results: Dict[str, object] = {}
+
+    def request(name: str):
+        results[name] = session.request({"type": name})
+
+    threads = [Thread(target=request, args=(name,)) for name in ("a", "b", "c")]
+    for thread in threads:
+        thread.start()
+
+    requests: List[Json] = []
+    for _ in threads:
+        kind, _, data = recv_frame(server)
+        assert kind == frame_message
+        requests.append(decompress_message(data, features))
+    ids = {r["type"]: r["requestId"] for r in requests}
+    assert len(set(ids.values())) == 3
+
+    # Answered out of order, "b" streams file content in two chunks interleaved with the other responses
+    file = b"0123456789" * 1000
+    compression = get_compression(features)
+    send_frame(
+        server,
+        frame_message,
+        compress_message(
+            {"type": "b", "stream": True, "size": len(file), "requestId": ids["b"]},
+            features,
+        ),
+    )
+    send_frame(
+        server,
+        frame_stream_chunk,
+        compression.compress(file[:4000], incompressible=False),
+        ids["b"],
+    )
+    for name in ("c", "a"):
+        send_frame(
+            server,
+            frame_message,
+            compress_message({"type": name, "requestId": ids[name]}, features),
+        )
+    send_frame(
+        server,
+        frame_stream_chunk,
+        compression.compress(file[4000:], incompressible=False),
+        ids["b"],
+    )
+    send_frame(server, frame_stream_end, b"", ids["b"])
+
+    for thread in threads:
+        thread.join(5)
+    assert results["a"] == ({"type": "a", "requestId": ids["a"]}, None)
+    assert results["c"] == ({"type": "c", "requestId": ids["c"]}, None)
+    response, content = results["b"]  # type: ignore
+    assert response["type"] == "b" and bytes(content) == file
+    session.close()
+    server.close()
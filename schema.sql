@@ -132,6 +132,20 @@ ALTER SEQUENCE public."Repository_id_seq" OWNER TO postgres;
 ALTER SEQUENCE public."Repository_id_seq" OWNED BY public."Repository".id;
 
 
+--
+-- Name: Session; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public."Session" (
+    token text NOT NULL,
+    username text NOT NULL,
+    expires_at timestamp with time zone NOT NULL
+);
+
+
+ALTER TABLE public."Session" OWNER TO postgres;
+
+
 --
 -- Name: User; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -247,6 +261,14 @@ ALTER TABLE ONLY public."Repository"
     ADD CONSTRAINT "Repository_pkey" PRIMARY KEY (id);
 
 
+--
+-- Name: Session Session_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public."Session"
+    ADD CONSTRAINT "Session_pkey" PRIMARY KEY (token);
+
+
 --
 -- Name: User User_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -269,6 +291,13 @@ CREATE UNIQUE INDEX "Repository_user_id_name_idx" ON public."Repository" USING b
 CREATE UNIQUE INDEX branches ON public."PullRequest" USING btree (repo_id, from_branch, into_branch);
 
 
+--
+-- Name: session_expires_at; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX session_expires_at ON public."Session" USING btree (expires_at);
+
+
 --
 -- Name: username; Type: INDEX; Schema: public; Owner: postgres
 --
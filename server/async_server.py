@@ -0,0 +1,341 @@
+import asyncio
+from time import monotonic
+from typing import Optional, Set, Tuple
+
+from encryption import EncryptionState
+from framing import (
+    async_recv_frame,
+    async_send_frame,
+    frame_message,
+    frame_stream_chunk,
+    frame_stream_end,
+)
+from gitgud_types import Address, Json
+from server_comm import (
+    compress_message,
+    decompress_bytes,
+    encryption_length_size,
+    regular_length_size,
+    session_length_size,
+    stream_chunks,
+    stream_request_id,
+)
+from server_logic import ServerLogic
+from tracing import Trace, activate
+
+
+async def read_message(reader: asyncio.StreamReader, length_size: int) -> bytes:
+    """
+    Reads a message prefixed by its zero padded decimal length from a stream.
+
+    Parameters:
+        reader (asyncio.StreamReader): The stream to read from.
+        length_size (int): The size of the length prefix.
+
+    Returns:
+        bytes: The message without the length prefix.
+
+    Raises:
+        asyncio.IncompleteReadError: If the stream is closed before the whole message arrived.
+        ValueError: If the length prefix is not a valid integer.
+    """
+    length_of_data = int((await reader.readexactly(length_size)).decode())
+    return await reader.readexactly(length_of_data)
+
+
+async def write_message(writer: asyncio.StreamWriter, data: bytes, length_size: int):
+    """
+    Writes a message to a stream prefixed by its zero padded decimal length.
+
+    Parameters:
+        writer (asyncio.StreamWriter): The stream to write to.
+        data (bytes): The message to write.
+        length_size (int): The size of the length prefix.
+
+    Returns:
+        None
+    """
+    length_bytes = str(len(data)).zfill(length_size).encode()
+    writer.write(length_bytes + data)
+    await writer.drain()
+
+
+async def read_request(
+    reader: asyncio.StreamReader, encryption: EncryptionState, length_size: int
+) -> bytes:
+    """
+    Reads an encrypted request from a stream,
+    in a binary frame if the client negotiated binary framing and with a decimal length prefix otherwise.
+
+    Parameters:
+        reader (asyncio.StreamReader): The stream to read from.
+        encryption (EncryptionState): The encryption state of the connection, holding the negotiated features.
+        length_size (int): The size of the decimal length prefix.
+
+    Returns:
+        bytes: The encrypted request.
+    """
+    if encryption.features.get("framing") != "binary":
+        return await read_message(reader, length_size)
+
+    (kind, _, data) = await async_recv_frame(reader)
+    if kind != frame_message:
+        raise ValueError("Unexpected frame kind")
+    return data
+
+
+async def write_response(
+    writer: asyncio.StreamWriter,
+    encryption: EncryptionState,
+    data: bytes,
+    length_size: int,
+):
+    """
+    Writes an encrypted response to a stream,
+    in a binary frame if the client negotiated binary framing and with a decimal length prefix otherwise.
+
+    Parameters:
+        writer (asyncio.StreamWriter): The stream to write to.
+        encryption (EncryptionState): The encryption state of the connection, holding the negotiated features.
+        data (bytes): The encrypted response.
+        length_size (int): The size of the decimal length prefix.
+
+    Returns:
+        None
+    """
+    if encryption.features.get("framing") == "binary":
+        await async_send_frame(writer, frame_message, data)
+    else:
+        await write_message(writer, data, length_size)
+
+
+class AsyncServer:
+    def __init__(self, logic: ServerLogic):
+        """
+        Initializes a new instance of the AsyncServer class.
+
+        Connections, key exchange, framing and decompression all run as coroutines on one event loop,
+        only `ServerLogic.handle_request` (git and database work) runs on the worker pool of its lane.
+
+        Parameters:
+            logic (ServerLogic): The logic that handles the requests, created with listen=False.
+
+        Returns:
+            None
+        """
+        self.logic = logic
+        self.handshake_timeout = 10
+        # Connections being served, read by the metrics exporter
+        self.open_connections = 0
+
+    async def serve(self, port: int):
+        """
+        Listen on a port and serve clients until cancelled.
+
+        Parameters:
+            port (int): The port number to listen on.
+
+        Returns:
+            None
+        """
+        server = await asyncio.start_server(self._handle_client, "0.0.0.0", port)
+        async with server:
+            await server.serve_forever()
+
+    async def _exchange_keys(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> EncryptionState:
+        """
+        Run the server side of the key exchange on a new connection.
+
+        Parameters:
+            reader (asyncio.StreamReader): The stream of the client.
+            writer (asyncio.StreamWriter): The stream to the client.
+
+        Returns:
+            EncryptionState: The encryption state after the key exchange.
+        """
+        encryption = EncryptionState()
+        await write_message(
+            writer, encryption.get_initial_public_message(), encryption_length_size
+        )
+        encryption_response = await read_message(reader, encryption_length_size)
+        encryption.set_encryption_key(encryption_response)
+        accept_message = encryption.get_accept_message()
+        if accept_message is not None:
+            await write_message(writer, accept_message, encryption_length_size)
+        return encryption
+
+    def _decrypt_request(
+        self, data: bytes, encryption: EncryptionState
+    ) -> Tuple[bytes, Trace]:
+        """
+        Decrypt and decompress a request, starting its trace.
+
+        Parameters:
+            data (bytes): The encrypted request.
+            encryption (EncryptionState): The encryption state of the connection.
+
+        Returns:
+            Tuple[bytes, Trace]: The request and its trace.
+        """
+        trace = Trace()
+        with trace.span("decrypt"):
+            decrypted = encryption.decrypt(data)
+        with trace.span("decompress"):
+            request = decompress_bytes(decrypted, encryption.features)
+        return (request, trace)
+
+    async def _run_request(
+        self,
+        request: bytes,
+        trace: Trace,
+        writer: asyncio.StreamWriter,
+        encryption: EncryptionState,
+        write_lock: asyncio.Lock,
+        length_size: int,
+    ):
+        """
+        Run a request on the worker pool of its lane and write back its response,
+        followed by the stream of file content when the client negotiated inline streams.
+        Records are encrypted while holding the write lock, they have to be sent in the order they were encrypted.
+
+        Parameters:
+            request (bytes): The decrypted and decompressed request.
+            trace (Trace): The trace of the request, counted in the latency stats once the response is sent.
+            writer (asyncio.StreamWriter): The stream to the client.
+            encryption (EncryptionState): The encryption state of the connection.
+            write_lock (asyncio.Lock): Lock keeping responses of one connection from interleaving.
+            length_size (int): The size of the length prefix of the response.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+
+        def handle_request() -> Tuple[Json, Optional[bytes]]:
+            with activate(trace):
+                trace.dequeued()
+                return self.logic.handle_request(request, encryption.features)
+
+        trace.queued_at = monotonic()
+        (response, file) = await loop.run_in_executor(
+            self.logic.lane_of(request, encryption.features), handle_request
+        )
+
+        with trace.span("compress"):
+            compressed_response = compress_message(response, encryption.features)
+        async with write_lock:
+            with trace.span("encrypt"):
+                data_to_send = encryption.encrypt(compressed_response)
+            with trace.span("send"):
+                await write_response(writer, encryption, data_to_send, length_size)
+        if file is None:
+            self.logic.latency_stats.finish(trace)
+            return
+
+        with trace.span("stream"):
+            # Compressing a large file would stall the event loop
+            chunks = await loop.run_in_executor(
+                None, lambda: list(stream_chunks(file, encryption.features))
+            )
+            request_id = stream_request_id(response)
+            for chunk in chunks:
+                async with write_lock:
+                    encrypted_chunk = encryption.encrypt(chunk)
+                    await async_send_frame(
+                        writer, frame_stream_chunk, encrypted_chunk, request_id
+                    )
+            async with write_lock:
+                await async_send_frame(writer, frame_stream_end, b"", request_id)
+        self.logic.latency_stats.finish(trace)
+
+    async def _run_session_request(
+        self,
+        request: bytes,
+        trace: Trace,
+        writer: asyncio.StreamWriter,
+        encryption: EncryptionState,
+        write_lock: asyncio.Lock,
+    ):
+        """
+        Run a request received over a session, closing the session if it fails.
+        A request that fails before its response is sent has no other way to fail the client's waiting request.
+
+        Parameters:
+            request (bytes): The decrypted and decompressed request.
+            trace (Trace): The trace of the request.
+            writer (asyncio.StreamWriter): The stream to the client.
+            encryption (EncryptionState): The encryption state of the connection.
+            write_lock (asyncio.Lock): Lock keeping responses of one connection from interleaving.
+
+        Returns:
+            None
+        """
+        try:
+            await self._run_request(
+                request, trace, writer, encryption, write_lock, session_length_size
+            )
+        except Exception as e:
+            print(
+                f"[trace {trace.trace_id}] Disconnecting {writer.get_extra_info('peername')}",
+                e,
+            )
+            writer.close()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """
+        Serve a single connection: key exchange, then a single request and close,
+        or when a session was negotiated, requests until the client hangs up.
+        Session requests run concurrently and their responses are sent as they finish.
+
+        Parameters:
+            reader (asyncio.StreamReader): The stream of the client.
+            writer (asyncio.StreamWriter): The stream to the client.
+
+        Returns:
+            None
+        """
+        addr: Optional[Address] = writer.get_extra_info("peername")
+        write_lock = asyncio.Lock()
+        requests: Set[asyncio.Task] = set()
+        self.open_connections += 1
+        try:
+            encryption = await asyncio.wait_for(
+                self._exchange_keys(reader, writer), self.handshake_timeout
+            )
+            if not encryption.features.get("session"):
+                data_bytes = await read_request(reader, encryption, regular_length_size)
+                (request, trace) = self._decrypt_request(data_bytes, encryption)
+                await self._run_request(
+                    request, trace, writer, encryption, write_lock, regular_length_size
+                )
+                return
+
+            while not reader.at_eof() and not writer.is_closing():
+                data_bytes = await read_request(reader, encryption, session_length_size)
+                # Decrypted here, records have to be decrypted in the order they arrive
+                (request, trace) = self._decrypt_request(data_bytes, encryption)
+                task = asyncio.create_task(
+                    self._run_session_request(
+                        request, trace, writer, encryption, write_lock
+                    )
+                )
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+        except asyncio.IncompleteReadError as e:
+            if not reader.at_eof():
+                print(f"Disconnecting {addr}", e)
+        except Exception as e:
+            print(f"Disconnecting {addr}", e)
+        finally:
+            if requests:
+                await asyncio.gather(*requests, return_exceptions=True)
+            self.open_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
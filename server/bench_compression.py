@@ -0,0 +1,118 @@
+"""
+Benchmark of the compression codecs on typical payloads: CPU time against bytes on the wire.
+
+Usage: python bench_compression.py [seconds per payload and codec]
+"""
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from compression import (
+    Compression,
+    codecs,
+    dictionary_min_size,
+    looks_incompressible,
+    supported_dictionaries,
+)
+
+
+def sample_payloads() -> Dict[str, bytes]:
+    """
+    Build payloads like the ones the server sends.
+
+    Returns:
+        Dict[str, bytes]: Name -> payload.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    source = b""
+    for name in sorted(os.listdir(here)):
+        if name.endswith(".py"):
+            with open(os.path.join(here, name), "rb") as f:
+                source += f.read()
+
+    issues = [
+        {
+            "id": i,
+            "title": f"Issue number {i}",
+            "content": "Steps to reproduce the problem " * 3,
+            "creator": "someone",
+            "creationDate": "2024-01-01 12:00:00",
+            "isOpen": i % 2 == 0,
+        }
+        for i in range(100)
+    ]
+    return {
+        "validateConnection": json.dumps({"type": "validateConnection"}).encode(),
+        "branches": json.dumps(
+            {"branches": ["master", "dev", "feature/login"], "requestId": 12}
+        ).encode(),
+        "issue": json.dumps({"issues": issues[:1], "requestId": 7}).encode(),
+        "issues (json)": json.dumps({"type": "issues", "issues": issues}).encode(),
+        "source files": source,
+        "random (incompressible)": os.urandom(1024 * 1024),
+        "png (incompressible)": b"\x89PNG\r\n\x1a\n" + os.urandom(1024 * 1024),
+    }
+
+
+def time_per_call(run: Callable[[], object], seconds: float) -> float:
+    """
+    Run a function for a while and time it.
+
+    Parameters:
+        run (Callable[[], object]): The function to time.
+        seconds (float): How long to run.
+
+    Returns:
+        float: Seconds per call.
+    """
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        run()
+        count += 1
+    return (time.perf_counter() - start) / count
+
+
+def configurations() -> List[Tuple[str, Compression]]:
+    """
+    Returns:
+        List[Tuple[str, Compression]]: The compressions to compare, the original protocol's plain gzip first.
+    """
+    configs = [("gzip 9 (before)", Compression())]
+    for name, codec in codecs.items():
+        for level in sorted({codec.default_level, 1}):
+            configs.append((f"{name} {level}", Compression(name, level)))
+    for version in supported_dictionaries:
+        configs.append(
+            (
+                f"zstd 3 dict v{version}",
+                Compression("zstd", 3, dictionary_min_size, version),
+            )
+        )
+    return configs
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    for payload_name, payload in sample_payloads().items():
+        print(
+            f"{payload_name}: {len(payload)} bytes,",
+            f"incompressible: {looks_incompressible(payload)}",
+        )
+        for config_name, compression in configurations():
+            compressed = compression.compress(payload)
+            compress_time = time_per_call(
+                lambda: compression.compress(payload), seconds
+            )
+            decompress_time = time_per_call(
+                lambda: compression.decompress(compressed), seconds
+            )
+            print(
+                f"  {config_name:<16} {len(compressed):>10} bytes",
+                f"{len(compressed) / len(payload):>7.1%}",
+                f"{compress_time * 1e6:>12.1f} us compress",
+                f"{decompress_time * 1e6:>12.1f} us decompress",
+            )
@@ -0,0 +1,77 @@
+"""
+Microbenchmark of the key exchange math of one handshake, both the server's and the client's side.
+
+Usage: python bench_handshake.py [seconds per backend]
+"""
+import random
+import sys
+import time
+from typing import Callable
+
+from encryption import global_g, global_p
+from key_exchange import KeyExchange, ModPowKeyExchange, X25519KeyExchange
+
+
+def naive_modpow_handshake():
+    """
+    The handshake as computed before key_exchange.py, building g**num before reducing it.
+    """
+    server_secret = random.randint(0, 1000)
+    client_secret = random.randint(0, 1000)
+    server_mixed = (global_g**server_secret) % global_p
+    client_mixed = (global_g**client_secret) % global_p
+    (client_mixed**server_secret) % global_p
+    (server_mixed**client_secret) % global_p
+
+
+def backend_handshake(backend: Callable[[], KeyExchange]) -> Callable[[], None]:
+    """
+    Build a handshake between two fresh instances of a key exchange backend.
+
+    Parameters:
+        backend (Callable[[], KeyExchange]): Creates an instance of the backend.
+
+    Returns:
+        Callable[[], None]: Runs one handshake.
+    """
+
+    def handshake():
+        server = backend()
+        client = backend()
+        server.shared_key(client.public_key())
+        client.shared_key(server.public_key())
+
+    return handshake
+
+
+def handshakes_per_second(handshake: Callable[[], None], seconds: float) -> float:
+    """
+    Run handshakes for a while and count them.
+
+    Parameters:
+        handshake (Callable[[], None]): Runs one handshake.
+        seconds (float): How long to run.
+
+    Returns:
+        float: Handshakes per second.
+    """
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        handshake()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    benchmarks = {
+        "modpow (g**num) % p (before)": naive_modpow_handshake,
+        "modpow pow(g, num, p)": backend_handshake(
+            lambda: ModPowKeyExchange(global_p, global_g)
+        ),
+        "x25519": backend_handshake(X25519KeyExchange),
+    }
+    for name, handshake in benchmarks.items():
+        print(f"{name:<30} {handshakes_per_second(handshake, seconds):>12.0f} handshakes/s")
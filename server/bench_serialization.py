@@ -0,0 +1,57 @@
+"""
+Benchmark of the serializations on the structured content the server sends: encode and decode time against payload size.
+Diffs are `get_diff_json` output of the commits of a git repository, commit lists are built from its history.
+
+Usage: python bench_serialization.py [repository path] [seconds per payload and serialization]
+"""
+import sys
+from typing import Any, Dict
+
+from git import Repo
+
+from bench_compression import time_per_call
+from git_utils import get_diff_json
+from server_logic import ServerLogic
+from server_protocol import pack_commits
+from serialization import serializers
+
+
+def sample_payloads(repo: Repo) -> Dict[str, Any]:
+    """
+    Build the content of commits and diff responses from a repository.
+
+    Parameters:
+        repo (Repo): The repository.
+
+    Returns:
+        Dict[str, Any]: Name -> content.
+    """
+    commits = list(repo.iter_commits(max_count=60))
+    diffs = [
+        get_diff_json(repo.git.show(commit.hexsha, format="")) for commit in commits
+    ]
+    largest_diff = max(diffs, key=lambda diff: len(str(diff)))
+    oldest = commits[-1].hexsha
+    return {
+        "commits page": pack_commits(ServerLogic.pack_git_commits(commits)),
+        "largest commit diff": largest_diff,
+        f"diff of {len(commits)} commits": get_diff_json(
+            repo.git.diff(f"{oldest}...{commits[0].hexsha}")
+        ),
+    }
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else ".."
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    for payload_name, payload in sample_payloads(Repo(path)).items():
+        print(f"{payload_name}:")
+        for name, serializer in serializers.items():
+            encoded = serializer.dumps(payload)
+            encode_time = time_per_call(lambda: serializer.dumps(payload), seconds)
+            decode_time = time_per_call(lambda: serializer.loads(encoded), seconds)
+            print(
+                f"  {name:<8} {len(encoded):>10} bytes",
+                f"{encode_time * 1e6:>12.1f} us encode",
+                f"{decode_time * 1e6:>12.1f} us decode",
+            )
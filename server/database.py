@@ -2,6 +2,17 @@ import os
 import psycopg2
 from dotenv import load_dotenv
 from typing import List, Tuple, Optional, cast
+from tracing import span
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    """
+    A cursor timing its queries as the "db" stage of the current request's trace.
+    """
+
+    def execute(self, query, vars=None):
+        with span("db"):
+            return super().execute(query, vars)
 
 
 class DB:
@@ -24,7 +35,7 @@ class DB:
             port=5432,
             password=os.getenv("DB_PASSWORD"),
         )
-        self.cursor = self.conn.cursor()
+        self.cursor = self.conn.cursor(cursor_factory=TracedCursor)
 
     def repo_by_name(self, repo: str) -> Optional[Tuple[int, str, bool]]:
         """
@@ -392,6 +403,66 @@ WHERE "PullRequest".id = %s
         branches = self.cursor.fetchone()
         return cast(Optional[Tuple[str, str]], branches)
 
+    def add_session(self, token: str, username: str, expires_at: float):
+        """
+        Store a new session.
+
+        Parameters:
+            token (str): The connection token of the session.
+            username (str): The user the session belongs to.
+            expires_at (float): When the session expires, in seconds since the epoch.
+        """
+        self.cursor.execute(
+            'INSERT INTO "Session" (token, username, expires_at) VALUES (%s, %s, to_timestamp(%s))',
+            (token, username, expires_at),
+        )
+        self.conn.commit()
+
+    def session(self, token: str) -> Optional[Tuple[str, float]]:
+        """
+        Look up a session that hasn't expired.
+
+        Parameters:
+            token (str): The connection token of the session.
+
+        Returns:
+            Optional[Tuple[str, float]]: The username and the expiry in seconds since the epoch, None if there's no such session.
+        """
+        self.cursor.execute(
+            'SELECT username, extract(epoch from expires_at) from "Session" where token = %s and expires_at > now()',
+            (token,),
+        )
+        session = self.cursor.fetchone()
+        if session is None:
+            return None
+        return (session[0], float(session[1]))
+
+    def extend_session(self, token: str, expires_at: float):
+        """
+        Move the expiry of a session.
+
+        Parameters:
+            token (str): The connection token of the session.
+            expires_at (float): The new expiry, in seconds since the epoch.
+        """
+        self.cursor.execute(
+            'UPDATE "Session" set expires_at = to_timestamp(%s) where token = %s',
+            (expires_at, token),
+        )
+        self.conn.commit()
+
+    def delete_expired_sessions(self) -> int:
+        """
+        Delete the sessions that expired.
+
+        Returns:
+            int: The number of sessions deleted.
+        """
+        self.cursor.execute('DELETE FROM "Session" where expires_at <= now()')
+        deleted = self.cursor.rowcount
+        self.conn.commit()
+        return deleted
+
 
 if __name__ == "__main__":
     load_dotenv()
@@ -1,27 +1,82 @@
 import base64
-import random
-from typing import Optional, cast
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Dict, Optional, cast
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
+
+from gitgud_types import Json
+from handshake import negotiate_features
+from key_exchange import ModPowKeyExchange, accept_key_exchange, key_exchanges
+from key_pool import KeyPool
+from record_layer import RecordLayer
 
 
 global_p = 189871
 global_g = 190619
 
+# Key pairs are generated ahead of time, off the thread accepting connections
+key_pools: Dict[str, KeyPool] = {
+    name: KeyPool(factory) for (name, factory) in key_exchanges.items()
+}
+
+
+def key_pool_stats() -> Json:
+    """
+    Get the depth, key pairs taken and times each key pool ran dry.
 
-def diffie_helman(num: int, g: int, p: int) -> int:
+    Returns:
+        Json: Stats by key exchange name.
     """
-    Calculate the Diffie-Hellman key exchange using the given parameters.
+    return {name: pool.stats() for (name, pool) in key_pools.items()}
+
+
+ticket_fernet: Optional[Fernet] = None
+
+
+def get_ticket_fernet() -> Fernet:
+    """
+    Get the key resumption tickets are encrypted with,
+    TICKET_KEY (a Fernet key) lets servers share tickets and keeps them valid across restarts,
+    without it tickets are only valid until the server restarts.
+
+    Returns:
+        Fernet: The ticket key.
+    """
+    global ticket_fernet
+    if ticket_fernet is None:
+        ticket_fernet = Fernet(os.getenv("TICKET_KEY") or Fernet.generate_key())
+    return ticket_fernet
+
+
+def resumption_secret(key: bytes) -> bytes:
+    """
+    Derive the secret of a resumption ticket from the key of a full key exchange, the client derives the same secret.
 
     Parameters:
-        num (int): The private key exponent.
-        g (int): The generator.
-        p (int): The prime modulus.
+        key (bytes): The shared key of the key exchange.
 
     Returns:
-        int: The calculated Diffie-Hellman key.
+        bytes: The resumption secret.
     """
-    return (g**num) % p
+    return hashlib.sha256(b"gitgud resumption" + key).digest()
+
+
+def resumed_key(secret: bytes, client_nonce: bytes, server_hello: bytes) -> bytes:
+    """
+    Derive the key of a resumed connection, unique to the connection through both the client's nonce and the server's hello.
+
+    Parameters:
+        secret (bytes): The resumption secret held in the ticket.
+        client_nonce (bytes): The random nonce the client sent with the ticket.
+        server_hello (bytes): The initial public message the server sent on the connection.
+
+    Returns:
+        bytes: The 32 byte key of the connection.
+    """
+    return hashlib.sha256(secret + client_nonce + server_hello).digest()
 
 
 class EncryptionState:
@@ -33,8 +88,8 @@ class EncryptionState:
         """
         Initializes a new instance of the class.
 
-        This constructor sets the `secret_key` attribute to a random integer between 0 and 1000,
-        the `encryption_key` attribute to `None`, and the `fernet` attribute to `None`.
+        This constructor sets the `key` attribute to `None`, the `fernet` attribute to `None`
+        and the negotiated `features` to none.
 
         Parameters:
             None
@@ -42,13 +97,26 @@ class EncryptionState:
         Returns:
             None
         """
-        self.secret_key: int = random.randint(0, 1000)
-        self.encryption_key: Optional[int] = None
+        # The original key exchange, created for the initial message, see `get_mixed_key`
+        self.modpow_exchange: Optional[ModPowKeyExchange] = None
+        self.key: Optional[bytes] = None
         self.fernet = None
+        # Answer to a key exchange other than modpow offered by the client
+        self.key_exchange_accept: Json = {}
+        # Replaces Fernet when the client negotiated a cipher
+        self.record_layer: Optional[RecordLayer] = None
+        # Held while encrypting and sending, records have to go out in the order they were sealed
+        self.send_lock = Lock()
+        self.features: Json = {}
+        self.offered_features = False
+        self.initial_message: Optional[bytes] = None
+        # Ticket handed to the client after a full key exchange, set when it asked for resumption
+        self.ticket: Optional[str] = None
+        self.resumed = False
 
     def encrypt(self, data: bytes) -> bytes:
         """
-        Encrypts the given data using the Fernet encryption algorithm.
+        Encrypts the given data using the negotiated record layer, or the Fernet encryption algorithm if there is none.
 
         Parameters:
             data (bytes): The data to be encrypted.
@@ -56,11 +124,13 @@ class EncryptionState:
         Returns:
             bytes: The encrypted data.
         """
+        if self.record_layer is not None:
+            return self.record_layer.seal(data)
         return cast(Fernet, self.fernet).encrypt(data)
 
     def decrypt(self, data: bytes) -> bytes:
         """
-        Decrypts the given data using the Fernet encryption algorithm.
+        Decrypts the given data using the negotiated record layer, or the Fernet encryption algorithm if there is none.
 
         Args:
             data (bytes): The data to be decrypted.
@@ -68,34 +138,128 @@ class EncryptionState:
         Returns:
             bytes: The decrypted data.
         """
+        if self.record_layer is not None:
+            return self.record_layer.open(data)
         return cast(Fernet, self.fernet).decrypt(data)
 
+    def set_key(self, key: bytes):
+        """
+        Set the key shared with the client and start the record layer if a cipher was negotiated.
+
+        Parameters:
+            key (bytes): The 32 byte shared key.
+        """
+        self.key = key
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        if "cipher" in self.features:
+            self.record_layer = RecordLayer(self.features["cipher"], key, True)
+
     def set_encryption_key(self, client_mixed_key_response_bytes: bytes):
         """
-        :client_mixed_key: Response of encryption key in bytes
-        Set S value on server based on client mixed key
+        :client_mixed_key: Response of encryption key in bytes, optionally followed by `;` and a json feature offer,
+            or `resume;<ticket>;<nonce>;<offer>` to resume with a ticket instead of a key exchange
+        Set S value on server based on client mixed key and negotiate the offered features
+        """
+        response = client_mixed_key_response_bytes.decode()
+        if response.startswith("resume;"):
+            self.resume(response)
+            return
+
+        (client_mixed_key, _, offer_str) = response.partition(";")
+        offer: Optional[Json] = None
+        if offer_str:
+            offer = json.loads(offer_str)
+            self.features = negotiate_features(cast(Json, offer))
+            self.offered_features = True
+
+        key_exchange_name = accept_key_exchange(offer)
+        key_exchange = (
+            None if key_exchange_name is None else key_pools[key_exchange_name].take()
+        )
+        if key_exchange is None:
+            self.set_key(
+                cast(ModPowKeyExchange, self.modpow_exchange).shared_key(
+                    client_mixed_key
+                )
+            )
+        else:
+            self.set_key(key_exchange.shared_key(cast(Json, offer)["publicKey"]))
+            self.key_exchange_accept = {
+                "keyExchange": key_exchange.name,
+                "publicKey": key_exchange.public_key(),
+            }
+        if self.features.get("resumption"):
+            self.ticket = (
+                get_ticket_fernet()
+                .encrypt(resumption_secret(cast(bytes, self.key)))
+                .decode()
+            )
+
+    def resume(self, response: str):
+        """
+        Derive the key from a resumption ticket instead of running a key exchange.
+
+        Parameters:
+            response (str): `resume;<ticket>;<nonce>;<offer>` sent by the client.
+
+        Raises:
+            ValueError: If the ticket is invalid or expired, the client falls back to a full key exchange.
         """
-        client_mixed_key = int(client_mixed_key_response_bytes.decode())
-        self.encryption_key = diffie_helman(self.secret_key, client_mixed_key, global_p)
-        key = base64.urlsafe_b64encode(
-            self.encryption_key.to_bytes(32, byteorder="big")
+        (_, ticket, nonce, offer) = response.split(";", 3)
+        try:
+            secret = get_ticket_fernet().decrypt(
+                ticket.encode(), ttl=int(os.getenv("TICKET_TTL", "3600"))
+            )
+        except InvalidToken:
+            raise ValueError("Invalid resumption ticket")
+        self.features = negotiate_features(json.loads(offer))
+        self.offered_features = True
+        self.resumed = True
+        self.set_key(
+            resumed_key(
+                secret,
+                base64.urlsafe_b64decode(nonce),
+                cast(bytes, self.initial_message),
+            )
         )
-        self.fernet = Fernet(key)
 
     def get_initial_public_message(self) -> bytes:
         """
         Get initial message to send to client
         """
-        return f"{self.get_mixed_key()};{global_p};{global_g}".encode()
+        if self.initial_message is None:
+            self.initial_message = (
+                f"{self.get_mixed_key()};{global_p};{global_g}".encode()
+            )
+        return self.initial_message
+
+    def get_accept_message(self) -> Optional[bytes]:
+        """
+        Get the message accepting the client's feature offer,
+        None if the client didn't offer features and expects the original protocol.
+        """
+        if not self.offered_features:
+            return None
+        if self.resumed:
+            return json.dumps({**self.features, "resumed": True}).encode()
+        accept = {**self.features, **self.key_exchange_accept}
+        if self.ticket is not None:
+            accept["ticket"] = self.ticket
+        return json.dumps(accept).encode()
 
     def finished_encryption(self) -> bool:
         """
         :return: Tells if than encryption has been completed
         """
-        return self.encryption_key is not None
+        return self.fernet is not None
 
     def get_mixed_key(self) -> int:
         """
-        Get public A from private a
+        Get public A from private a.
+        The original protocol sends it before the client says which key exchange it wants,
+        it's a single pow over a tiny modulus so it's made here instead of taken from a key pool,
+        the pools only hold key pairs of the exchanges clients offer.
         """
-        return diffie_helman(self.secret_key, global_g, global_p)
+        if self.modpow_exchange is None:
+            self.modpow_exchange = ModPowKeyExchange(global_p, global_g)
+        return int(self.modpow_exchange.public_key())
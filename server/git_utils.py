@@ -4,9 +4,15 @@ import unidiff
 import unidiff.patch
 
 
-from typing import List, cast
+from typing import List, Optional, cast
+from git import Blob
 from gitgud_types import Json, commit_page_size
 
+# Bump when the output of get_diff_json changes, clients cache diffs by a hash that includes it
+diff_format_version = 1
+# Bytes read at once while skipping through a blob
+blob_chunk_size = 64 * 1024
+
 
 def commits_between_branches(
     repo: Repo, from_branch: str, into_branch: str, page: int
@@ -42,6 +48,38 @@ def commits_between_branches(
     return commits
 
 
+def read_blob_range(blob: Blob, offset: int, length: Optional[int]) -> bytes:
+    """
+    Read a range of a blob without holding the rest of it in memory.
+    The stream comes from a `git cat-file` process shared by the repo that has to be read to the end,
+    so the bytes before and after the range are read in chunks and dropped.
+
+    Parameters:
+        blob (Blob): The blob.
+        offset (int): The first byte of the range.
+        length (Optional[int]): The bytes in the range, None for the rest of the blob.
+
+    Returns:
+        bytes: The range, shorter than length when the blob ends first.
+    """
+    stream = blob.data_stream
+    size = blob.size
+    offset = min(offset, size)
+    end = size if length is None else min(offset + length, size)
+
+    def skip(count: int):
+        while count > 0:
+            chunk = stream.read(min(count, blob_chunk_size))
+            if not chunk:
+                return
+            count -= len(chunk)
+
+    skip(offset)
+    content = stream.read(end - offset)
+    skip(size - end)
+    return content
+
+
 def get_diff_json(git_diff_output: str) -> Json:
     """
     Creates a json object from the output of git diff,
@@ -5,6 +5,11 @@ Address = Tuple[str, int]
 Action = Callable[[Json], Json]
 
 IssuePr = Literal["Issue", "PR"]
+# Requests of each lane wait in their own queue for their own workers,
+# so cheap metadata requests aren't stuck behind slow git work
+Lane = Literal["fast", "git"]
 
 
 commit_page_size = 60
+# Most requests a batch may carry
+batch_max_size = 32
@@ -0,0 +1,146 @@
+import os
+from typing import List, Optional
+
+from compression import (
+    codecs,
+    default_min_size,
+    dictionary_min_size,
+    supported_compressions,
+    supported_dictionaries,
+)
+from gitgud_types import Json
+from record_layer import supported_ciphers
+from serialization import serializers, supported_serializations
+
+
+def compression_preference() -> List[str]:
+    """
+    Returns:
+        List[str]: The compression codecs the server accepts in order of preference,
+        COMPRESSION if it's set (comma separated) and every available codec otherwise.
+    """
+    configured = os.getenv("COMPRESSION")
+    if not configured:
+        return supported_compressions
+    return [name.strip() for name in configured.split(",") if name.strip() in codecs]
+
+
+def negotiate_compression(offer: Json) -> Optional[Json]:
+    """
+    Pick the compression of a connection out of the codecs and dictionaries offered by the client.
+
+    Parameters:
+        offer (Json): The features the client supports.
+
+    Returns:
+        Optional[Json]: The accepted compression, None if the client didn't offer a codec the server accepts.
+    """
+    offered_compressions = offer.get("compression")
+    if not isinstance(offered_compressions, list):
+        return None
+    for algorithm in compression_preference():
+        if algorithm in offered_compressions:
+            break
+    else:
+        return None
+
+    level = os.getenv("COMPRESSION_LEVEL")
+    compression: Json = {
+        "algorithm": algorithm,
+        "level": codecs[algorithm].default_level if level is None else int(level),
+    }
+    min_size = default_min_size
+    offered_dictionaries = offer.get("compressionDictionary")
+    if algorithm == "zstd" and isinstance(offered_dictionaries, list):
+        # Newest first, the client may not have the latest dictionary yet
+        for version in supported_dictionaries:
+            if version in offered_dictionaries:
+                compression["dictionary"] = version
+                min_size = dictionary_min_size
+                break
+    compression["minSize"] = int(os.getenv("COMPRESSION_MIN_SIZE", str(min_size)))
+    return compression
+
+
+def negotiate_serialization(offer: Json) -> Optional[str]:
+    """
+    Pick the serialization of a connection out of the ones offered by the client,
+    SERIALIZATION (comma separated) sets the ones the server accepts in order of preference, every available one otherwise.
+
+    Parameters:
+        offer (Json): The features the client supports.
+
+    Returns:
+        Optional[str]: The accepted serialization, None if the client didn't offer one the server accepts.
+    """
+    offered_serializations = offer.get("serialization")
+    if not isinstance(offered_serializations, list):
+        return None
+    configured = os.getenv("SERIALIZATION")
+    preference = (
+        [name.strip() for name in configured.split(",")]
+        if configured
+        else supported_serializations
+    )
+    for name in preference:
+        if name in serializers and name in offered_serializations:
+            return name
+    return None
+
+
+def negotiate_features(offer: Json) -> Json:
+    """
+    Pick the protocol features to use on a connection out of the features offered by the client.
+
+    Clients that don't send an offer keep the original protocol,
+    every feature is opt in so old clients keep working.
+
+    Parameters:
+        offer (Json): The features the client supports, sent with its key exchange response.
+
+    Returns:
+        Json: The features accepted by the server, sent back to the client.
+
+    Raises:
+        ValueError: If the offer is not a Json object.
+
+    Supported features:
+        - session (bool): Keep the connection open for many requests tagged by "requestId".
+        - framing ("binary"): Send messages in binary frames (see framing.py) instead of decimal length prefixes.
+        - inlineStream (bool): Stream file content as chunk frames after the response instead of a file transfer, requires binary framing.
+        - resumption (bool): Hand out a ticket after the key exchange, later connections present it instead of exchanging keys again.
+        - cipher (List[str]): AEAD ciphers of the record layer (record_layer.py) the client supports, replacing Fernet tokens,
+            the server accepts the first of its own `supported_ciphers` that was offered.
+        - compression (List[str]): Compression codecs (compression.py) the client supports, replacing plain gzip,
+            the server accepts the first of its preferred codecs that was offered,
+            with the level (COMPRESSION_LEVEL) and the size below which payloads are stored (COMPRESSION_MIN_SIZE).
+        - compressionDictionary (List[int]): Versions of the zstd dictionary for small messages the client has,
+            the newest one the server also has is used when zstd is accepted.
+        - serialization (List[str]): Encodings (serialization.py) of messages and of structured file content the client supports,
+            replacing JSON, the server accepts the first of its preferred ones (SERIALIZATION) that was offered.
+    """
+    if not isinstance(offer, dict):
+        raise ValueError("Feature offer needs to be Json object")
+
+    accepted: Json = {}
+    if offer.get("session") is True:
+        accepted["session"] = True
+    if offer.get("framing") == "binary":
+        accepted["framing"] = "binary"
+        if offer.get("inlineStream") is True:
+            accepted["inlineStream"] = True
+    if offer.get("resumption") is True:
+        accepted["resumption"] = True
+    offered_ciphers = offer.get("cipher")
+    if isinstance(offered_ciphers, list):
+        for cipher in supported_ciphers:
+            if cipher in offered_ciphers:
+                accepted["cipher"] = cipher
+                break
+    compression = negotiate_compression(offer)
+    if compression is not None:
+        accepted["compression"] = compression
+    serialization = negotiate_serialization(offer)
+    if serialization is not None:
+        accepted["serialization"] = serialization
+    return accepted
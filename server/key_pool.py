@@ -0,0 +1,82 @@
+import os
+from collections import deque
+from threading import Condition, Thread
+from typing import Callable, Deque, Optional, cast
+
+from gitgud_types import Json
+from key_exchange import KeyExchange
+
+
+class KeyPool:
+    def __init__(self, factory: Callable[[], KeyExchange], size: Optional[int] = None):
+        """
+        Initializes a new instance of the KeyPool class,
+        key exchanges with their key pairs generated ahead of time by a background thread,
+        so accepting a connection only takes a ready key pair.
+
+        Parameters:
+            factory (Callable[[], KeyExchange]): Creates a key exchange with a new key pair.
+            size (Optional[int], optional): Key pairs kept ready. Defaults to KEY_POOL_SIZE or 64, read when the pool is first used.
+
+        Returns:
+            None
+        """
+        self.factory = factory
+        self.size = size
+        self.keys: Deque[KeyExchange] = deque()
+        self.condition = Condition()
+        self.taken = 0
+        # Times a key pair was needed while the pool was empty
+        self.misses = 0
+        self.refill_thread: Optional[Thread] = None
+
+    def take(self) -> KeyExchange:
+        """
+        Take a ready key exchange, generating one on the calling thread only if the pool ran dry.
+
+        Returns:
+            KeyExchange: A key exchange never handed out before.
+        """
+        with self.condition:
+            if self.refill_thread is None:
+                if self.size is None:
+                    self.size = int(os.getenv("KEY_POOL_SIZE", "64"))
+                self.refill_thread = Thread(target=self._refill, daemon=True)
+                self.refill_thread.start()
+            self.taken += 1
+            self.condition.notify()
+            if self.keys:
+                return self.keys.popleft()
+            self.misses += 1
+        return self._generate()
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: The key pairs ready, taken and the times the pool ran dry.
+        """
+        with self.condition:
+            return {"depth": len(self.keys), "taken": self.taken, "misses": self.misses}
+
+    def _generate(self) -> KeyExchange:
+        """
+        Create a key exchange and compute its public key, the expensive part of the accept path.
+
+        Returns:
+            KeyExchange: The key exchange.
+        """
+        key_exchange = self.factory()
+        key_exchange.public_key()
+        return key_exchange
+
+    def _refill(self):
+        """
+        Keep the pool full, waking up whenever a key pair is taken.
+        """
+        while True:
+            with self.condition:
+                while len(self.keys) >= cast(int, self.size):
+                    self.condition.wait()
+            key_exchange = self._generate()
+            with self.condition:
+                self.keys.append(key_exchange)
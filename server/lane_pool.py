@@ -0,0 +1,52 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Optional
+
+from gitgud_types import Json
+
+
+class LanePool(ThreadPoolExecutor):
+    def __init__(self, max_workers: Optional[int], thread_name_prefix: str):
+        """
+        Initializes a new instance of the LanePool class, the worker pool of a lane
+        counting the work waiting for a worker and the work running, which ThreadPoolExecutor doesn't expose.
+
+        Parameters:
+            max_workers (Optional[int]): The threads of the pool, None for the ThreadPoolExecutor default.
+            thread_name_prefix (str): Prefix of the names of its threads.
+
+        Returns:
+            None
+        """
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.counts_lock = Lock()
+        self.waiting = 0
+        self.running = 0
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        def run() -> Any:
+            with self.counts_lock:
+                self.waiting -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.counts_lock:
+                    self.running -= 1
+
+        with self.counts_lock:
+            self.waiting += 1
+        try:
+            return super().submit(run)
+        except BaseException:
+            with self.counts_lock:
+                self.waiting -= 1
+            raise
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: The work waiting for a worker ("waiting") and the work running ("running").
+        """
+        with self.counts_lock:
+            return {"waiting": self.waiting, "running": self.running}
@@ -1,10 +1,30 @@
+import asyncio
 import os
 from typing import cast
+from async_server import AsyncServer
+from metrics import MetricsExporter
+from server_comm import ServerComm
 from server_logic import ServerLogic
 from dotenv import load_dotenv
 
 if __name__ == "__main__":
     load_dotenv()
-    logic = ServerLogic(int(cast(str, os.getenv("SERVER_PORT"))))
-    while True:
-        logic.tick()
+    port = int(cast(str, os.getenv("SERVER_PORT")))
+    metrics_port = os.getenv("METRICS_PORT")
+    if os.getenv("SERVER_MODE") == "asyncio":
+        logic = ServerLogic(port, listen=False)
+        server = AsyncServer(logic)
+        if metrics_port:
+            MetricsExporter(logic, lambda: server.open_connections).start(
+                int(metrics_port)
+            )
+        asyncio.run(server.serve(port))
+    else:
+        logic = ServerLogic(port)
+        if metrics_port:
+            server_comm = cast(ServerComm, logic.server_comm)
+            MetricsExporter(logic, lambda: len(server_comm.open_sockets)).start(
+                int(metrics_port)
+            )
+        while True:
+            logic.tick()
@@ -0,0 +1,229 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
+
+from server_logic import ServerLogic
+
+# Walking the clones is slow, their disk use is measured at most this often in seconds
+cache_scan_interval = 60
+
+
+def directory_size(path: str) -> int:
+    """
+    Parameters:
+        path (str): A directory.
+
+    Returns:
+        int: The bytes of all the files under it, files removed while walking are skipped.
+    """
+    total = 0
+    for (root, _, files) in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CacheUsage:
+    def __init__(self, path: str):
+        """
+        Initializes a new instance of the CacheUsage class, the clones under the cache folder and their disk use,
+        measured again when older than `cache_scan_interval`.
+
+        Parameters:
+            path (str): The cache folder, repositories are cloned to "<path>/<owner>/<repo>".
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.measured_at: Optional[float] = None
+        self.usage = (0, 0)
+
+    def get(self) -> Tuple[int, int]:
+        """
+        Returns:
+            Tuple[int, int]: The number of cloned repositories and the bytes they take.
+        """
+        with self.lock:
+            if (
+                self.measured_at is None
+                or monotonic() - self.measured_at >= cache_scan_interval
+            ):
+                self.usage = self._measure()
+                self.measured_at = monotonic()
+            return self.usage
+
+    def _measure(self) -> Tuple[int, int]:
+        if not os.path.isdir(self.path):
+            return (0, 0)
+        repos = 0
+        for owner in os.scandir(self.path):
+            if owner.is_dir():
+                repos += sum(1 for repo in os.scandir(owner.path) if repo.is_dir())
+        return (repos, directory_size(self.path))
+
+
+class MetricsExporter:
+    def __init__(self, logic: ServerLogic, open_sockets: Callable[[], int]):
+        """
+        Initializes a new instance of the MetricsExporter class,
+        resource gauges of the server served in the Prometheus text format for capacity planning and leak alerts.
+
+        Parameters:
+            logic (ServerLogic): The logic of the server.
+            open_sockets (Callable[[], int]): Counts the client connections open on the front end.
+
+        Returns:
+            None
+        """
+        self.logic = logic
+        self.open_sockets = open_sockets
+        self.cache_usage = CacheUsage("./cache")
+
+    def collect(self) -> List[Tuple[str, str, str, float]]:
+        """
+        Read the current value of every metric.
+
+        Returns:
+            List[Tuple[str, str, str, float]]: The name, type, help and value of every metric, labels are part of the name.
+        """
+        logic = self.logic
+        transfers = logic.transfer_server.stats()
+        coalescing = logic.single_flight.stats()
+        (cache_repos, cache_bytes) = self.cache_usage.get()
+        metrics = [
+            (
+                "gitgud_logic_queue_depth",
+                "gauge",
+                "Requests read off their connection waiting to be handed to a lane",
+                logic.queue.qsize(),
+            ),
+        ]
+        lanes = {lane: pool.stats() for (lane, pool) in logic.lanes.items()}
+        for (name, help, count) in [
+            (
+                "gitgud_lane_queue_depth",
+                "Requests waiting for a worker of their lane",
+                "waiting",
+            ),
+            (
+                "gitgud_lane_running",
+                "Requests running on a worker of their lane",
+                "running",
+            ),
+        ]:
+            for (lane, lane_stats) in lanes.items():
+                metrics.append(
+                    (f'{name}{{lane="{lane}"}}', "gauge", help, lane_stats[count])
+                )
+        metrics += [
+            (
+                "gitgud_open_sockets",
+                "gauge",
+                "Client connections open on the front end",
+                self.open_sockets(),
+            ),
+            (
+                "gitgud_pending_transfers",
+                "gauge",
+                "File transfers waiting to be claimed",
+                transfers["pendingTransfers"],
+            ),
+            (
+                "gitgud_pending_transfer_bytes",
+                "gauge",
+                "Bytes held by file transfers waiting to be claimed",
+                transfers["pendingBytes"],
+            ),
+            (
+                "gitgud_sessions",
+                "gauge",
+                "Sessions held in memory, cached ones with SESSION_STORE=postgres",
+                len(logic.sessions),
+            ),
+            (
+                "gitgud_threads",
+                "gauge",
+                "Live threads",
+                threading.active_count(),
+            ),
+            (
+                "gitgud_cache_repos",
+                "gauge",
+                "Repositories cloned in the cache folder",
+                cache_repos,
+            ),
+            (
+                "gitgud_cache_bytes",
+                "gauge",
+                f"Disk use of the cache folder, measured at most every {cache_scan_interval}s",
+                cache_bytes,
+            ),
+            (
+                "gitgud_requests_executed_total",
+                "counter",
+                "Read requests computed by single-flight",
+                coalescing["executed"],
+            ),
+            (
+                "gitgud_requests_coalesced_total",
+                "counter",
+                "Read requests that shared the response of an identical request in flight",
+                coalescing["coalesced"],
+            ),
+        ]
+        return metrics
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        described = set()
+        for (name, kind, help, value) in self.collect():
+            family = name.split("{")[0]
+            if family not in described:
+                described.add(family)
+                lines.append(f"# HELP {family} {help}")
+                lines.append(f"# TYPE {family} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start(self, port: int):
+        """
+        Serve the metrics on "/metrics" of a local port in a separate thread.
+
+        Parameters:
+            port (int): The port, only listened on for local connections.
+
+        Returns:
+            None
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the log
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
@@ -0,0 +1,186 @@
+import os
+import re
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Condition, Lock, Thread, get_ident
+from time import monotonic, sleep
+from types import FrameType
+from typing import Dict, Iterator, Optional, cast
+
+from tracing import current_trace
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """
+    Parameters:
+        frame (Optional[FrameType]): The innermost frame of a thread.
+
+    Returns:
+        str: The stack in the collapsed format of flame graphs, outermost function first, separated by ";".
+    """
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(functions))
+
+
+class RunningAction:
+    def __init__(self, action: str, repo: Optional[str]):
+        """
+        Initializes a new instance of the RunningAction class, an action being sampled.
+
+        Parameters:
+            action (str): The type of the request.
+            repo (Optional[str]): The repository of the request, if it has one.
+
+        Returns:
+            None
+        """
+        self.action = action
+        self.repo = repo
+        self.started = monotonic()
+        # Collapsed stack -> Times it was sampled
+        self.samples: Dict[str, int] = {}
+
+
+class SlowActionProfiler:
+    def __init__(self):
+        """
+        Initializes a new instance of the SlowActionProfiler class.
+        With PROFILE_SLOW_MS set, a background thread samples the stacks of the threads running actions
+        every PROFILE_INTERVAL_MS (defaults to 5) milliseconds, the samples of actions that take at least PROFILE_SLOW_MS
+        are written to PROFILE_DIR (defaults to ./profiles) in the collapsed format of flame graphs,
+        named by time, action, repository and trace ID, only the newest PROFILE_KEEP (defaults to 100) are kept.
+        PROFILE_ACTIONS limits profiling to some actions, comma separated, defaults to all.
+        Actions aren't instrumented, the cost is the sampling thread, so fast actions run as without profiling
+        and concurrent actions on different workers are sampled independently.
+
+        Returns:
+            None
+        """
+        slow_ms = os.getenv("PROFILE_SLOW_MS")
+        self.threshold: Optional[float] = (
+            float(slow_ms) / 1000 if slow_ms is not None else None
+        )
+        actions = os.getenv("PROFILE_ACTIONS")
+        self.actions = (
+            {action.strip() for action in actions.split(",")} if actions else None
+        )
+        self.interval = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+        self.directory = os.getenv("PROFILE_DIR", "./profiles")
+        self.keep = int(os.getenv("PROFILE_KEEP", "100"))
+        self.condition = Condition()
+        # Thread ID -> The action it runs, a batch applies its requests inside its own action
+        self.running: Dict[int, RunningAction] = {}
+        self.sampler: Optional[Thread] = None
+        self.save_lock = Lock()
+
+    def enabled_for(self, action: str) -> bool:
+        """
+        Parameters:
+            action (str): The type of a request.
+
+        Returns:
+            bool: Whether the action should be profiled.
+        """
+        return self.threshold is not None and (
+            self.actions is None or action in self.actions
+        )
+
+    @contextmanager
+    def profile(self, action: str, repo: Optional[str]) -> Iterator[None]:
+        """
+        Sample the stack of the current thread while it applies an action, and save the samples if it's slower than the threshold.
+
+        Parameters:
+            action (str): The type of the request.
+            repo (Optional[str]): The repository of the request, if it has one.
+
+        Returns:
+            Iterator[None]: Context manager profiling the block.
+        """
+        thread = get_ident()
+        with self.condition:
+            if not self.enabled_for(action) or thread in self.running:
+                running = None
+            else:
+                running = RunningAction(action, repo)
+                self.running[thread] = running
+                if self.sampler is None:
+                    self.sampler = Thread(target=self._sample, daemon=True)
+                    self.sampler.start()
+                self.condition.notify()
+        if running is None:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                del self.running[thread]
+            elapsed = monotonic() - running.started
+            if elapsed >= cast(float, self.threshold) and running.samples:
+                self._save(running, elapsed)
+
+    def _sample(self):
+        """
+        Count the stacks of the threads running actions every interval, sleeping while there are none.
+        """
+        while True:
+            with self.condition:
+                while not self.running:
+                    self.condition.wait()
+            sleep(self.interval)
+            frames = sys._current_frames()
+            with self.condition:
+                for thread, running in self.running.items():
+                    frame = frames.get(thread)
+                    if frame is not None:
+                        stack = collapse_stack(frame)
+                        running.samples[stack] = running.samples.get(stack, 0) + 1
+            del frames
+
+    def _save(self, running: RunningAction, elapsed: float):
+        """
+        Write the samples of an action and delete the oldest profiles past PROFILE_KEEP.
+
+        Parameters:
+            running (RunningAction): The sampled action.
+            elapsed (float): Seconds the action took.
+        """
+        trace = current_trace()
+        name = "-".join(
+            [
+                datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+                running.action,
+                re.sub(r"[^\w.-]", "_", str(running.repo))
+                if running.repo
+                else "norepo",
+                trace.trace_id if trace is not None else "notrace",
+            ]
+        )
+        path = os.path.join(self.directory, f"{name}.folded")
+        try:
+            with self.save_lock:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, "w") as file:
+                    for stack, count in running.samples.items():
+                        file.write(f"{stack} {count}\n")
+                profiles = sorted(
+                    profile
+                    for profile in os.listdir(self.directory)
+                    if profile.endswith(".folded")
+                )
+                for old in profiles[: max(len(profiles) - self.keep, 0)]:
+                    os.remove(os.path.join(self.directory, old))
+        except OSError as e:
+            print("Couldn't save profile", path, e)
+            return
+        print(f"Profiled slow {running.action} ({elapsed * 1000:.1f}ms) to {path}")
+
@@ -2,24 +2,19 @@ import os
 from git import Repo
 
 
-def repo_clone(repo_name: str, branch: str = "") -> Repo:
+def repo_clone(repo_name: str) -> Repo:
     """
-    Clones repo into cache folder if it doesn't exist and pulls branch if it does
+    Clones repo into cache folder if it doesn't exist and fetches it if it does.
+    Branches are read from their remote refs ("origin/<branch>"), so the working tree is never checked out again,
+    the caller holds the write lock of the repo (repo_locks.py).
     """
     path = f"./cache/{repo_name}"
     if os.path.exists(path):
         repo = Repo(path)
-        if branch:
-            repo.git.checkout(branch)
-        repo.remotes.origin.pull(branch if branch else "main")
         repo.remotes.origin.fetch()
 
         return repo
     else:
         repo_url = f"git@localhost:{repo_name}"
         path_of_clone = f"./cache/{repo_name}"
-        return Repo.clone_from(
-            repo_url,
-            path_of_clone,
-            branch=branch if branch else None,
-        )
+        return Repo.clone_from(repo_url, path_of_clone)
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Dict, Iterator
+
+
+class ReadWriteLock:
+    def __init__(self):
+        """
+        Initializes a new instance of the ReadWriteLock class,
+        held by any number of readers or by a single writer.
+        Waiting writers go first, new readers wait for them so a steady stream of reads can't starve a fetch.
+
+        Returns:
+            None
+        """
+        self.condition = Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    def downgrade(self):
+        """
+        Turn the write lock held by the caller into a read lock, without letting another writer in between.
+        """
+        with self.condition:
+            self.writer = False
+            self.readers += 1
+            self.condition.notify_all()
+
+
+class RepoLocks:
+    def __init__(self):
+        """
+        Initializes a new instance of the RepoLocks class,
+        a read write lock per repository of the shared `./cache` clones.
+
+        Cloning, fetching and checking out change the clone and take the write lock,
+        git queries only read it and share the read lock.
+        Requests for different repositories don't block each other.
+        A thread holding the read lock of a repository must not ask for its write lock.
+
+        Returns:
+            None
+        """
+        self.guard = Lock()
+        # Full repo name -> ReadWriteLock, created on first use
+        self.locks: Dict[str, ReadWriteLock] = {}
+        # Full repo name -> When its clone was last refreshed by `read_fresh`, written under its write lock
+        self.refreshed_at: Dict[str, float] = {}
+
+    def _lock_of(self, repo_name: str) -> ReadWriteLock:
+        with self.guard:
+            return self.locks.setdefault(repo_name, ReadWriteLock())
+
+    @contextmanager
+    def read(self, repo_name: str) -> Iterator[None]:
+        """
+        Hold the read lock of a repository.
+
+        Parameters:
+            repo_name (str): The full name of the repository, "owner/repo".
+
+        Returns:
+            Iterator[None]: Context manager holding the lock.
+        """
+        lock = self._lock_of(repo_name)
+        lock.acquire_read()
+        try:
+            yield
+        finally:
+            lock.release_read()
+
+    @contextmanager
+    def write(self, repo_name: str) -> Iterator[None]:
+        """
+        Hold the write lock of a repository.
+
+        Parameters:
+            repo_name (str): The full name of the repository, "owner/repo".
+
+        Returns:
+            Iterator[None]: Context manager holding the lock.
+        """
+        lock = self._lock_of(repo_name)
+        lock.acquire_write()
+        try:
+            yield
+        finally:
+            lock.release_write()
+
+    @contextmanager
+    def read_fresh(
+        self, repo_name: str, max_age: float, refresh: Callable[[], None]
+    ) -> Iterator[None]:
+        """
+        Hold the read lock of a repository whose clone was refreshed at most `max_age` seconds ago.
+        Reads of a fresh clone share the read lock right away,
+        otherwise the write lock is taken to refresh it and downgraded to the read lock,
+        so no writer changes the clone between the refresh and the read.
+
+        Parameters:
+            repo_name (str): The full name of the repository, "owner/repo".
+            max_age (float): Seconds a refresh stays fresh.
+            refresh (Callable[[], None]): Clones or fetches the repository, called holding the write lock.
+
+        Returns:
+            Iterator[None]: Context manager holding the read lock.
+        """
+        lock = self._lock_of(repo_name)
+        lock.acquire_read()
+        refreshed_at = self.refreshed_at.get(repo_name)
+        if refreshed_at is None or monotonic() - refreshed_at >= max_age:
+            lock.release_read()
+            lock.acquire_write()
+            try:
+                # Another request may have refreshed it while this one waited for the write lock
+                refreshed_at = self.refreshed_at.get(repo_name)
+                if refreshed_at is None or monotonic() - refreshed_at >= max_age:
+                    refresh()
+                    self.refreshed_at[repo_name] = monotonic()
+            except BaseException:
+                lock.release_write()
+                raise
+            lock.downgrade()
+        try:
+            yield
+        finally:
+            lock.release_read()
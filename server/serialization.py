@@ -0,0 +1,94 @@
+import json
+from typing import Any, Dict, List
+
+from gitgud_types import Json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Serializer:
+    """
+    A way to encode messages and structured file content that can be negotiated in the handshake.
+    """
+
+    name = ""
+
+    def dumps(self, value: Any) -> bytes:
+        """
+        Parameters:
+            value (Any): The value to encode, made of dicts, lists, strings, numbers, booleans and None.
+
+        Returns:
+            bytes: The encoded value.
+        """
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        """
+        Parameters:
+            data (bytes): The encoded value.
+
+        Returns:
+            Any: The decoded value.
+
+        Raises:
+            ValueError: If the data isn't a valid encoded value.
+        """
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+    """
+    The format of the original protocol, always available.
+    """
+
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def loads(self, data: bytes) -> Any:
+        # JSONDecodeError and UnicodeDecodeError are ValueErrors
+        return json.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Binary encoding, faster to encode and decode and smaller than JSON, needs the msgpack package.
+    """
+
+    name = "msgpack"
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack {e}")
+
+
+json_serializer = JsonSerializer()
+# Name -> Serializer of the serializations that can be used here, in order of preference
+serializers: Dict[str, Serializer] = {}
+if msgpack is not None:
+    serializers[MsgpackSerializer.name] = MsgpackSerializer()
+serializers[JsonSerializer.name] = json_serializer
+supported_serializations: List[str] = list(serializers)
+
+
+def get_serializer(features: Json) -> Serializer:
+    """
+    Get the serialization of a connection.
+
+    Parameters:
+        features (Json): The features negotiated on the connection.
+
+    Returns:
+        Serializer: The negotiated serialization, JSON if none was negotiated.
+    """
+    return serializers[features.get("serialization", JsonSerializer.name)]
@@ -1,62 +1,108 @@
+import json
+import os
 import socket
-from threading import Thread
-from typing import Dict, List, Optional, Tuple
+from secrets import token_urlsafe
+from threading import Lock, Thread, current_thread
+from time import monotonic
+from typing import Dict, Iterator, List, Optional, Tuple, cast
 from queue import Queue
 from encryption import EncryptionState
-import select
-import compress
-from gitgud_types import Address
-
+import selectors
+from compression import get_compression, looks_incompressible
+from serialization import get_serializer
+from tracing import Trace, span
+from gitgud_types import Address, Json
+from framing import (
+    frame_message,
+    frame_stream_chunk,
+    frame_stream_end,
+    recv_exact,
+    recv_frame,
+    send_frame,
+    stream_chunk_size,
+)
 
 encryption_length_size = 3
 regular_length_size = 4
 file_token_length_size = 3
 file_length_size = 9
+session_length_size = 9
+
+
+capture_lock = Lock()
 
 
-def decompress_bytes(data: bytes) -> str:
+def capture_message(message: bytes, features: Json):
+    """
+    Append a protocol message to the file in COMPRESSION_CAPTURE if it's set, as a line of JSON whatever its serialization,
+    captured messages are what train_dictionary.py trains the compression dictionary on.
+
+    Parameters:
+        message (bytes): The decompressed message.
+        features (Json): The features negotiated on the connection.
+    """
+    path = os.getenv("COMPRESSION_CAPTURE")
+    if not path:
+        return
+    try:
+        text = json.dumps(get_serializer(features).loads(message))
+    except ValueError:
+        return
+    with capture_lock:
+        with open(path, "a") as f:
+            f.write(text + "\n")
+
+
+def decompress_bytes(data: bytes, features: Json) -> bytes:
     """
-    Decompresses a byte string using the gzip algorithm and returns the decompressed string.
+    Decompresses a byte string with the compression negotiated on a connection and returns the decompressed message.
 
     Parameters:
         data (bytes): The byte string to be decompressed.
+        features (Json): The features negotiated on the connection, plain gzip if no compression was negotiated.
 
     Returns:
-        str: The decompressed string.
+        bytes: The decompressed message, encoded with the negotiated serialization.
 
     Raises:
-        ValueError: If the input data is not in a valid gzip format.
+        ValueError: If the input data is not in a valid format.
     """
-    return compress.decompress_bytes_to_str(compress.Algorithm.gzip, data)
+    message = get_compression(features).decompress(data)
+    capture_message(message, features)
+    return message
 
 
-def compress_str(data: str) -> bytes:
+def compress_message(message: Json, features: Json) -> bytes:
     """
-    Compresses a string using the gzip algorithm and returns the compressed bytes.
+    Encodes a message with the serialization negotiated on a connection and compresses it with the negotiated compression.
 
     Parameters:
-        data (str): The string to be compressed.
+        message (Json): The message to be sent.
+        features (Json): The features negotiated on the connection, JSON and plain gzip if nothing was negotiated.
 
     Returns:
         bytes: The compressed bytes.
-
-    Raises:
-        ValueError: If the input data is not a valid string.
     """
-    return compress.compress_str_to_bytes(compress.Algorithm.gzip, data)
+    data = get_serializer(features).dumps(message)
+    capture_message(data, features)
+    return get_compression(features).compress(data, incompressible=False)
 
 
-def compress_bytes(data: bytes) -> bytes:
+def compress_bytes(
+    data: bytes, features: Json, incompressible: Optional[bool] = None
+) -> bytes:
     """
-    Compresses a byte string using the gzip algorithm and returns the compressed bytes.
+    Compresses a byte string with the compression negotiated on a connection and returns the compressed bytes.
 
     Parameters:
         data (bytes): The byte string to be compressed.
+        features (Json): The features negotiated on the connection, plain gzip if no compression was negotiated.
+        incompressible (Optional[bool], optional): Whether the data is stored as is, detected from the data if None. Defaults to None.
 
     Returns:
         bytes: The compressed bytes.
     """
-    return compress.compress_bytes_to_bytes(compress.Algorithm.gzip, data)
+    return get_compression(features).compress(data, incompressible)
 
 
 def recv(soc: socket.socket, length_size: int) -> bytes:
@@ -70,8 +116,8 @@ def recv(soc: socket.socket, length_size: int) -> bytes:
     Returns:
     - bytes: The data received from the socket.
     """
-    length_of_data = int(soc.recv(length_size).decode())
-    return soc.recv(length_of_data)
+    length_of_data = int(recv_exact(soc, length_size).decode())
+    return bytes(recv_exact(soc, length_of_data))
 
 
 def send(soc: socket.socket, data: bytes, length_size: int):
@@ -86,91 +132,285 @@ def send(soc: socket.socket, data: bytes, length_size: int):
     No return value.
     """
     length_bytes = str(len(data)).zfill(length_size).encode()
-    soc.send(length_bytes + data)
+    soc.sendall(length_bytes + data)
+
+
+def recv_message(
+    soc: socket.socket, encryption: EncryptionState, length_size: int
+) -> bytes:
+    """
+    A function that receives an encrypted message from a client,
+    in a binary frame if the client negotiated binary framing and with a decimal length prefix otherwise.
+
+    Parameters:
+    - soc: The socket of the client.
+    - encryption: The encryption state of the client, holding the negotiated features.
+    - length_size: The size of the decimal length prefix.
+
+    Returns:
+    - bytes: The encrypted message.
+    """
+    if encryption.features.get("framing") != "binary":
+        return recv(soc, length_size)
+
+    (kind, _, data) = recv_frame(soc)
+    if kind != frame_message:
+        raise ValueError("Unexpected frame kind")
+    return data
+
+
+def send_message(
+    soc: socket.socket, encryption: EncryptionState, data: bytes, length_size: int
+):
+    """
+    A function that sends an encrypted message to a client,
+    in a binary frame if the client negotiated binary framing and with a decimal length prefix otherwise.
+
+    Parameters:
+    - soc: The socket of the client.
+    - encryption: The encryption state of the client, holding the negotiated features.
+    - data: The encrypted message.
+    - length_size: The size of the decimal length prefix.
+
+    No return value.
+    """
+    if encryption.features.get("framing") == "binary":
+        send_frame(soc, frame_message, data)
+    else:
+        send(soc, data, length_size)
+
+
+def stream_chunks(data: bytes, features: Json) -> Iterator[bytes]:
+    """
+    A function that splits file content into the chunks of a stream and compresses each one on its own,
+    content that looks incompressible is checked once and all its chunks are stored.
+
+    Parameters:
+    - data: The file content.
+    - features: The features negotiated on the connection.
+
+    Returns:
+    - Iterator[bytes]: The compressed chunks.
+    """
+    incompressible = looks_incompressible(data)
+    view = memoryview(data)
+    for start in range(0, len(data), stream_chunk_size):
+        yield compress_bytes(
+            bytes(view[start : start + stream_chunk_size]), features, incompressible
+        )
+
 
+def stream_frames(encryption: EncryptionState, data: bytes) -> Iterator[bytes]:
+    """
+    A function that splits file content into the payloads of stream chunk frames,
+    each chunk is compressed and encrypted on its own so it can be sent as soon as it is ready.
+    The chunks have to be sent as they are produced, records are encrypted in the order they are sent.
+
+    Parameters:
+    - encryption: The encryption state of the connection.
+    - data: The file content.
 
-class FileComm:
-    def __init__(self, data: bytes, token: str):
+    Returns:
+    - Iterator[bytes]: The encrypted chunks.
+    """
+    for chunk in stream_chunks(data, encryption.features):
+        yield encryption.encrypt(chunk)
+
+
+def stream_request_id(response: Json) -> int:
+    """
+    A function that gets the request id to tag stream frames of a response with,
+    0 when the request wasn't sent over a session.
+
+    Parameters:
+    - response: The response the stream belongs to.
+
+    Returns:
+    - int: The request id for the frame header.
+    """
+    request_id = response.get("requestId")
+    if isinstance(request_id, int) and 0 <= request_id < 2**32:
+        return request_id
+    return 0
+
+
+class PendingTransfer:
+    def __init__(self, data: bytes, expires_at: float):
         """
-        Initializes a new instance of the FileComm class.
+        Initializes a new instance of the PendingTransfer class,
+        file content waiting for its client to claim it from the TransferServer.
 
         Parameters:
-            data (bytes): The data to be stored in the FileComm object.
-            token (str): The token to be stored in the FileComm object.
+            data (bytes): The file content.
+            expires_at (float): `time.monotonic()` after which the transfer is dropped.
 
         Returns:
             None
         """
         self.data = data
-        self.token = token
-        self.running = False
-        self.start_listeneing()
+        self.expires_at = expires_at
 
-    def start_listeneing(self):
-        """
-        Start listening for incoming connections in a separate thread.
 
-        This method creates a new thread and assigns the `_listen` method as the target for that thread. The `_listen` method is responsible for listening for incoming connections and handling them.
+class TransferServer:
+    def __init__(
+        self,
+        port: int = 0,
+        ttl: float = 60,
+        memory_budget: int = 256 * 1024 * 1024,
+        handshake_timeout: float = 10,
+    ):
+        """
+        Initializes a new instance of the TransferServer class.
+        One long lived listener serving every file transfer,
+        clients claim the file content registered under a token on a connection of their own.
 
         Parameters:
-            None
+            port (int, optional): The port to listen on, 0 lets the os pick one. Defaults to 0.
+            ttl (float, optional): Seconds an unclaimed transfer is kept. Defaults to 60.
+            memory_budget (int, optional): Most bytes of file content kept pending at once. Defaults to 256 MiB.
+            handshake_timeout (float, optional): Seconds a client gets to send its token. Defaults to 10.
 
         Returns:
             None
         """
-        thread = Thread(target=self._listen)
-        thread.start()
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.handshake_timeout = handshake_timeout
+        self.lock = Lock()
+        # Token -> Transfer
+        self.transfers: Dict[str, PendingTransfer] = {}
+        self.pending_bytes = 0
 
-    def get_port(self) -> int:
+        self.soc = socket.socket()
+        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.soc.bind(("0.0.0.0", port))
+        self.soc.listen()
+        # Wake up once a second to drop expired transfers even when no client connects
+        self.soc.settimeout(1)
+        self.port: int = self.soc.getsockname()[1]
+        Thread(target=self._listen, daemon=True).start()
+
+    def add(self, data: bytes) -> Optional[str]:
         """
-        Returns port of file communication that was selected randomly by os
+        Register file content for a client to claim.
+
+        Parameters:
+            data (bytes): The file content.
+
+        Returns:
+            Optional[str]: The token to claim the content with, None if it doesn't fit in the memory budget.
         """
-        while not self.running:
-            pass
-        return self.soc.getsockname()[1]
+        token = token_urlsafe(32)
+        with self.lock:
+            self._evict_expired()
+            if self.pending_bytes + len(data) > self.memory_budget:
+                return None
+            self.transfers[token] = PendingTransfer(data, monotonic() + self.ttl)
+            self.pending_bytes += len(data)
+        return token
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: The number of pending transfers and the bytes they hold.
+        """
+        with self.lock:
+            return {
+                "pendingTransfers": len(self.transfers),
+                "pendingBytes": self.pending_bytes,
+            }
+
+    def _claim(self, token: str) -> Optional[bytes]:
+        """
+        Remove a transfer from the registry, a token can only be claimed once.
+
+        Parameters:
+            token (str): The token of the transfer.
+
+        Returns:
+            Optional[bytes]: The file content, None if the token is unknown or expired.
+        """
+        with self.lock:
+            transfer = self.transfers.pop(token, None)
+            if transfer is None:
+                return None
+            self.pending_bytes -= len(transfer.data)
+            if transfer.expires_at < monotonic():
+                return None
+            return transfer.data
+
+    def _evict_expired(self):
+        """
+        Drop the transfers nobody claimed in time, the lock must be held.
+        """
+        now = monotonic()
+        expired = [t for (t, p) in self.transfers.items() if p.expires_at < now]
+        for token in expired:
+            self.pending_bytes -= len(self.transfers.pop(token).data)
+        if expired:
+            print(
+                f"Dropped {len(expired)} unclaimed transfers,",
+                f"{len(self.transfers)} pending ({self.pending_bytes} bytes)",
+            )
 
     def _listen(self):
         """
-        Listen for incoming connections,
-        establish encryption,
+        Accept transfer connections, each one is served on a short lived thread.
+        """
+        while True:
+            try:
+                (client, _) = self.soc.accept()
+            except socket.timeout:
+                with self.lock:
+                    self._evict_expired()
+                continue
+            Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client: socket.socket):
+        """
+        Establish encryption,
         receive file request,
         validate file request,
         send file,
         then close the connection.
-        """
-        self.soc = socket.socket()
-        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.soc.bind(("0.0.0.0", 0))
-        self.soc.listen(1)
-        self.running = True
-        encryption = EncryptionState()
-
-        (client, _) = self.soc.accept()
 
-        send(client, encryption.get_initial_public_message(), encryption_length_size)
-        encryption_response = recv(client, encryption_length_size)
-        encryption.set_encryption_key(encryption_response)
-
-        token_encrypted = recv(client, file_token_length_size)
-        token = encryption.decrypt(token_encrypted).decode()
-
-        if token == self.token:
-            data_compressed = compress_bytes(self.data)
-            data_encrypted = encryption.encrypt(data_compressed)
-            send(client, data_encrypted, file_length_size)
-
-        client.close()
-        self.soc.close()
-        del self.soc
+        Parameters:
+            client (socket.socket): The connection of the client.
+        """
+        try:
+            client.settimeout(self.handshake_timeout)
+            encryption = EncryptionState()
+            send(
+                client, encryption.get_initial_public_message(), encryption_length_size
+            )
+            encryption_response = recv(client, encryption_length_size)
+            encryption.set_encryption_key(encryption_response)
+            accept_message = encryption.get_accept_message()
+            if accept_message is not None:
+                send(client, accept_message, encryption_length_size)
+
+            token_encrypted = recv(client, file_token_length_size)
+            token = encryption.decrypt(token_encrypted).decode()
+
+            data = self._claim(token)
+            if data is not None:
+                client.settimeout(None)
+                data_compressed = compress_bytes(data, encryption.features)
+                data_encrypted = encryption.encrypt(data_compressed)
+                send(client, data_encrypted, file_length_size)
+        except Exception as e:
+            print("File transfer failed", e)
+        finally:
+            client.close()
 
 
 class ServerComm:
-    def __init__(self, queue: Queue[Tuple[str, Address]]) -> None:
+    def __init__(self, queue: Queue[Tuple[bytes, Address, Trace]]) -> None:
         """
         Initializes a new instance of the ServerComm class.
 
         Parameters:
-            queue (Queue[Tuple[str, Address]]): The queue for handling incoming requests.
+            queue (Queue[Tuple[bytes, Address, Trace]]): The queue for handling incoming requests.
 
         Returns:
             None
@@ -178,41 +418,46 @@ class ServerComm:
         self.server_socket = socket.socket()
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.open_sockets: Dict[Address, Tuple[socket.socket, EncryptionState]] = {}
+        self.selector = selectors.DefaultSelector()
+        # Closes requested by other threads, done on the listening thread so the selector is only used by it
+        self.pending_disconnects: Queue[socket.socket] = Queue()
+        (self.wakeup_reader, self.wakeup_writer) = socket.socketpair()
+        self.listen_thread: Optional[Thread] = None
         self.logic_queue = queue
         self.running = False
 
-    def _get_addr_of_socket(self, soc: socket.socket) -> Optional[Address]:
-        """
-        Get the address of socket if it is part of the open_clients
-
-        Parameters:
-            soc (socket.socket): Socket to get address of
-        """
-        for k, v in self.open_sockets.items():
-            if v[0] is soc:
-                return k
-        return None
-
     def _listen(self, port: int):
         """
         Listens on a specified port for incoming connections and reads data from the sockets.
 
+        Sockets are registered once in the selector with their address and encryption state
+        attached as data, so readiness checks don't depend on the number of open connections.
+
         Parameters:
             port (int): The port number to listen on.
         """
         self.server_socket.bind(("0.0.0.0", port))
-        self.server_socket.listen(4)
+        self.server_socket.listen(128)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, None)
         while self.running:
-            current_sockets = [conn[0] for conn in self.open_sockets.values()]
-            rlist: List[socket.socket]
-            rlist, _, _ = select.select(
-                [self.server_socket] + current_sockets, current_sockets, [], 0.1
-            )
-            self._read_sockets(rlist)
+            events = self.selector.select(0.1)
+            self._read_sockets(events)
+            self._close_pending_disconnects()
+
+        for addr in list(self.open_sockets):
+            self._disconnect_client(addr)
+        self._close_pending_disconnects()
+        self.selector.close()
+        self.server_socket.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
 
     def _disconnect_client(self, addr: Address):
         """
         Disconnects a client from the server by removing its socket from the `open_sockets` dictionary and closing the socket.
+        Called from another thread the close is handed to the listening thread, which is woken up to do it,
+        since the selector isn't safe to change while it is selecting.
 
         Parameters:
             addr (Address): The address of the client to disconnect.
@@ -220,23 +465,69 @@ class ServerComm:
         Returns:
             None
         """
-        if addr in self.open_sockets:
-            soc = self.open_sockets[addr]
-            del self.open_sockets[addr]
-            soc[0].close()
+        if addr not in self.open_sockets:
+            return
+        (soc, _) = self.open_sockets.pop(addr)
+        self._schedule_close(soc)
+
+    def _schedule_close(self, soc: socket.socket):
+        """
+        Close a socket that was removed from `open_sockets`,
+        directly on the listening thread and by waking up the listening thread from any other thread.
+
+        Parameters:
+            soc (socket.socket): The socket to close.
+
+        Returns:
+            None
+        """
+        if current_thread() is self.listen_thread:
+            self._close_socket(soc)
+            return
+
+        self.pending_disconnects.put(soc)
+        try:
+            self.wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _close_pending_disconnects(self):
+        """
+        Close the sockets other threads disconnected, runs on the listening thread.
+        """
+        while not self.pending_disconnects.empty():
+            self._close_socket(self.pending_disconnects.get())
 
-    def _read_sockets(self, rlist: List[socket.socket]):
+    def _close_socket(self, soc: socket.socket):
+        """
+        Removes a socket from the selector and closes it, must run on the listening thread.
+
+        Parameters:
+            soc (socket.socket): The socket to close.
+
+        Returns:
+            None
+        """
+        try:
+            self.selector.unregister(soc)
+        except (KeyError, ValueError):
+            pass
+        soc.close()
+
+    def _read_sockets(self, events: List[Tuple[selectors.SelectorKey, int]]):
         """
         Read sockets and handle new client connections or received messages.
 
         Parameters:
-            rlist (List[socket.socket]): List of socket objects to read from.
+            events (List[Tuple[selectors.SelectorKey, int]]): Ready selector keys, the data of each client key is its address and encryption state.
 
         Returns:
             None
         """
-        for soc in rlist:
-            if soc is self.server_socket:
+        for key, _ in events:
+            if key.fileobj is self.wakeup_reader:
+                self.wakeup_reader.recv(4096)
+            elif key.fileobj is self.server_socket:
                 try:
                     new_client, addr = self.server_socket.accept()
                     self._new_client(new_client, addr)
@@ -244,30 +535,116 @@ class ServerComm:
                     print("Error on new client")
                     continue
             else:
-                addr = self._get_addr_of_socket(soc)
-                if not addr:
+                soc = cast(socket.socket, key.fileobj)
+                (addr, encryption) = cast(Tuple[Address, EncryptionState], key.data)
+                if addr not in self.open_sockets:
+                    # Disconnected by another thread, closed after this round of events
                     continue
 
-                if self.open_sockets[addr][1].finished_encryption():
+                if encryption.finished_encryption():
                     self._on_message_receive(soc, addr)
                 else:
                     self._on_receive_encryption(soc, addr)
 
-    def send_and_close(self, addr: Address, data: str):
+    def client_features(self, addr: Address) -> Json:
+        """
+        Get the protocol features the client at the given address negotiated.
+
+        Parameters:
+            addr (Address): The address of the client.
+
+        Returns:
+            Json: The negotiated features, empty if the client is no longer connected.
+        """
+        if addr not in self.open_sockets:
+            return {}
+        return self.open_sockets[addr][1].features
+
+    def _send(
+        self,
+        soc: socket.socket,
+        encryption: EncryptionState,
+        response: Json,
+        file: Optional[bytes],
+        length_size: int,
+    ):
         """
-        Send data and close the socket for the given address.
+        Send a response and the file content streamed after it.
+
+        Parameters:
+            soc (socket.socket): The socket of the client.
+            encryption (EncryptionState): The encryption state of the client.
+            response (Json): The response to send.
+            file (Optional[bytes]): File content to stream after the response, the client needs to have negotiated inline streams.
+            length_size (int): The size of the decimal length prefix if binary framing wasn't negotiated.
+
+        Returns:
+            None
+        """
+        with span("compress"):
+            compressed_response = compress_message(response, encryption.features)
+        with encryption.send_lock:
+            with span("encrypt"):
+                data_to_send = encryption.encrypt(compressed_response)
+            with span("send"):
+                send_message(soc, encryption, data_to_send, length_size)
+            if file is None:
+                return
+
+            request_id = stream_request_id(response)
+            with span("stream"):
+                for chunk in stream_frames(encryption, file):
+                    send_frame(soc, frame_stream_chunk, chunk, request_id)
+                send_frame(soc, frame_stream_end, b"", request_id)
+
+    def send_and_close(
+        self, addr: Address, response: Json, file: Optional[bytes] = None
+    ):
+        """
+        Send a response and close the socket for the given address.
 
         Parameters:
             addr (Address): The address to send the data to.
-            data (str): The data to be sent.
+            response (Json): The response to be sent.
+            file (Optional[bytes]): File content to stream after the response. Defaults to None.
 
         Returns:
             None
         """
-        (soc, encyption) = self.open_sockets[addr]
-        data_to_send = encyption.encrypt(compress_str(data))
-        send(soc, data_to_send, regular_length_size)
-        self._disconnect_client(addr)
+        # Removed before sending so the client hanging up isn't reported as an error
+        (soc, encyption) = self.open_sockets.pop(addr)
+        try:
+            self._send(soc, encyption, response, file, regular_length_size)
+        finally:
+            self._schedule_close(soc)
+
+    def send_response(
+        self, addr: Address, response: Json, file: Optional[bytes] = None
+    ):
+        """
+        Send a response to the given address,
+        the connection is kept open if the client negotiated a session and closed otherwise.
+
+        Parameters:
+            addr (Address): The address to send the data to.
+            response (Json): The response to be sent.
+            file (Optional[bytes]): File content to stream after the response. Defaults to None.
+
+        Returns:
+            None
+        """
+        if addr not in self.open_sockets:
+            return
+        (soc, encryption) = self.open_sockets[addr]
+        if not encryption.features.get("session"):
+            self.send_and_close(addr, response, file)
+            return
+
+        try:
+            self._send(soc, encryption, response, file, session_length_size)
+        except Exception as e:
+            print(f"Disconnecting {addr}", e)
+            self._disconnect_client(addr)
 
     def _on_message_receive(self, soc: socket.socket, addr: Address):
         """
@@ -280,15 +657,27 @@ class ServerComm:
         Returns:
             None
         """
+        encryption = self.open_sockets[addr][1]
+        length_size = (
+            session_length_size
+            if encryption.features.get("session")
+            else regular_length_size
+        )
         try:
-            data_bytes = recv(soc, regular_length_size)
-            data_decrypted = self.open_sockets[addr][1].decrypt(data_bytes)
-            data_decompressed = decompress_bytes(data_decrypted)
+            data_bytes = recv_message(soc, encryption, length_size)
+            trace = Trace()
+            with trace.span("decrypt"):
+                data_decrypted = encryption.decrypt(data_bytes)
+            with trace.span("decompress"):
+                data_decompressed = decompress_bytes(
+                    data_decrypted, encryption.features
+                )
         except Exception as e:
             print(f"Disconnecting {addr}", e)
             self._disconnect_client(addr)
             return
-        self.logic_queue.put((data_decompressed, addr))
+        trace.queued_at = monotonic()
+        self.logic_queue.put((data_decompressed, addr, trace))
 
     def _on_receive_encryption(self, soc: socket.socket, addr: Address):
         """
@@ -300,7 +689,11 @@ class ServerComm:
         """
         try:
             encryption_response_bytes = recv(soc, encryption_length_size)
-            self.open_sockets[addr][1].set_encryption_key(encryption_response_bytes)
+            encryption = self.open_sockets[addr][1]
+            encryption.set_encryption_key(encryption_response_bytes)
+            accept_message = encryption.get_accept_message()
+            if accept_message is not None:
+                send(soc, accept_message, encryption_length_size)
         except Exception as e:
             print(f"Disconnecting {addr}", e)
             self._disconnect_client(addr)
@@ -319,6 +712,7 @@ class ServerComm:
         """
         encryption = EncryptionState()
         self.open_sockets[addr] = (soc, encryption)
+        self.selector.register(soc, selectors.EVENT_READ, (addr, encryption))
 
         encryption_initial_message = encryption.get_initial_public_message()
         try:
@@ -341,5 +735,5 @@ class ServerComm:
             None
         """
         self.running = True
-        thread = Thread(target=self._listen, args=(port,))
-        thread.start()
+        self.listen_thread = Thread(target=self._listen, args=(port,))
+        self.listen_thread.start()
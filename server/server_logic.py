@@ -1,13 +1,27 @@
-import json
-from typing import Dict, List, Tuple, cast, Union, Optional
+from contextlib import contextmanager
+from threading import Lock, local
+from typing import Dict, Iterator, List, Tuple, cast, Union, Optional
 import datetime
 from gitdb.util import os
 from database import DB
 from git_manager import GitManager
+from lane_pool import LanePool
 from queue import Queue
-from git_utils import commits_between_branches, get_diff_json
+from git_utils import (
+    commits_between_branches,
+    diff_format_version,
+    get_diff_json,
+    read_blob_range,
+)
+from profiling import SlowActionProfiler
 from repo_clone import repo_clone
+from repo_locks import RepoLocks
+from serialization import get_serializer
+from session_store import SessionStore, create_session_store
+from single_flight import SingleFlight
+from tracing import LatencyStats, Trace, activate, current_trace, span
 from server_protocol import (
+    pack_batch,
     pack_branches,
     pack_commit,
     pack_commits,
@@ -16,14 +30,19 @@ from server_protocol import (
     pack_create_repo,
     pack_delete_issue,
     pack_delete_pr,
-    pack_diff,
     pack_error,
+    pack_file,
+    pack_file_value,
+    pack_file_range,
     pack_issue,
     pack_login,
+    pack_not_modified,
     pack_project_dirs,
     pack_pull_request,
     pack_register,
     pack_search_repo,
+    pack_server_stats,
+    pack_stream,
     pack_update_issue,
     pack_update_pr,
     pack_validate_token,
@@ -33,8 +52,16 @@ from server_protocol import (
     unpack,
 )
 from git import BadName, Repo, Commit as GitCommit
-from server_comm import FileComm, ServerComm
-from gitgud_types import Action, IssuePr, Json, Address, commit_page_size
+from server_comm import ServerComm, TransferServer
+from gitgud_types import (
+    Action,
+    IssuePr,
+    Json,
+    Address,
+    Lane,
+    batch_max_size,
+    commit_page_size,
+)
 from secrets import token_urlsafe
 from fuzzywuzzy import process
 
@@ -43,41 +70,194 @@ from ssh_validation import validate_pubkey
 
 
 class ServerLogic:
-    def __init__(self, port: int):
+    def __init__(self, port: int, listen: bool = True):
         """
         Initializes a new instance of the ServerLogic class.
+        Requests run concurrently on the worker pool of their lane (see `get_actions`),
+        FAST_WORKERS threads (defaults to 4) for cheap database requests
+        and GIT_WORKERS threads (defaults to the `ThreadPoolExecutor` default, min(32, cores + 4)) for requests doing git work.
+        Each worker thread has its own database connection and the shared `./cache` clones are locked per repository.
 
         Parameters:
             port (int): The port number to listen on.
+            listen (bool, optional): Start the threaded ServerComm front end, False when another front end (asyncio) feeds requests. Defaults to True.
 
         Returns:
             None
         """
         self.port = port
-        self.queue: Queue[Tuple[str, Address]] = Queue()
-        # Connection Token -> Username
-        self.connected_client: Dict[str, str] = {}
-        self.server_comm = ServerComm(self.queue)
-        self.server_comm.start_listeneing(port)
-        self.db = DB()
+        self.queue: Queue[Tuple[bytes, Address, Trace]] = Queue()
+        # Connection Token -> Username, configured by SESSION_STORE
+        self.sessions: SessionStore = create_session_store(lambda: self.db)
+        self.server_comm: Optional[ServerComm] = None
+        if listen:
+            self.server_comm = ServerComm(self.queue)
+            self.server_comm.start_listeneing(port)
+        self.transfer_server = TransferServer(
+            int(os.getenv("TRANSFER_PORT", "0")),
+            float(os.getenv("TRANSFER_TTL", "60")),
+            int(os.getenv("TRANSFER_MEMORY_BUDGET", str(256 * 1024 * 1024))),
+        )
+        self.thread_state = local()
+        self.repo_locks = RepoLocks()
+        # Identical read requests in flight share one computation, see stats() for how many were coalesced
+        self.single_flight = SingleFlight()
+        # Latency histograms of every action and its stages, reported by serverStats
+        self.latency_stats = LatencyStats()
+        # Profiles actions slower than PROFILE_SLOW_MS, off when it's unset
+        self.profiler = SlowActionProfiler()
+        # The gitolite admin repo is a single working tree committed to by register and createRepo
+        self.git_manager_lock = Lock()
         self.git_manager = GitManager("../gitolite-admin")
         self.actions = self.get_actions()
+        fast_workers = os.getenv("FAST_WORKERS")
+        git_workers = os.getenv("GIT_WORKERS")
+        self.lanes: Dict[Lane, LanePool] = {
+            "fast": LanePool(
+                max_workers=int(fast_workers) if fast_workers else 4,
+                thread_name_prefix="fast",
+            ),
+            "git": LanePool(
+                max_workers=int(git_workers) if git_workers else None,
+                thread_name_prefix="git",
+            ),
+        }
+
+    @property
+    def db(self) -> DB:
+        """
+        Returns:
+            DB: The database connection of the current thread, a psycopg2 cursor can't be shared between threads.
+        """
+        db = getattr(self.thread_state, "db", None)
+        if db is None:
+            db = DB()
+            self.thread_state.db = db
+        return db
 
     def tick(self):
         """
-        Process a request from the queue, apply an action, and send the response back to the client.
+        Take a request from the queue and hand it to the worker pool of its lane.
+        """
+        (request, addr, trace) = self.queue.get()
+        features = cast(ServerComm, self.server_comm).client_features(addr)
+        self.lane_of(request, features).submit(self.run_request, request, addr, trace)
+
+    def lane_of(self, request: bytes, features: Json) -> LanePool:
+        """
+        Find the worker pool of the lane a request runs in.
+
+        Parameters:
+            request (bytes): The decompressed and decrypted request.
+            features (Json): The features negotiated on the request's connection.
+
+        Returns:
+            LanePool: The worker pool, the fast lane for requests that will fail validation.
+        """
+        try:
+            request_type = get_serializer(features).loads(request)["type"]
+            lane = self.actions[request_type][2]
+        except Exception:
+            lane = "fast"
+        return self.lanes[lane]
+
+    def run_request(self, request: bytes, addr: Address, trace: Trace):
+        """
+        Apply the action of a request and send the response back to the client, runs on a worker thread.
+
+        Parameters:
+            request (bytes): The decompressed and decrypted request.
+            addr (Address): The address of the client.
+            trace (Trace): The trace of the request, counted in the latency stats once the response is sent.
+
+        Returns:
+            None
+        """
+        server_comm = cast(ServerComm, self.server_comm)
+        with activate(trace):
+            trace.dequeued()
+            try:
+                features = server_comm.client_features(addr)
+                (response, file) = self.handle_request(request, features)
+                server_comm.send_response(addr, response, file)
+            except Exception as e:
+                print(f"[trace {trace.trace_id}] Request of {addr} failed", e)
+        self.latency_stats.finish(trace)
+
+    def handle_request(
+        self, request: bytes, features: Json
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Unpack a raw request, apply its action and pack the response, errors are returned as error responses.
+        The "requestId" of a request sent over a session is copied to its response.
+        Stages are recorded into the current thread's trace (tracing.py), internal errors are logged and answered with its "traceId".
+
+        Parameters:
+            request (bytes): The decompressed and decrypted request.
+            features (Json): The features negotiated on the request's connection, its serialization and whether file content is streamed inline.
+
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response to send back to the client and file content to stream right after it.
         """
-        (request, addr) = self.queue.get()
         response: Json
+        request_id = None
+        trace = current_trace()
         try:
-            json_request = unpack(request)
-            response = self.apply_action(json_request)
+            json_request = unpack(request, get_serializer(features))
+            request_id = json_request.get("requestId")
+            if trace is not None and json_request["type"] in self.actions:
+                trace.action = json_request["type"]
+            with span("action"):
+                response = self.apply_action(json_request)
         except ValueError as e:
             response = pack_error(str(e))
         except Exception as e:
             response = pack_error(f"Internal Server error {e}")
+            if trace is not None:
+                print(f"[trace {trace.trace_id}] Internal Server error", e)
+                response["traceId"] = trace.trace_id
+
+        (response, file) = self.deliver_file(response, features)
+        if request_id is not None:
+            response = {**response, "requestId": request_id}
+        return (response, file)
+
+    def deliver_file(
+        self, response: Json, features: Json
+    ) -> Tuple[Json, Optional[bytes]]:
+        """
+        Replace file content in a response (`pack_file`) with the way the client receives it.
+        Structured content (`pack_file_value`) is encoded with the connection's serialization first, named by "fileFormat".
+
+        Parameters:
+            response (Json): The response of an action.
+            features (Json): The features negotiated on the connection, with inlineStream the content is streamed on it instead of starting a file transfer.
 
-        self.server_comm.send_and_close(addr, json.dumps(response))
+        Returns:
+            Tuple[Json, Optional[bytes]]: The response to send and the file content to stream after it, if any.
+        """
+        if "fileValue" in response:
+            serializer = get_serializer(features)
+            with span("serialize"):
+                data = serializer.dumps(response["fileValue"])
+            response = {
+                **{k: v for k, v in response.items() if k != "fileValue"},
+                "fileFormat": serializer.name,
+            }
+        elif "fileData" in response:
+            data = cast(bytes, response["fileData"])
+            response = {k: v for k, v in response.items() if k != "fileData"}
+        else:
+            return (response, None)
+
+        if features.get("inlineStream", False):
+            return ({**response, **pack_stream(len(data))}, data)
+
+        with span("transfer"):
+            token = self.transfer_server.add(data)
+        if token is None:
+            return (pack_error("Server busy, try again later"), None)
+        return ({**response, **pack_view_file(self.transfer_server.port, token)}, None)
 
     def apply_action(self, json: Json) -> Json:
         """
@@ -93,63 +273,90 @@ class ServerLogic:
         if request_type not in self.actions:
             return pack_error("Invalid type")
 
-        (action, required_keys) = self.actions[request_type]
+        (action, required_keys, _) = self.actions[request_type]
         if not all(required_key in json for required_key in required_keys):
             return pack_error("Invalid keys in request")
         if (
             "connectionToken" in required_keys
-            and json["connectionToken"] not in self.connected_client
+            and json["connectionToken"] not in self.sessions
         ):
             return pack_error("Invalid connection token")
 
-        return action(json)
+        with self.profiler.profile(request_type, json.get("repo")):
+            return action(json)
 
-    def get_actions(self) -> Dict[str, Tuple[Action, List[str]]]:
+    def get_actions(self) -> Dict[str, Tuple[Action, List[str], Lane]]:
         """
-        Returns all actions as a dictionary from the type to the function and the required keys
+        Returns all actions as a dictionary from the type to the function, the required keys
+        and the lane it runs in: "fast" for database and in memory work, "git" for anything touching a repository.
         """
         return {
-            "register": (self.register, ["username", "password", "sshKey"]),
-            "login": (self.login, ["username", "password"]),
+            "register": (self.register, ["username", "password", "sshKey"], "git"),
+            "login": (self.login, ["username", "password"], "fast"),
             "createRepo": (
                 self.create_repo,
                 ["repoName", "visibility", "connectionToken"],
+                "git",
             ),
-            "branches": (self.branches, ["repo", "connectionToken"]),
+            "branches": (self.branches, ["repo", "connectionToken"], "git"),
             "viewFile": (
                 self.view_file,
                 ["repo", "connectionToken", "filePath", "branch"],
+                "git",
             ),
             "projectDirectory": (
                 self.project_directory,
                 ["directory", "repo", "branch", "connectionToken"],
+                "git",
+            ),
+            "commits": (
+                self.commits,
+                ["repo", "connectionToken", "branch", "page"],
+                "git",
             ),
-            "commits": (self.commits, ["repo", "connectionToken", "branch", "page"]),
-            "diff": (self.diff, ["repo", "connectionToken", "hash"]),
+            "diff": (self.diff, ["repo", "connectionToken", "hash"], "git"),
             "createIssue": (
                 self.create_issue,
                 ["repo", "connectionToken", "title", "content"],
+                "fast",
             ),
-            "viewIssues": (self.view_issues, ["repo", "connectionToken"]),
-            "deleteIssue": (self.delete_issue, ["id", "connectionToken"]),
+            "viewIssues": (self.view_issues, ["repo", "connectionToken"], "fast"),
+            "deleteIssue": (self.delete_issue, ["id", "connectionToken"], "fast"),
             "updateIssue": (
                 self.update_issue,
                 ["id", "connectionToken", "title", "content"],
+                "fast",
             ),
             "createPullRequest": (
                 self.create_pull_request,
                 ["repo", "title", "connectionToken", "fromBranch", "intoBranch"],
+                "git",
+            ),
+            "viewPullRequests": (
+                self.view_pull_requests,
+                ["repo", "connectionToken"],
+                "git",
+            ),
+            "deletePullRequest": (
+                self.delete_pull_request,
+                ["id", "connectionToken"],
+                "fast",
             ),
-            "viewPullRequests": (self.view_pull_requests, ["repo", "connectionToken"]),
-            "deletePullRequest": (self.delete_pull_request, ["id", "connectionToken"]),
             "updatePullRequest": (
                 self.update_pull_request,
                 ["id", "connectionToken", "title", "fromBranch", "intoBranch"],
+                "git",
             ),
-            "prDiff": (self.pr_diff, ["connectionToken", "id"]),
-            "prCommits": (self.pr_commits, ["connectionToken", "id", "page"]),
-            "validateConnection": (self.validate_connection, ["tokenForValidation"]),
-            "searchRepo": (self.search_repo, ["searchQuery"]),
+            "prDiff": (self.pr_diff, ["connectionToken", "id"], "git"),
+            "prCommits": (self.pr_commits, ["connectionToken", "id", "page"], "git"),
+            "validateConnection": (
+                self.validate_connection,
+                ["tokenForValidation"],
+                "fast",
+            ),
+            "searchRepo": (self.search_repo, ["searchQuery"], "fast"),
+            "batch": (self.batch, ["requests", "connectionToken"], "git"),
+            "serverStats": (self.server_stats, ["connectionToken"], "fast"),
         }
 
     def generate_new_connection_token(self, username: str) -> str:
@@ -163,9 +370,79 @@ class ServerLogic:
             str: The newly generated connection token.
         """
         token = token_urlsafe(32)
-        self.connected_client[token] = username
+        self.sessions.add(token, username)
         return token
 
+    def username_of(self, connection_token: str) -> str:
+        """
+        Get the user of a connection token that was validated.
+
+        Parameters:
+            connection_token (str): The connection token.
+
+        Returns:
+            str: The user of the session.
+
+        Raises:
+            ValueError: If the session expired since it was validated.
+        """
+        username = self.sessions.username(connection_token)
+        if username is None:
+            raise ValueError("Invalid connection token")
+        return username
+
+    @contextmanager
+    def open_repo(self, repo_name: str) -> Iterator[Repo]:
+        """
+        Bring the shared clone of a repository up to date and hold its read lock while using it.
+        The clone is fetched only when it wasn't in the last REPO_FETCH_INTERVAL seconds (defaults to 2),
+        so concurrent reads of a repository share its read lock instead of each waiting for a fetch.
+        The repository needs to exist in the database.
+
+        Parameters:
+            repo_name (str): The full name of the repository, "owner/repo".
+
+        Returns:
+            Iterator[Repo]: Context manager giving the clone, read branches through their remote refs ("origin/<branch>").
+        """
+        # A batch brings each repository up to date once for all its requests
+        batch_repos: Optional[Dict[str, Repo]] = getattr(
+            self.thread_state, "batch_repos", None
+        )
+        if batch_repos is not None and repo_name in batch_repos:
+            with self.repo_locks.read(repo_name):
+                yield batch_repos[repo_name]
+            return
+
+        cloned: Optional[Repo] = None
+
+        def refresh():
+            nonlocal cloned
+            with span("repo_clone"):
+                cloned = repo_clone(repo_name)
+
+        max_age = float(os.getenv("REPO_FETCH_INTERVAL", "2"))
+        with self.repo_locks.read_fresh(repo_name, max_age, refresh):
+            repo = cloned if cloned is not None else Repo(f"./cache/{repo_name}")
+            if batch_repos is not None:
+                batch_repos[repo_name] = repo
+            yield repo
+
+    @staticmethod
+    def client_has(request: Json, content_hash: str) -> bool:
+        """
+        Check if the client already holds content, it lists the hashes of its cached content under "have".
+
+        Parameters:
+            request (Json): The request of the client.
+            content_hash (str): The hash of the content the request asks for.
+
+        Returns:
+            bool: True if the content doesn't need to be sent again.
+        """
+        have = request.get("have", [])
+        return isinstance(have, list) and content_hash in have
+
     def validate_repo_request(
         self, repo: str, connectionToken: str
     ) -> Union[Json, Tuple[int, str, bool]]:
@@ -177,6 +454,22 @@ class ServerLogic:
         Returns:
             Union[Json, Tuple[int, str, bool]]: Either repository data if valid, or an error message with status code and boolean.
         """
+        # Inside a batch the same repository is validated once
+        batch_validated: Optional[
+            Dict[Tuple[str, str], Union[Json, Tuple[int, str, bool]]]
+        ] = getattr(
+            self.thread_state, "batch_validated", None
+        )
+        if batch_validated is not None and (repo, connectionToken) in batch_validated:
+            return batch_validated[(repo, connectionToken)]
+        result = self._validate_repo_request(repo, connectionToken)
+        if batch_validated is not None:
+            batch_validated[(repo, connectionToken)] = result
+        return result
+
+    def _validate_repo_request(
+        self, repo: str, connectionToken: str
+    ) -> Union[Json, Tuple[int, str, bool]]:
         user_and_repo = repo.split("/")
         if len(user_and_repo) != 2:
             return pack_error("Invalid user and repo request")
@@ -184,7 +477,7 @@ class ServerLogic:
         sql_repo_data = self.db.repo_by_name(repo)
         if sql_repo_data is None:
             return pack_error("Invalid username or repo")
-        username = self.connected_client[connectionToken]
+        username = self.username_of(connectionToken)
 
         # You are not owner of repo and repo is not public
         if username != user_and_repo[0] and not sql_repo_data[2]:
@@ -214,7 +507,8 @@ class ServerLogic:
             return pack_error("Invalid username")
 
         self.db.add_user(username, password_hash)
-        self.git_manager.add_ssh_key(username, ssh_key)
+        with self.git_manager_lock:
+            self.git_manager.add_ssh_key(username, ssh_key)
 
         token = self.generate_new_connection_token(username)
 
@@ -251,14 +545,15 @@ class ServerLogic:
         repo_name = request["repoName"]
         visibility = request["visibility"]
         connection_token = request["connectionToken"]
-        username = self.connected_client[connection_token]
+        username = self.username_of(connection_token)
         repo_id = self.db.repo_by_name(f"{username}/{repo_name}")
         if repo_id is not None:
             return pack_error("Repository already exists")
         id = cast(int, self.db.username_to_id(username))
 
         self.db.add_repo(id, repo_name, visibility)
-        self.git_manager.create_repo(repo_name, username, visibility)
+        with self.git_manager_lock:
+            self.git_manager.create_repo(repo_name, username, visibility)
 
         return pack_create_repo(f"{username}/{repo_name}")
 
@@ -277,27 +572,30 @@ class ServerLogic:
         if isinstance(result, dict):
             return result
 
-        # Safe to clone, repo exists in database
-        r = repo_clone(full_repo_name)
-        branches = branches_of_repo(r)
-        return pack_branches(branches)
+        def compute() -> Json:
+            # Safe to clone, repo exists in database
+            with self.open_repo(full_repo_name) as r:
+                branches = branches_of_repo(r)
+                return pack_branches(branches)
+
+        return self.single_flight.run(request, compute)
 
     def view_file(self, request: Json) -> Json:
         """
         A function to view a file based on the repo, file path and branch.
 
         Parameters:
-            request (Json): A JSON object containing information about the file to be viewed.
+            request (Json): A JSON object containing information about the file to be viewed,
+                optionally the "offset" and "length" of the range to read to page through large files.
 
         Returns:
-            Json: The result of viewing the file, either the file content or an error message.
+            Json: The result of viewing the file, either the file content and its total size or an error message.
         """
         full_repo_name = cast(str, request["repo"])
         result = self.validate_repo_request(full_repo_name, request["connectionToken"])
         if isinstance(result, dict):
             return result
         file = request["filePath"]
-        token = token_urlsafe(32)
         branch = request["branch"]
 
         path = os.path.relpath(f"./cache/{full_repo_name}/{file}")
@@ -305,14 +603,37 @@ class ServerLogic:
         if not path.startswith(f"cache/{full_repo_name}"):
             return pack_error("Path out of repository")
 
-        # Safe to clone, repo exists in database
-        repo_clone(full_repo_name, branch=branch)
-        try:
-            with open(path, "rb") as f:
-                file_com = FileComm(f.read(), token)
-                return pack_view_file(file_com.get_port(), token)
-        except FileNotFoundError:
-            return pack_error("File doesn't exist")
+        offset = request.get("offset", 0)
+        length = request.get("length")
+        if not isinstance(offset, int) or offset < 0:
+            return pack_error("Invalid offset")
+        if length is not None and (not isinstance(length, int) or length < 0):
+            return pack_error("Invalid length")
+
+        def compute() -> Json:
+            # Safe to clone, repo exists in database
+            with self.open_repo(full_repo_name) as repo:
+                try:
+                    blob = repo.commit(f"origin/{branch}").tree / os.path.relpath(
+                        path, f"cache/{full_repo_name}"
+                    )
+                except (BadName, KeyError, ValueError):
+                    return pack_error("File doesn't exist")
+                if blob.type != "blob":
+                    return pack_error("File doesn't exist")
+
+                content_hash = f"blob:{blob.hexsha}:{offset}:{length}"
+                if self.client_has(request, content_hash):
+                    return pack_not_modified(content_hash)
+
+                content = read_blob_range(blob, offset, length)
+
+            return {
+                **pack_file(content, content_hash),
+                **pack_file_range(offset, blob.size),
+            }
+
+        return self.single_flight.run(request, compute)
 
     def project_directory(self, request: Json) -> Json:
         """
@@ -337,23 +658,25 @@ class ServerLogic:
         if not path.startswith(f"cache/{full_repo_name}"):
             return pack_error("Path out of repository")
 
-        # Safe to clone, repo exists in database
-        repo_clone(full_repo_name, branch=branch)
-
-        if not os.path.isdir(path):
-            return pack_error("Directory doesn't exist")
-
-        try:
-            (_, dirs, files) = next(os.walk(path))
-            if ".git" in dirs:
-                dirs.remove(".git")
-
-            dirs = map(lambda dir: f"{dir}/", dirs)
+        def compute() -> Json:
+            # Safe to clone, repo exists in database
+            with self.open_repo(full_repo_name) as repo:
+                try:
+                    tree = repo.commit(f"origin/{branch}").tree
+                    directory = os.path.relpath(path, f"cache/{full_repo_name}")
+                    if directory != ".":
+                        tree = tree / directory
+                except (BadName, KeyError, ValueError):
+                    return pack_error("Directory doesn't exist")
+                if tree.type != "tree":
+                    return pack_error("Directory doesn't exist")
+
+                dirs = [f"{dir.name}/" for dir in tree.trees]
+                files = [blob.name for blob in tree.blobs]
 
             return pack_project_dirs([*dirs, *files])
 
-        except FileNotFoundError:
-            return pack_error("File doesn't exist")
+        return self.single_flight.run(request, compute)
 
     @staticmethod
     def pack_git_commits(commits: List[GitCommit]) -> List[Json]:
@@ -395,21 +718,23 @@ class ServerLogic:
         branch = request["branch"]
         page = int(request["page"])
 
-        # Safe to clone, repo exists in database
-        r = repo_clone(full_repo_name)
-        fifty_first_commits = list(
-            r.iter_commits(
-                f"origin/{branch}",
-                skip=page * commit_page_size,
-                max_count=commit_page_size,
-            )
-        )
+        def compute() -> Json:
+            # Safe to clone, repo exists in database
+            with self.open_repo(full_repo_name) as r:
+                fifty_first_commits = list(
+                    r.iter_commits(
+                        f"origin/{branch}",
+                        skip=page * commit_page_size,
+                        max_count=commit_page_size,
+                    )
+                )
 
-        commits = pack_commits(ServerLogic.pack_git_commits(fifty_first_commits))
-        token = token_urlsafe(32)
-        file_com = FileComm(json.dumps(commits).encode(), token)
-        port = file_com.get_port()
-        return pack_view_file(port, token)
+                commits = pack_commits(
+                    ServerLogic.pack_git_commits(fifty_first_commits)
+                )
+                return pack_file_value(commits)
+
+        return self.single_flight.run(request, compute)
 
     def pr_commits(self, request: Json) -> Json:
         """
@@ -439,23 +764,27 @@ class ServerLogic:
         full_repo_name = f"{owner}/{repo_name}"
         page = int(request["page"])
 
-        # Safe to clone, repo exists in database
-        r = repo_clone(full_repo_name)
-        error = self.validate_pr_branches(r, request["id"], into_branch, from_branch)
-        if error is not None:
-            return error
+        def compute() -> Json:
+            # Safe to clone, repo exists in database
+            with self.open_repo(full_repo_name) as r:
+                error = self.validate_pr_branches(
+                    r, request["id"], into_branch, from_branch
+                )
+                if error is not None:
+                    return error
 
-        fifty_first_commits = list(
-            commits_between_branches(
-                r, f"origin/{from_branch}", f"origin/{into_branch}", page
-            )
-        )
+                fifty_first_commits = list(
+                    commits_between_branches(
+                        r, f"origin/{from_branch}", f"origin/{into_branch}", page
+                    )
+                )
 
-        commits = pack_commits(ServerLogic.pack_git_commits(fifty_first_commits))
-        token = token_urlsafe(32)
-        file_com = FileComm(json.dumps(commits).encode(), token)
-        port = file_com.get_port()
-        return pack_view_file(port, token)
+                commits = pack_commits(
+                    ServerLogic.pack_git_commits(fifty_first_commits)
+                )
+                return pack_file_value(commits)
+
+        return self.single_flight.run(request, compute)
 
     def diff(self, request: Json) -> Json:
         """
@@ -465,25 +794,33 @@ class ServerLogic:
             request (Json): A JSON object containing the repository name, connection token, and commit hash.
 
         Returns:
-            Json: A JSON object with the port and token for the diff as a file request
+            Json: A JSON object with the diff as file content
         """
         full_repo_name = cast(str, request["repo"])
         result = self.validate_repo_request(full_repo_name, request["connectionToken"])
         if isinstance(result, dict):
             return result
 
-        r = repo_clone(full_repo_name)
-        hash = request["hash"]
-        try:
-            commit = r.commit(hash)
-        except BadName:
-            return pack_error("Invalid commit hash")
+        def compute() -> Json:
+            with self.open_repo(full_repo_name) as r:
+                hash = request["hash"]
+                try:
+                    commit = r.commit(hash)
+                except BadName:
+                    return pack_error("Invalid commit hash")
 
-        token = token_urlsafe(32)
-        diff: str = commit.repo.git.show(commit.hexsha)
+                content_hash = f"diff:{commit.hexsha}:v{diff_format_version}"
+                if self.client_has(request, content_hash):
+                    return pack_not_modified(content_hash)
+
+                diff: str = commit.repo.git.show(commit.hexsha)
 
-        file_com = FileComm(json.dumps(get_diff_json(diff)).encode(), token)
-        return pack_diff(file_com.get_port(), token)
+            # Parsed after releasing the repository, the diff text is all that's needed
+            with span("get_diff_json"):
+                diff_json = get_diff_json(diff)
+            return pack_file_value(diff_json, content_hash)
+
+        return self.single_flight.run(request, compute)
 
     def create_issue(self, request: Json) -> Json:
         """
@@ -502,7 +839,7 @@ class ServerLogic:
         if isinstance(error_or_repo, dict):
             return error_or_repo
         token = request["connectionToken"]
-        username = self.connected_client[token]
+        username = self.username_of(token)
         user_id = self.db.username_to_id(username)
         assert user_id is not None
 
@@ -617,7 +954,7 @@ class ServerLogic:
         if isinstance(error_or_repo, dict):
             return error_or_repo
 
-        username = self.connected_client[request["connectionToken"]]
+        username = self.username_of(request["connectionToken"])
         user_id = self.db.username_to_id(username)
 
         # Repo validation asserts this
@@ -626,19 +963,19 @@ class ServerLogic:
         from_branch = request["fromBranch"]
         into_branch = request["intoBranch"]
         repo_id = error_or_repo[0]
-        repo = repo_clone(request["repo"])
-        branches = branches_of_repo(repo)
-        if not (from_branch in branches and into_branch in branches):
-            return pack_error("Invalid branch names")
-
-        self.db.create_pr(
-            request["title"],
-            from_branch,
-            into_branch,
-            repo_id,
-            user_id,
-        )
-        return pack_create_pull_request()
+        with self.open_repo(request["repo"]) as repo:
+            branches = branches_of_repo(repo)
+            if not (from_branch in branches and into_branch in branches):
+                return pack_error("Invalid branch names")
+
+            self.db.create_pr(
+                request["title"],
+                from_branch,
+                into_branch,
+                repo_id,
+                user_id,
+            )
+            return pack_create_pull_request()
 
     def view_pull_requests(self, request: Json) -> Json:
         """
@@ -660,18 +997,24 @@ class ServerLogic:
 
         pull_requests = self.db.pull_requests(repo_id)
 
-        repo = repo_clone(request["repo"])
-        branches = branches_of_repo(repo)
-        for i, pr in enumerate(pull_requests):
+        # Only reading the branches is shared, deleting stale pull requests writes and stays out of single-flight
+        def compute() -> Json:
+            with self.open_repo(request["repo"]) as repo:
+                return {"branches": branches_of_repo(repo)}
+
+        branches = self.single_flight.run(request, compute)["branches"]
+        open_pull_requests = []
+        for pr in pull_requests:
             (id, _, _, from_branch, into_branch, _) = pr
             if from_branch not in branches or into_branch not in branches:
-                pull_requests.pop(i)
                 self.db.delete_pr(id)
+            else:
+                open_pull_requests.append(pr)
 
         return pack_view_pull_requests(
             [
                 pack_pull_request(pr[1], pr[2], pr[3], pr[4], pr[0], pr[5])
-                for pr in pull_requests
+                for pr in open_pull_requests
             ]
         )
 
@@ -719,12 +1062,14 @@ class ServerLogic:
         )
         full_repo = f"{owner}/{repo_name}"
 
-        repo = repo_clone(full_repo)
-        error = self.validate_pr_branches(repo, request["id"], into_branch, from_branch)
-        if error is not None:
-            return error
-        self.db.update_pr(id, title, from_branch, into_branch)
-        return pack_update_pr()
+        with self.open_repo(full_repo) as repo:
+            error = self.validate_pr_branches(
+                repo, request["id"], into_branch, from_branch
+            )
+            if error is not None:
+                return error
+            self.db.update_pr(id, title, from_branch, into_branch)
+            return pack_update_pr()
 
     def validate_pr_branches(
         self, repo: Repo, id: int, into_branch: str, from_branch: str
@@ -756,7 +1101,7 @@ class ServerLogic:
             request (Json): The JSON object containing the request data.
 
         Returns:
-            Json: A JSON object with the port and token for the diff as a file request
+            Json: A JSON object with the diff as file content
         """
         error = self.validate_issue_or_pr(
             request["id"], request["connectionToken"], "PR"
@@ -775,23 +1120,31 @@ class ServerLogic:
         if into_branch.startswith("origin/") or from_branch.startswith("origin/"):
             return pack_error("Use only branch name no need for remote")
 
-        r = repo_clone(f"{owner}/{repo_name}")
-        error = self.validate_pr_branches(r, request["id"], into_branch, from_branch)
+        def compute() -> Json:
+            with self.open_repo(f"{owner}/{repo_name}") as r:
+                error = self.validate_pr_branches(
+                    r, request["id"], into_branch, from_branch
+                )
 
-        if error is not None:
-            return error
+                if error is not None:
+                    return error
 
-        into_branch = f"origin/{into_branch}"
-        from_branch = f"origin/{from_branch}"
-        diff = r.git.diff(f"{into_branch}...{from_branch}")
-        if not diff:
-            return pack_error("No common base")
+                into_hash = r.commit(f"origin/{into_branch}").hexsha
+                from_hash = r.commit(f"origin/{from_branch}").hexsha
+                content_hash = f"prDiff:{into_hash}:{from_hash}:v{diff_format_version}"
+                if self.client_has(request, content_hash):
+                    return pack_not_modified(content_hash)
 
-        token = token_urlsafe(32)
-        full_diff = get_diff_json(diff)
+                diff = r.git.diff(f"{into_hash}...{from_hash}")
+            if not diff:
+                return pack_error("No common base")
 
-        file_com = FileComm(json.dumps(full_diff).encode(), token)
-        return pack_diff(file_com.get_port(), token)
+            with span("get_diff_json"):
+                full_diff = get_diff_json(diff)
+
+            return pack_file_value(full_diff, content_hash)
+
+        return self.single_flight.run(request, compute)
 
     def validate_connection(self, request: Json) -> Json:
         """
@@ -804,7 +1157,7 @@ class ServerLogic:
             Json: The result of the validation process.
         """
         return pack_validate_token(
-            request["tokenForValidation"] in self.connected_client
+            request["tokenForValidation"] in self.sessions
         )
 
     def search_repo(self, request: Json) -> Json:
@@ -828,6 +1181,101 @@ class ServerLogic:
 
         return pack_search_repo(repo_results)
 
+    def batch(self, request: Json) -> Json:
+        """
+        Run many requests in one round trip, like the ones a screen sends when it opens.
+        The requests are run in order with the connection token of the batch, and with its "repo" unless they name their own.
+        The token and the permissions on each repository are validated once, and each repository is brought up to date once.
+
+        Parameters:
+            request (Json): A JSON object containing the requests under "requests" and optionally the repository under "repo".
+
+        Returns:
+            Json: A JSON object containing the response of every request in order, a failed request's response is an error,
+            or an error if the batch itself is invalid.
+        """
+        requests = request["requests"]
+        if not isinstance(requests, list):
+            return pack_error("Batch requests must be a list")
+        if len(requests) > batch_max_size:
+            return pack_error(f"A batch can hold at most {batch_max_size} requests")
+
+        connection_token = request["connectionToken"]
+        repo = request.get("repo")
+        self.thread_state.batch_validated = {}
+        self.thread_state.batch_repos = {}
+        try:
+            if repo is not None:
+                result = self.validate_repo_request(repo, connection_token)
+                if isinstance(result, dict):
+                    return result
+
+            return pack_batch(
+                [
+                    self.run_batch_request(sub_request, connection_token, repo)
+                    for sub_request in requests
+                ]
+            )
+        finally:
+            self.thread_state.batch_validated = None
+            self.thread_state.batch_repos = None
+
+    def server_stats(self, request: Json) -> Json:
+        """
+        Report the latency histograms of every action and its stages, request coalescing and pending file transfers.
+        Only users listed in STATS_USERS (comma separated) may ask.
+
+        Parameters:
+            request (Json): A JSON object containing the connection token.
+
+        Returns:
+            Json: A JSON object containing the statistics, or an error if the user isn't allowed to see them.
+        """
+        username = self.username_of(request["connectionToken"])
+        allowed = [user.strip() for user in os.getenv("STATS_USERS", "").split(",")]
+        if username not in allowed:
+            return pack_error("Invalid permissions")
+
+        return pack_server_stats(
+            self.latency_stats.stats(),
+            self.single_flight.stats(),
+            self.transfer_server.stats(),
+        )
+
+    def run_batch_request(
+        self, request: Json, connection_token: str, repo: Optional[str]
+    ) -> Json:
+        """
+        Apply the action of a request of a batch, errors are returned as error responses like in `handle_request`.
+
+        Parameters:
+            request (Json): The request.
+            connection_token (str): The connection token of the batch.
+            repo (Optional[str]): The repository of the batch, used when the request doesn't name one.
+
+        Returns:
+            Json: The response of the request.
+        """
+        if not isinstance(request, dict) or "type" not in request:
+            return pack_error("Every request needs type value")
+        if request["type"] == "batch":
+            return pack_error("Batches can't be nested")
+
+        defaults = {} if repo is None else {"repo": repo}
+        try:
+            response = self.apply_action(
+                {**defaults, **request, "connectionToken": connection_token}
+            )
+        except ValueError as e:
+            response = pack_error(str(e))
+        except Exception as e:
+            response = pack_error(f"Internal Server error {e}")
+
+        # There is one framed response for the whole batch, file content has to be requested on its own
+        if "fileData" in response or "fileValue" in response:
+            return pack_error("Files can't be requested in a batch")
+        return response
+
 
 def branches_of_repo(repo: Repo) -> List[str]:
     """
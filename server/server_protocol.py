@@ -1,27 +1,28 @@
-import json
-from typing import List
+from typing import Any, List, Optional
 
 from gitgud_types import Json
+from serialization import Serializer, json_serializer
 
 
-def unpack(request: str) -> Json:
+def unpack(request: bytes, serializer: Serializer = json_serializer) -> Json:
     """
-    Unpacks a JSON-encoded string into a Python dictionary.
+    Unpacks an encoded request into a Python dictionary.
 
     Args:
-        request (str): The JSON-encoded string to be unpacked.
+        request (bytes): The request, encoded with the serialization negotiated on its connection.
+        serializer (Serializer, optional): The serialization negotiated on the connection. Defaults to JSON.
 
     Returns:
         Json: The unpacked Python dictionary.
 
     Raises:
-        ValueError: If the input is not a valid JSON string or if the unpacked result is not a dictionary.
+        ValueError: If the input is not a valid encoded value or if the unpacked result is not a dictionary.
         ValueError: If the unpacked result does not contain the required "type" key.
     """
     try:
-        result = json.loads(request)
-    except json.JSONDecodeError:
-        raise ValueError("Invalid json")
+        result = serializer.loads(request)
+    except ValueError:
+        raise ValueError(f"Invalid {serializer.name}")
 
     if not isinstance(result, dict):
         raise ValueError("Value nees to be Json object")
@@ -98,7 +99,7 @@ def pack_branches(branches: List[str]) -> Json:
 
 def pack_view_file(port: int, token: str) -> Json:
     """
-    Packs the given port and token for a file request into a JSON object.
+    Packs the given port and token for a file transfer into a JSON object.
 
     Args:
         port (int): The port number to be packed.
@@ -110,6 +111,81 @@ def pack_view_file(port: int, token: str) -> Json:
     return {"port": port, "token": token}
 
 
+def pack_file(data: bytes, content_hash: Optional[str] = None) -> Json:
+    """
+    Packs file content returned by an action.
+    The content never reaches the client as is, when the response is sent it is replaced by
+    a file transfer (`pack_view_file`) or streamed inline on the connection (`pack_stream`).
+
+    Args:
+        data (bytes): The content of the file.
+        content_hash (Optional[str], optional): A hash that changes whenever the content does, clients cache the content by it. Defaults to None.
+
+    Returns:
+        Json: The JSON object holding the file content under "fileData" and its "contentHash" if given.
+    """
+    if content_hash is None:
+        return {"fileData": data}
+    return {"fileData": data, "contentHash": content_hash}
+
+
+def pack_file_value(value: Any, content_hash: Optional[str] = None) -> Json:
+    """
+    Packs structured content returned by an action (commits, diffs...) that is sent like file content (`pack_file`).
+    It is encoded with the serialization negotiated on the connection when the response is sent, tagged by "fileFormat".
+
+    Args:
+        value (Any): The content, made of dicts, lists, strings, numbers, booleans and None.
+        content_hash (Optional[str], optional): A hash that changes whenever the content does, clients cache the content by it. Defaults to None.
+
+    Returns:
+        Json: The JSON object holding the content under "fileValue" and its "contentHash" if given.
+    """
+    if content_hash is None:
+        return {"fileValue": value}
+    return {"fileValue": value, "contentHash": content_hash}
+
+
+def pack_not_modified(content_hash: str) -> Json:
+    """
+    Packs the answer to a request for content the client already holds.
+
+    Args:
+        content_hash (str): The hash of the content, one of the hashes the client sent under "have".
+
+    Returns:
+        Json: The JSON object telling the client to use its cached content.
+    """
+    return {"notModified": True, "contentHash": content_hash}
+
+
+def pack_file_range(offset: int, file_size: int) -> Json:
+    """
+    Packs where a range of a file starts and the size of the whole file into a JSON object.
+
+    Args:
+        offset (int): The offset of the range in the file.
+        file_size (int): The size of the whole file.
+
+    Returns:
+        Json: The JSON object containing the offset and the file size.
+    """
+    return {"offset": offset, "fileSize": file_size}
+
+
+def pack_stream(size: int) -> Json:
+    """
+    Packs the header of file content that is streamed on the connection right after the response.
+
+    Args:
+        size (int): The size of the file content in bytes.
+
+    Returns:
+        Json: The JSON object marking the response as streamed with the size of the content.
+    """
+    return {"stream": True, "size": size}
+
+
 def pack_project_dirs(files: List[str]) -> Json:
     """
     Packs a list of file names into a JSON object.
@@ -156,20 +232,6 @@ def pack_commits(commits: List[Json]) -> Json:
     return {"commits": commits}
 
 
-def pack_diff(port: int, token: str) -> Json:
-    """
-    Packs the given port and token for a diff request into a JSON object.
-
-    Args:
-        port (int): The port number to be packed.
-        token (str): The token to be packed.
-
-    Returns:
-        Json: The JSON object containing the port and token.
-    """
-    return {"port": port, "token": token}
-
-
 def pack_create_issue() -> Json:
     """
     Creates a JSON object representing the response for creating a new issue.
@@ -346,3 +408,31 @@ def pack_search_repo(repos: List[str]) -> Json:
         Json: A JSON object with the key "repos" and the value being the input list of repository names.
     """
     return {"repos": repos}
+
+
+def pack_batch(responses: List[Json]) -> Json:
+    """
+    Packs the responses of the requests of a batch into a JSON object.
+
+    Args:
+        responses (List[Json]): The response of every request of the batch, in order, failed requests have an "error" key.
+
+    Returns:
+        Json: A JSON object with the key "responses" and the value being the input list of responses.
+    """
+    return {"responses": responses}
+
+
+def pack_server_stats(latency: Json, coalescing: Json, transfers: Json) -> Json:
+    """
+    Packs the server's statistics into a JSON object.
+
+    Args:
+        latency (Json): Action -> Latency histograms of the action and of its stages, in milliseconds.
+        coalescing (Json): Counts of the read requests computed and coalesced by single-flight.
+        transfers (Json): The file transfers waiting to be claimed and the bytes they hold.
+
+    Returns:
+        Json: A JSON object with the keys "latency", "coalescing" and "transfers".
+    """
+    return {"latency": latency, "coalescing": coalescing, "transfers": transfers}
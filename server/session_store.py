@@ -0,0 +1,228 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, time
+from typing import Callable, Generic, Optional, Tuple, TypeVar
+
+from database import DB
+
+T = TypeVar("T")
+
+# Expired sessions are deleted from the database at most this often in seconds
+purge_interval = 60
+
+
+class LruCache(Generic[T]):
+    def __init__(self, capacity: int):
+        """
+        Initializes a new instance of the LruCache class, entries that expire at a given time,
+        the least recently used entry is evicted when the cache is full.
+
+        Parameters:
+            capacity (int): The most entries held.
+
+        Returns:
+            None
+        """
+        self.capacity = capacity
+        self.lock = Lock()
+        # Key -> (value, expiry in seconds since the epoch), least recently used first
+        self.entries: OrderedDict[str, Tuple[T, float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[T]:
+        """
+        Parameters:
+            key (str): The key.
+
+        Returns:
+            Optional[T]: The value, None if it isn't cached or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            (value, expires_at) = entry
+            if expires_at <= time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: T, expires_at: float):
+        """
+        Parameters:
+            key (str): The key.
+            value (T): The value.
+            expires_at (float): When the entry expires, in seconds since the epoch.
+        """
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+
+class SessionStore:
+    """
+    Maps the connection tokens handed out by login to their users.
+    Sessions expire after `ttl` seconds without being used.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    def add(self, token: str, username: str):
+        """
+        Start a session.
+
+        Parameters:
+            token (str): The new connection token.
+            username (str): The user that logged in.
+        """
+        raise NotImplementedError
+
+    def username(self, token: str) -> Optional[str]:
+        """
+        Look up a session and keep it alive.
+
+        Parameters:
+            token (str): A connection token, as sent by the client.
+
+        Returns:
+            Optional[str]: The user of the session, None if the token isn't a string, is unknown or expired.
+        """
+        raise NotImplementedError
+
+    def __contains__(self, token: str) -> bool:
+        return self.username(token) is not None
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: The sessions held in this process's memory.
+        """
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions held in the memory of the process, lost on restart and not seen by other processes.
+    """
+
+    def __init__(self, ttl: float, capacity: int):
+        """
+        Parameters:
+            ttl (float): Seconds a session lives without being used.
+            capacity (int): The most sessions held, the least recently used is logged out past it.
+        """
+        super().__init__(ttl)
+        self.sessions: LruCache[str] = LruCache(capacity)
+
+    def add(self, token: str, username: str):
+        self.sessions.put(token, username, time() + self.ttl)
+
+    def username(self, token: str) -> Optional[str]:
+        if not isinstance(token, str):
+            return None
+        username = self.sessions.get(token)
+        if username is not None:
+            self.sessions.put(token, username, time() + self.ttl)
+        return username
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+
+class PostgresSessionStore(SessionStore):
+    """
+    Sessions in the "Session" table, shared by every server process on the database and kept across restarts.
+    Lookups are cached in memory for `cache_ttl` seconds so validating a token rarely queries the database,
+    a session is extended in the database once less than half of its ttl is left.
+    """
+
+    def __init__(
+        self, db: Callable[[], DB], ttl: float, cache_ttl: float, capacity: int
+    ):
+        """
+        Parameters:
+            db (Callable[[], DB]): Gets the database connection of the current thread.
+            ttl (float): Seconds a session lives without being used.
+            cache_ttl (float): Seconds a session found in the database is trusted without asking it again.
+            capacity (int): The most sessions cached.
+        """
+        super().__init__(ttl)
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.cache: LruCache[str] = LruCache(capacity)
+        self.purge_lock = Lock()
+        self.purged_at: Optional[float] = None
+
+    def add(self, token: str, username: str):
+        expires_at = time() + self.ttl
+        self.db().add_session(token, username, expires_at)
+        self.cache.put(token, username, min(time() + self.cache_ttl, expires_at))
+        self._purge_expired()
+
+    def username(self, token: str) -> Optional[str]:
+        # A token of the wrong type would fail the query and abort the thread's transaction
+        if not isinstance(token, str):
+            return None
+        username = self.cache.get(token)
+        if username is not None:
+            return username
+
+        session = self.db().session(token)
+        if session is None:
+            return None
+        (username, expires_at) = session
+        now = time()
+        if expires_at - now < self.ttl / 2:
+            expires_at = now + self.ttl
+            self.db().extend_session(token, expires_at)
+        self.cache.put(token, username, min(now + self.cache_ttl, expires_at))
+        return username
+
+    def _purge_expired(self):
+        """
+        Delete the expired sessions of every process from the database, at most every `purge_interval` seconds.
+        """
+        with self.purge_lock:
+            if (
+                self.purged_at is not None
+                and monotonic() - self.purged_at < purge_interval
+            ):
+                return
+            self.purged_at = monotonic()
+        self.db().delete_expired_sessions()
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+
+def create_session_store(db: Callable[[], DB]) -> SessionStore:
+    """
+    Create the session store configured by SESSION_STORE: "memory" (default) or "postgres".
+
+    Parameters:
+        db (Callable[[], DB]): Gets the database connection of the current thread.
+
+    Returns:
+        SessionStore: The session store.
+
+    Raises:
+        ValueError: If SESSION_STORE names an unknown store.
+    """
+    store = os.getenv("SESSION_STORE", "memory")
+    ttl = float(os.getenv("SESSION_TTL", str(24 * 60 * 60)))
+    capacity = int(os.getenv("SESSION_CAPACITY", "100000"))
+    if store == "memory":
+        return MemorySessionStore(ttl, capacity)
+    if store == "postgres":
+        return PostgresSessionStore(
+            db, ttl, float(os.getenv("SESSION_CACHE_TTL", "30")), capacity
+        )
+    raise ValueError(f"Unknown SESSION_STORE {store}")
@@ -0,0 +1,111 @@
+import json
+from threading import Event, Lock
+from typing import Callable, Dict, Optional, cast
+
+from gitgud_types import Json
+from tracing import span
+
+
+class Flight:
+    def __init__(self):
+        """
+        Initializes a new instance of the Flight class, a computation requests with the same key wait on.
+
+        Returns:
+            None
+        """
+        self.done = Event()
+        self.result: Optional[Json] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Initializes a new instance of the SingleFlight class.
+        Identical requests arriving while one of them is computed wait for it and share its response
+        instead of each pulling the repository and walking git on their own.
+        Only responses that don't depend on who asked may be shared, so callers coalesce after authorization.
+
+        Returns:
+            None
+        """
+        self.lock = Lock()
+        # Key -> the computation in flight
+        self.flights: Dict[str, Flight] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def request_key(request: Json) -> str:
+        """
+        Normalize a request into the key identical requests share,
+        without the connection token and the request id that differ between clients asking the same thing.
+
+        Parameters:
+            request (Json): The request.
+
+        Returns:
+            str: The key.
+        """
+        return json.dumps(
+            {
+                k: v
+                for (k, v) in request.items()
+                if k not in ("connectionToken", "requestId")
+            },
+            sort_keys=True,
+        )
+
+    def run(self, request: Json, compute: Callable[[], Json]) -> Json:
+        """
+        Compute the response of a request, or wait for an identical request that's being computed.
+
+        Parameters:
+            request (Json): The request, already authorized.
+            compute (Callable[[], Json]): Computes the response.
+
+        Returns:
+            Json: The response, shared with the identical requests, it must not be modified.
+        """
+        key = self.request_key(request)
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = Flight()
+                self.flights[key] = flight
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            with span("coalesced"):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return cast(Json, flight.result)
+
+        try:
+            flight.result = compute()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: Requests computed ("executed"), requests that shared another's response ("coalesced")
+            and computations in flight ("inFlight").
+        """
+        with self.lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "inFlight": len(self.flights),
+            }
@@ -0,0 +1,146 @@
+from threading import local
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+from gitgud_types import Json, batch_max_size
+from profiling import SlowActionProfiler
+from server_logic import ServerLogic
+from server_protocol import pack_error
+from session_store import MemorySessionStore
+
+
+class FakeRepoTable:
+    """
+    The "Repo" table method of DB the batch validates with, on a dict.
+    """
+
+    def __init__(self, repos: Dict[str, bool]):
+        self.repos = repos
+        self.lookups: List[str] = []
+
+    def repo_by_name(self, repo: str) -> Optional[Tuple[int, str, bool]]:
+        self.lookups.append(repo)
+        if repo not in self.repos:
+            return None
+        return (1, repo.split("/")[1], self.repos[repo])
+
+
+@pytest.fixture
+def logic() -> ServerLogic:
+    """
+    A ServerLogic without sockets, database or git, its actions are stand-ins.
+    """
+    logic = ServerLogic.__new__(ServerLogic)
+    logic.sessions = MemorySessionStore(ttl=100, capacity=10)
+    logic.sessions.add("token", "alice")
+    logic.thread_state = local()
+    logic.thread_state.db = FakeRepoTable({"alice/repo": False, "bob/repo": False})
+    logic.profiler = SlowActionProfiler()
+
+    def branches(request: Json) -> Json:
+        result = logic.validate_repo_request(
+            request["repo"], request["connectionToken"]
+        )
+        if isinstance(result, dict):
+            return result
+        return {"branches": ["main"], "repo": request["repo"]}
+
+    def view_file(request: Json) -> Json:
+        return {"fileData": "content"}
+
+    def invalid(request: Json) -> Json:
+        raise ValueError("Invalid request")
+
+    def crash(request: Json) -> Json:
+        raise KeyError("missing")
+
+    logic.actions = {
+        "branches": (branches, ["repo", "connectionToken"], "git"),
+        "viewFile": (view_file, ["repo", "connectionToken"], "git"),
+        "invalid": (invalid, ["connectionToken"], "fast"),
+        "crash": (crash, ["connectionToken"], "fast"),
+    }
+    return logic
+
+
+def batch(logic: ServerLogic, requests: List[Json], repo: Optional[str] = None):
+    request: Json = {"type": "batch", "requests": requests, "connectionToken": "token"}
+    if repo is not None:
+        request["repo"] = repo
+    return logic.batch(request)
+
+
+def test_responses_in_order(logic: ServerLogic):
+    response = batch(
+        logic,
+        [{"type": "branches"}, {"type": "branches", "repo": "alice/repo"}],
+        repo="alice/repo",
+    )
+    assert response == {
+        "responses": [
+            {"branches": ["main"], "repo": "alice/repo"},
+            {"branches": ["main"], "repo": "alice/repo"},
+        ]
+    }
+    # Validated once for the whole batch
+    assert logic.thread_state.db.lookups == ["alice/repo"]
+    assert logic.thread_state.batch_validated is None
+
+
+def test_size_limit(logic: ServerLogic):
+    full = [{"type": "branches", "repo": "alice/repo"}] * batch_max_size
+    assert len(batch(logic, full)["responses"]) == batch_max_size
+    assert batch(logic, full + [{"type": "branches"}]) == pack_error(
+        f"A batch can hold at most {batch_max_size} requests"
+    )
+    assert batch(logic, {"type": "branches"}) == pack_error(  # type: ignore
+        "Batch requests must be a list"
+    )
+
+
+def test_nested_batch_is_rejected(logic: ServerLogic):
+    nested = {"type": "batch", "requests": [{"type": "branches"}]}
+    response = batch(logic, [nested, {"type": "branches"}], repo="alice/repo")
+    assert response["responses"][0] == pack_error("Batches can't be nested")
+    assert "branches" in response["responses"][1]
+
+
+def test_file_in_batch_is_rejected(logic: ServerLogic):
+    response = batch(logic, [{"type": "viewFile"}], repo="alice/repo")
+    assert response == {
+        "responses": [pack_error("Files can't be requested in a batch")]
+    }
+
+
+def test_per_request_errors(logic: ServerLogic):
+    response = batch(
+        logic,
+        [
+            {"type": "invalid"},
+            {"type": "crash"},
+            {"type": "unknown"},
+            {"repo": "alice/repo"},
+            "not a request",
+            {"type": "branches", "repo": "bob/repo"},
+            {"type": "branches", "repo": "nobody/repo"},
+            {"type": "branches"},
+        ],
+        repo="alice/repo",
+    )
+    assert response["responses"] == [
+        pack_error("Invalid request"),
+        pack_error("Internal Server error 'missing'"),
+        pack_error("Invalid type"),
+        pack_error("Every request needs type value"),
+        pack_error("Every request needs type value"),
+        pack_error("Invalid permissions"),
+        pack_error("Invalid username or repo"),
+        {"branches": ["main"], "repo": "alice/repo"},
+    ]
+
+
+def test_invalid_batch_repo(logic: ServerLogic):
+    response = batch(logic, [{"type": "branches"}], repo="bob/repo")
+    assert response == pack_error("Invalid permissions")
+    assert logic.thread_state.batch_validated is None
@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+from compression import (
+    Compression,
+    codecs,
+    dictionary_codec_id,
+    dictionary_max_size,
+    get_compression,
+    looks_incompressible,
+    stored_codec_id,
+    supported_compressions,
+    supported_dictionaries,
+)
+from handshake import negotiate_compression
+
+message = json.dumps(
+    {
+        "requestType": "view_file",
+        "repoName": "owner/repo",
+        "branch": "main",
+        "filePath": "src/main.py",
+        "fileData": "def main():\n    print('hello world')\n" * 40,
+    }
+).encode()
+
+
+@pytest.fixture(autouse=True)
+def default_config(monkeypatch):
+    monkeypatch.delenv("COMPRESSION", raising=False)
+    monkeypatch.delenv("COMPRESSION_LEVEL", raising=False)
+    monkeypatch.delenv("COMPRESSION_MIN_SIZE", raising=False)
+
+
+@pytest.mark.parametrize("algorithm", supported_compressions)
+def test_round_trip(algorithm: str):
+    compression = Compression(algorithm)
+    compressed = compression.compress(message)
+    assert compressed[0] == codecs[algorithm].codec_id
+    assert len(compressed) < len(message)
+    assert compression.decompress(compressed) == message
+
+
+@pytest.mark.parametrize("algorithm", supported_compressions)
+def test_round_trip_negotiated(algorithm: str):
+    features = {"compression": negotiate_compression({"compression": [algorithm]})}
+    assert features["compression"]["algorithm"] == algorithm
+    compression = get_compression(features)
+    assert compression.decompress(compression.compress(message)) == message
+
+
+def test_round_trip_original_gzip():
+    compression = get_compression({})
+    assert compression.codec is None
+    compressed = compression.compress(message)
+    assert compressed[:2] == b"\x1f\x8b"
+    assert compression.decompress(compressed) == message
+
+
+@pytest.mark.skipif(not supported_dictionaries, reason="needs a zstd dictionary")
+def test_round_trip_dictionary():
+    accepted = negotiate_compression(
+        {"compression": ["zstd"], "compressionDictionary": supported_dictionaries}
+    )
+    assert accepted is not None
+    assert accepted["dictionary"] == supported_dictionaries[0]
+    compression = get_compression({"compression": accepted})
+
+    short = b'{"requestType": "view_branches", "repoName": "owner/repo"}'
+    assert len(short) >= accepted["minSize"]
+    for payload in [short, message]:
+        compressed = compression.compress(payload)
+        assert compressed[0] == dictionary_codec_id
+        assert compression.decompress(compressed) == payload
+
+    # Larger than the dictionary was trained for, compressed without it
+    large = message * (dictionary_max_size // len(message) + 1)
+    compressed = compression.compress(large)
+    assert compressed[0] == codecs["zstd"].codec_id
+    assert compression.decompress(compressed) == large
+
+
+def test_dictionary_needs_zstd():
+    accepted = negotiate_compression(
+        {"compression": ["gzip"], "compressionDictionary": supported_dictionaries}
+    )
+    assert accepted is not None and "dictionary" not in accepted
+    with pytest.raises(ValueError):
+        Compression("gzip", dictionary=1)
+    with pytest.raises(ValueError):
+        Compression("unknown")
+
+
+@pytest.mark.parametrize("algorithm", supported_compressions)
+def test_small_payload_is_stored(algorithm: str):
+    compression = Compression(algorithm)
+    compressed = compression.compress(b"tiny")
+    assert compressed == bytes([stored_codec_id]) + b"tiny"
+    assert compression.decompress(compressed) == b"tiny"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024,
+        b"PK\x03\x04" + b"\x00" * 1024,
+        os.urandom(64 * 1024),
+    ],
+    ids=["png", "zip", "random"],
+)
+def test_incompressible_is_stored(data: bytes):
+    assert looks_incompressible(data)
+    compression = Compression(supported_compressions[0])
+    compressed = compression.compress(data)
+    assert compressed[0] == stored_codec_id
+    assert compression.decompress(compressed) == data
+
+
+def test_incompressible_hint():
+    assert not looks_incompressible(message)
+    compression = Compression(supported_compressions[0])
+    assert compression.compress(message, incompressible=True)[0] == stored_codec_id
+    compressed = compression.compress(os.urandom(1024), incompressible=False)
+    # Compressing didn't pay off, stored anyway
+    assert compressed[0] == stored_codec_id
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        Compression("gzip").decompress(bytes([200]) + message)
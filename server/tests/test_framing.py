@@ -0,0 +1,91 @@
+import asyncio
+import socket
+
+import pytest
+
+import framing
+from framing import (
+    async_recv_frame,
+    async_send_frame,
+    frame_header,
+    frame_message,
+    frame_stream_chunk,
+    frame_stream_end,
+    pack_frame_header,
+    recv_frame,
+    send_frame,
+    unpack_frame_header,
+)
+
+
+def test_round_trip():
+    a, b = socket.socketpair()
+    with a, b:
+        send_frame(a, frame_message, b"response", 7)
+        send_frame(a, frame_stream_chunk, b"\x00" * 100_000, 7)
+        send_frame(a, frame_stream_end, b"", 7)
+        assert recv_frame(b) == (frame_message, 7, b"response")
+        assert recv_frame(b) == (frame_stream_chunk, 7, b"\x00" * 100_000)
+        assert recv_frame(b) == (frame_stream_end, 7, b"")
+
+
+def test_request_id_defaults_to_zero():
+    assert unpack_frame_header(pack_frame_header(frame_message, 5)) == (
+        frame_message,
+        0,
+        5,
+    )
+
+
+def test_rejects_frames_over_max_size(monkeypatch):
+    monkeypatch.setattr(framing, "max_frame_size", 10)
+    with pytest.raises(ValueError):
+        pack_frame_header(frame_message, 11)
+    with pytest.raises(ValueError):
+        unpack_frame_header(frame_header.pack(11, frame_message, 0))
+
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(frame_header.pack(11, frame_message, 0) + b"x" * 11)
+        with pytest.raises(ValueError):
+            recv_frame(b)
+
+
+def test_truncated_header():
+    a, b = socket.socketpair()
+    with b:
+        a.sendall(pack_frame_header(frame_message, 4)[:5])
+        a.close()
+        with pytest.raises(ConnectionError):
+            recv_frame(b)
+
+
+def test_truncated_payload():
+    a, b = socket.socketpair()
+    with b:
+        a.sendall(pack_frame_header(frame_message, 4) + b"ab")
+        a.close()
+        with pytest.raises(ConnectionError):
+            recv_frame(b)
+
+
+def test_async_round_trip_and_truncation():
+    async def run():
+        reader = asyncio.StreamReader()
+
+        class Writer:
+            def write(self, data: bytes):
+                reader.feed_data(data)
+
+            async def drain(self):
+                pass
+
+        await async_send_frame(Writer(), frame_stream_chunk, b"chunk", 3)  # type: ignore
+        assert await async_recv_frame(reader) == (frame_stream_chunk, 3, b"chunk")
+
+        reader.feed_data(pack_frame_header(frame_message, 4)[:6])
+        reader.feed_eof()
+        with pytest.raises(asyncio.IncompleteReadError):
+            await async_recv_frame(reader)
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import pytest
+from git import Repo
+
+import git_utils
+from git_utils import read_blob_range
+
+content = bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch) -> Repo:
+    # Small chunks so skipping takes many reads
+    monkeypatch.setattr(git_utils, "blob_chunk_size", 1000)
+    repo = Repo.init(tmp_path)
+    (tmp_path / "big.bin").write_bytes(content)
+    (tmp_path / "small.txt").write_bytes(b"small")
+    repo.index.add(["big.bin", "small.txt"])
+    repo.index.commit("files")
+    return repo
+
+
+@pytest.mark.parametrize(
+    "offset, length",
+    [(0, None), (0, 10), (12345, 5000), (255_990, 100), (300_000, 10), (5, 0)],
+)
+def test_read_blob_range(repo: Repo, offset, length):
+    blob = repo.head.commit.tree / "big.bin"
+    end = None if length is None else offset + length
+    assert read_blob_range(blob, offset, length) == content[offset:end]
+
+
+def test_read_blob_range_keeps_stream_in_sync(repo: Repo):
+    # Blobs are read through the repo's shared cat-file process, the next read must not see leftovers
+    tree = repo.head.commit.tree
+    read_blob_range(tree / "big.bin", 100, 10)
+    assert read_blob_range(tree / "small.txt", 0, None) == b"small"
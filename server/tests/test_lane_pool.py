@@ -0,0 +1,35 @@
+from threading import Event
+
+from lane_pool import LanePool
+
+
+def test_counts_waiting_and_running():
+    pool = LanePool(max_workers=1, thread_name_prefix="test")
+    started = Event()
+    release = Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    first = pool.submit(block)
+    started.wait()
+    second = pool.submit(lambda x: x * 2, 21)
+    assert pool.stats() == {"waiting": 1, "running": 1}
+
+    release.set()
+    first.result()
+    assert second.result() == 42
+    assert pool.stats() == {"waiting": 0, "running": 0}
+    pool.shutdown()
+
+
+def test_failed_work_is_counted_done():
+    pool = LanePool(max_workers=1, thread_name_prefix="test")
+
+    def fail():
+        raise ValueError("failed")
+
+    assert isinstance(pool.submit(fail).exception(), ValueError)
+    assert pool.stats() == {"waiting": 0, "running": 0}
+    pool.shutdown()
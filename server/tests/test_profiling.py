@@ -0,0 +1,69 @@
+import os
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from profiling import SlowActionProfiler
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch) -> SlowActionProfiler:
+    monkeypatch.setenv("PROFILE_SLOW_MS", "50")
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    monkeypatch.setenv("PROFILE_KEEP", "3")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    return SlowActionProfiler()
+
+
+def slow_git_work(seconds: float):
+    sleep(seconds)
+
+
+def test_only_slow_actions_are_saved(profiler: SlowActionProfiler, tmp_path):
+    with profiler.profile("viewFile", "owner/repo"):
+        slow_git_work(0.001)
+    assert os.listdir(tmp_path) == []
+
+    with profiler.profile("commits", "owner/repo"):
+        slow_git_work(0.1)
+    [name] = os.listdir(tmp_path)
+    assert "-commits-owner_repo-" in name and name.endswith(".folded")
+    content = (tmp_path / name).read_text()
+    assert "slow_git_work (test_profiling.py:" in content
+
+
+def test_concurrent_actions_are_sampled_separately(
+    profiler: SlowActionProfiler, tmp_path
+):
+    def run(action: str):
+        with profiler.profile(action, None):
+            slow_git_work(0.1)
+
+    threads = [Thread(target=run, args=(action,)) for action in ("diff", "commits")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(name.split("-")[3] for name in os.listdir(tmp_path)) == [
+        "commits",
+        "diff",
+    ]
+
+
+def test_nested_action_and_rotation(profiler: SlowActionProfiler, tmp_path):
+    for _ in range(4):
+        with profiler.profile("batch", None):
+            with profiler.profile("diff", None):
+                slow_git_work(0.06)
+    names = os.listdir(tmp_path)
+    assert len(names) == 3
+    assert all("-batch-" in name for name in names)
+
+
+def test_disabled(monkeypatch, tmp_path):
+    monkeypatch.delenv("PROFILE_SLOW_MS", raising=False)
+    profiler = SlowActionProfiler()
+    with profiler.profile("diff", None):
+        slow_git_work(0.01)
+    assert profiler.sampler is None
@@ -0,0 +1,75 @@
+import os
+from typing import Tuple
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+import record_layer
+from record_layer import RecordLayer, nonce_size, supported_ciphers
+
+
+def connection(cipher: str) -> Tuple[RecordLayer, RecordLayer]:
+    key = os.urandom(32)
+    return (RecordLayer(cipher, key, True), RecordLayer(cipher, key, False))
+
+
+@pytest.mark.parametrize("cipher", supported_ciphers)
+def test_round_trip_both_directions(cipher: str):
+    (server, client) = connection(cipher)
+    for i in range(3):
+        assert server.open(client.seal(b"request %d" % i)) == b"request %d" % i
+        assert client.open(server.seal(b"response %d" % i)) == b"response %d" % i
+    assert client.open(server.seal(b"")) == b""
+
+
+@pytest.mark.parametrize("cipher", supported_ciphers)
+def test_nonce_counter_progression(cipher: str):
+    (server, client) = connection(cipher)
+    records = [client.seal(b"same") for _ in range(3)]
+    assert (client.sent, client.received) == (3, 0)
+    # The same plaintext seals differently under each nonce
+    assert len(set(records)) == 3
+    for record in records:
+        server.open(record)
+    assert (server.sent, server.received) == (0, 3)
+
+    # Every connection counts from 0
+    key = os.urandom(32)
+    first = RecordLayer(cipher, key, False).seal(b"same")
+    assert RecordLayer(cipher, key, False).seal(b"same") == first
+    assert RecordLayer._next_nonce(1) == (1).to_bytes(nonce_size, "big")
+
+
+@pytest.mark.parametrize("cipher", supported_ciphers)
+def test_reordered_record_is_rejected(cipher: str):
+    (server, client) = connection(cipher)
+    first = client.seal(b"first")
+    second = client.seal(b"second")
+    with pytest.raises(InvalidTag):
+        server.open(second)
+    with pytest.raises(InvalidTag):
+        server.open(first)
+
+
+@pytest.mark.parametrize("cipher", supported_ciphers)
+def test_tampered_record_is_rejected(cipher: str):
+    (server, client) = connection(cipher)
+    record = bytearray(client.seal(b"request"))
+    record[0] ^= 1
+    with pytest.raises(InvalidTag):
+        server.open(bytes(record))
+
+
+@pytest.mark.parametrize("cipher", supported_ciphers)
+def test_own_direction_is_rejected(cipher: str):
+    (server, _) = connection(cipher)
+    with pytest.raises(InvalidTag):
+        server.open(server.seal(b"reflected"))
+
+
+def test_counter_exhausted(monkeypatch):
+    monkeypatch.setattr(record_layer, "max_records", 1)
+    (_, client) = connection(supported_ciphers[0])
+    client.seal(b"last")
+    with pytest.raises(OverflowError):
+        client.seal(b"one too many")
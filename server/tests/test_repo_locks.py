@@ -0,0 +1,49 @@
+from threading import Barrier, Thread
+
+import pytest
+
+from repo_locks import RepoLocks
+
+
+def test_read_fresh_refreshes_once_until_stale():
+    locks = RepoLocks()
+    refreshes = []
+    barrier = Barrier(4)
+
+    def read():
+        barrier.wait()
+        with locks.read_fresh("owner/repo", 60, lambda: refreshes.append(1)):
+            pass
+
+    threads = [Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(refreshes) == 1
+
+    with locks.read_fresh("owner/repo", 0, lambda: refreshes.append(1)):
+        pass
+    assert len(refreshes) == 2
+
+
+def test_read_fresh_holds_read_lock_after_refresh():
+    locks = RepoLocks()
+    lock = locks._lock_of("owner/repo")
+    with locks.read_fresh("owner/repo", 60, lambda: None):
+        assert lock.readers == 1 and not lock.writer
+    assert lock.readers == 0
+
+
+def test_failed_refresh_releases_write_lock():
+    locks = RepoLocks()
+
+    def fail():
+        raise OSError("fetch failed")
+
+    with pytest.raises(OSError):
+        with locks.read_fresh("owner/repo", 60, fail):
+            pass
+    lock = locks._lock_of("owner/repo")
+    assert not lock.writer and lock.readers == 0
+    assert "owner/repo" not in locks.refreshed_at
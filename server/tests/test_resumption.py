@@ -0,0 +1,110 @@
+import base64
+import json
+import os
+import time
+from typing import Tuple
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+import encryption
+from encryption import (
+    EncryptionState,
+    get_ticket_fernet,
+    resumed_key,
+    resumption_secret,
+)
+from key_exchange import X25519KeyExchange
+
+
+@pytest.fixture(autouse=True)
+def ticket_key(monkeypatch):
+    monkeypatch.delenv("TICKET_KEY", raising=False)
+    monkeypatch.delenv("TICKET_TTL", raising=False)
+    monkeypatch.setattr(encryption, "ticket_fernet", None)
+
+
+def full_handshake() -> Tuple[str, bytes]:
+    """
+    Run a full X25519 key exchange asking for resumption, as the client does.
+
+    Returns:
+        Tuple[str, bytes]: The ticket and the resumption secret the client keeps.
+    """
+    server = EncryptionState()
+    server.get_initial_public_message()
+    client = X25519KeyExchange()
+    offer = {
+        "resumption": True,
+        "keyExchange": client.name,
+        "publicKey": client.public_key(),
+    }
+    server.set_encryption_key(f"1;{json.dumps(offer)}".encode())
+    accept = json.loads(server.get_accept_message())
+    secret = resumption_secret(client.shared_key(accept["publicKey"]))
+    return (accept["ticket"], secret)
+
+
+def resume(ticket: str, nonce: bytes) -> EncryptionState:
+    server = EncryptionState()
+    server.get_initial_public_message()
+    server.set_encryption_key(
+        f"resume;{ticket};{base64.urlsafe_b64encode(nonce).decode()};{{}}".encode()
+    )
+    return server
+
+
+def client_fernet(secret: bytes, nonce: bytes, server: EncryptionState) -> Fernet:
+    key = resumed_key(secret, nonce, server.get_initial_public_message())
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def test_resume_with_valid_ticket():
+    (ticket, secret) = full_handshake()
+    nonce = os.urandom(16)
+    server = resume(ticket, nonce)
+    assert json.loads(server.get_accept_message())["resumed"] is True
+    request = client_fernet(secret, nonce, server).encrypt(b"request")
+    assert server.decrypt(request) == b"request"
+
+
+def test_reject_expired_ticket(monkeypatch):
+    (_, secret) = full_handshake()
+    expired = (
+        get_ticket_fernet().encrypt_at_time(secret, int(time.time()) - 3601).decode()
+    )
+    with pytest.raises(ValueError):
+        resume(expired, os.urandom(16))
+
+    monkeypatch.setenv("TICKET_TTL", "7200")
+    resume(expired, os.urandom(16))
+
+
+def test_reject_tampered_ticket():
+    (ticket, _) = full_handshake()
+    raw = bytearray(base64.urlsafe_b64decode(ticket))
+    raw[40] ^= 1
+    with pytest.raises(ValueError):
+        resume(base64.urlsafe_b64encode(bytes(raw)).decode(), os.urandom(16))
+
+
+def test_reject_ticket_of_another_server(monkeypatch):
+    (ticket, _) = full_handshake()
+    monkeypatch.setattr(encryption, "ticket_fernet", Fernet(Fernet.generate_key()))
+    with pytest.raises(ValueError):
+        resume(ticket, os.urandom(16))
+
+
+def test_replayed_nonce_gets_another_key():
+    (ticket, secret) = full_handshake()
+    nonce = os.urandom(16)
+    first = resume(ticket, nonce)
+    request = client_fernet(secret, nonce, first).encrypt(b"request")
+    assert first.decrypt(request) == b"request"
+
+    # Replaying the resumption and the recorded request on a new connection,
+    # the key also depends on that connection's initial message
+    replayed = resume(ticket, nonce)
+    assert replayed.key != first.key
+    with pytest.raises(InvalidToken):
+        replayed.decrypt(request)
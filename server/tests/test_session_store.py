@@ -0,0 +1,138 @@
+import inspect
+import os
+from typing import Dict, Optional, Tuple
+
+import pytest
+
+import session_store
+from database import DB
+from session_store import MemorySessionStore, PostgresSessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(session_store, "time", clock)
+    return clock
+
+
+class FakeSessionTable:
+    """
+    The "Session" table methods of DB, on a dict.
+    """
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.rows: Dict[str, Tuple[str, float]] = {}
+        self.extended = 0
+
+    def add_session(self, token: str, username: str, expires_at: float):
+        self.rows[token] = (username, expires_at)
+
+    def session(self, token: str) -> Optional[Tuple[str, float]]:
+        row = self.rows.get(token)
+        if row is None or row[1] <= self.clock():
+            return None
+        return row
+
+    def extend_session(self, token: str, expires_at: float):
+        self.rows[token] = (self.rows[token][0], expires_at)
+        self.extended += 1
+
+    def delete_expired_sessions(self) -> int:
+        expired = [t for (t, (_, e)) in self.rows.items() if e <= self.clock()]
+        for token in expired:
+            del self.rows[token]
+        return len(expired)
+
+
+def test_fake_matches_db():
+    for name, method in inspect.getmembers(FakeSessionTable, inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        assert inspect.signature(method) == inspect.signature(getattr(DB, name))
+
+
+def test_memory_store(clock: Clock):
+    store = MemorySessionStore(ttl=100, capacity=10)
+    store.add("token", "alice")
+    assert store.username("token") == "alice"
+
+    # Every use pushes the expiry back
+    clock.now += 80
+    assert "token" in store
+    clock.now += 80
+    assert store.username("token") == "alice"
+
+    clock.now += 101
+    assert store.username("token") is None
+    assert store.username("unknown") is None
+    assert store.username(["not", "a", "token"]) is None  # type: ignore
+
+
+def test_memory_store_evicts_least_recently_used(clock: Clock):
+    store = MemorySessionStore(ttl=100, capacity=2)
+    store.add("a", "alice")
+    store.add("b", "bob")
+    store.username("a")
+    store.add("c", "carol")
+    assert "a" in store and "c" in store
+    assert "b" not in store
+    assert len(store) == 2
+
+
+def test_postgres_store(clock: Clock):
+    table = FakeSessionTable(clock)
+    store = PostgresSessionStore(lambda: table, ttl=100, cache_ttl=10, capacity=10)  # type: ignore
+    store.add("token", "alice")
+    assert table.rows["token"] == ("alice", clock.now + 100)
+    assert store.username("token") == "alice"
+
+    # Another process finds the session in the table
+    other = PostgresSessionStore(lambda: table, ttl=100, cache_ttl=10, capacity=10)  # type: ignore
+    assert other.username("token") == "alice"
+    assert table.extended == 0
+
+    # Less than half the ttl left, the session is extended
+    clock.now += 60
+    assert other.username("token") == "alice"
+    assert table.extended == 1
+    assert table.rows["token"][1] == clock.now + 100
+
+    clock.now += 101
+    assert store.username("token") is None
+    assert other.username("token") is None
+    assert store.username(5) is None  # type: ignore
+
+    # Adding a session purges the expired ones
+    store.purged_at = None
+    store.add("new", "bob")
+    assert list(table.rows) == ["new"]
+
+
+@pytest.mark.skipif(
+    not os.getenv("DB_NAME"), reason="needs the PostgreSQL database of DB_NAME"
+)
+def test_postgres_store_on_database():
+    db = DB()
+    store = PostgresSessionStore(lambda: db, ttl=100, cache_ttl=0, capacity=10)
+    store.add("test-session-token", "alice")
+    try:
+        assert store.username("test-session-token") == "alice"
+        db.extend_session("test-session-token", 0)
+        assert store.username("test-session-token") is None
+        db.delete_expired_sessions()
+        assert db.session("test-session-token") is None
+    finally:
+        db.cursor.execute(
+            'DELETE FROM "Session" where token = %s', ("test-session-token",)
+        )
+        db.conn.commit()
@@ -0,0 +1,269 @@
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from secrets import token_hex
+from threading import Lock, local
+from time import monotonic
+from typing import Dict, Iterator, List, Optional
+
+from gitgud_types import Json
+
+# Upper bounds in milliseconds of the buckets of a latency histogram, the last bucket holds the rest
+histogram_bounds_ms: List[float] = [
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+]
+
+
+class Trace:
+    def __init__(self):
+        """
+        Initializes a new instance of the Trace class, the time a request spends in each stage of being served,
+        from the moment it's read off its connection until its response (and file content) is sent.
+        The trace ID is printed with whatever is logged about the request.
+
+        Returns:
+            None
+        """
+        self.trace_id = token_hex(8)
+        self.started = monotonic()
+        # Type of the request, set once it's unpacked
+        self.action: Optional[str] = None
+        # Stage -> Seconds spent in it, a stage entered many times (db) adds up
+        self.stages: Dict[str, float] = {}
+        # When the request was handed to the workers, see `dequeued`
+        self.queued_at: Optional[float] = None
+        self.lock = Lock()
+
+    def add(self, stage: str, seconds: float):
+        """
+        Add time spent in a stage.
+
+        Parameters:
+            stage (str): The stage.
+            seconds (float): The time spent.
+        """
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Time a block as a stage of this trace.
+
+        Parameters:
+            stage (str): The stage.
+
+        Returns:
+            Iterator[None]: Context manager timing the block.
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, monotonic() - start)
+
+    def dequeued(self):
+        """
+        Count the time since `queued_at` as the "queue" stage, called by the worker that picks the request up.
+        """
+        if self.queued_at is not None:
+            self.add("queue", monotonic() - self.queued_at)
+
+    def elapsed(self) -> float:
+        """
+        Returns:
+            float: Seconds since the request was read.
+        """
+        return monotonic() - self.started
+
+    def describe(self) -> str:
+        """
+        Returns:
+            str: The trace as a log line, the stages in milliseconds.
+        """
+        with self.lock:
+            stages = " ".join(
+                f"{stage}={seconds * 1000:.1f}ms"
+                for (stage, seconds) in self.stages.items()
+            )
+        return f"[trace {self.trace_id}] {self.action or 'invalid'} {self.elapsed() * 1000:.1f}ms {stages}"
+
+
+# The trace of the request the current thread works on
+current = local()
+
+
+def current_trace() -> Optional[Trace]:
+    """
+    Returns:
+        Optional[Trace]: The trace of the request the current thread works on, None outside of a request.
+    """
+    return getattr(current, "trace", None)
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[None]:
+    """
+    Make a trace the current thread's while working on its request, so `span` records into it.
+
+    Parameters:
+        trace (Optional[Trace]): The trace, None to record nothing.
+
+    Returns:
+        Iterator[None]: Context manager holding the trace.
+    """
+    previous = current_trace()
+    current.trace = trace
+    try:
+        yield
+    finally:
+        current.trace = previous
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the current thread's trace, if there is one.
+
+    Parameters:
+        stage (str): The stage.
+
+    Returns:
+        Iterator[None]: Context manager timing the block.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+class Histogram:
+    def __init__(self):
+        """
+        Initializes a new instance of the Histogram class, counts of latencies in the `histogram_bounds_ms` buckets.
+
+        Returns:
+            None
+        """
+        self.counts = [0] * (len(histogram_bounds_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        Parameters:
+            seconds (float): The latency to count.
+        """
+        ms = seconds * 1000
+        self.counts[bisect_left(histogram_bounds_ms, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimate a percentile by the upper bound of the bucket it falls in.
+
+        Parameters:
+            fraction (float): The percentile, 0.99 for p99.
+
+        Returns:
+            float: The percentile in milliseconds, the largest latency seen if it falls in the last bucket.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts[:-1]):
+            seen += count
+            if seen >= rank:
+                return min(histogram_bounds_ms[i], self.max)
+        return self.max
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: The count, mean, p50, p95, p99 and max in milliseconds and the count of every bucket by its upper bound.
+        """
+        return {
+            "count": self.count,
+            "meanMs": self.total / self.count if self.count else 0,
+            "p50Ms": self.percentile(0.5),
+            "p95Ms": self.percentile(0.95),
+            "p99Ms": self.percentile(0.99),
+            "maxMs": self.max,
+            "buckets": {
+                **{
+                    str(bound): count
+                    for (bound, count) in zip(histogram_bounds_ms, self.counts)
+                },
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class LatencyStats:
+    def __init__(self):
+        """
+        Initializes a new instance of the LatencyStats class,
+        latency histograms of every action and of every stage of each action, collected from finished traces.
+
+        Returns:
+            None
+        """
+        self.lock = Lock()
+        # Action -> Histogram of the whole request
+        self.actions: Dict[str, Histogram] = {}
+        # Action -> Stage -> Histogram
+        self.stages: Dict[str, Dict[str, Histogram]] = {}
+
+    def finish(self, trace: Trace):
+        """
+        Count a trace once its response is sent.
+        Requests slower than TRACE_SLOW_MS milliseconds are logged with their stages, every request when it's 0.
+
+        Parameters:
+            trace (Trace): The trace.
+        """
+        action = trace.action or "invalid"
+        elapsed = trace.elapsed()
+        with self.lock:
+            self.actions.setdefault(action, Histogram()).record(elapsed)
+            stages = self.stages.setdefault(action, {})
+            with trace.lock:
+                for stage, seconds in trace.stages.items():
+                    stages.setdefault(stage, Histogram()).record(seconds)
+
+        slow_ms = os.getenv("TRACE_SLOW_MS")
+        if slow_ms is not None and elapsed * 1000 >= float(slow_ms):
+            print(trace.describe())
+
+    def stats(self) -> Json:
+        """
+        Returns:
+            Json: Action -> The histogram of the whole request under "latency" and of each stage under "stages".
+        """
+        with self.lock:
+            return {
+                action: {
+                    "latency": histogram.stats(),
+                    "stages": {
+                        stage: stage_histogram.stats()
+                        for (stage, stage_histogram) in self.stages[action].items()
+                    },
+                }
+                for (action, histogram) in self.actions.items()
+            }
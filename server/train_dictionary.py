@@ -0,0 +1,181 @@
+"""
+Train the zstd dictionary small protocol messages are compressed with.
+
+Messages captured by a server running with COMPRESSION_CAPTURE set are used when given,
+messages built from server_protocol.py with made up values otherwise.
+A retrained dictionary is saved under a new version, older versions are kept for the clients that still have them.
+
+Usage: python train_dictionary.py <version> [captured messages files...]
+"""
+import json
+import os
+import random
+import string
+import sys
+from typing import List
+
+import zstandard
+
+from compression import dictionary_dir, dictionary_path
+from server_protocol import (
+    pack_branches,
+    pack_commit,
+    pack_commits,
+    pack_error,
+    pack_issue,
+    pack_login,
+    pack_not_modified,
+    pack_project_dirs,
+    pack_pull_request,
+    pack_search_repo,
+    pack_stream,
+    pack_validate_token,
+    pack_view_file,
+    pack_view_issues,
+    pack_view_pull_requests,
+)
+
+dictionary_size = 16 * 1024
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+
+
+def random_sentence(rng: random.Random, words: int) -> str:
+    return " ".join(random_word(rng) for _ in range(words)).capitalize()
+
+
+def random_hex(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices("0123456789abcdef", k=length))
+
+
+def synthetic_messages(count: int) -> List[bytes]:
+    """
+    Build requests and responses like the ones clients and the server exchange.
+
+    Parameters:
+        count (int): How many messages to build.
+
+    Returns:
+        List[bytes]: The messages, JSON encoded like on the wire.
+    """
+    rng = random.Random(0)
+    messages: List[bytes] = []
+    while len(messages) < count:
+        user = random_word(rng)
+        repo = f"{user}/{random_word(rng)}"
+        token = random_hex(rng, 32)
+        branches = ["master", "main", "dev", *(random_word(rng) for _ in range(3))]
+        issues = [
+            pack_issue(
+                random_word(rng),
+                random_sentence(rng, 5),
+                random_sentence(rng, rng.randint(5, 40)),
+                rng.randint(1, 500),
+            )
+            for _ in range(rng.randint(0, 8))
+        ]
+        pull_requests = [
+            pack_pull_request(
+                random_word(rng),
+                random_sentence(rng, 4),
+                rng.choice(branches),
+                rng.choice(branches),
+                rng.randint(1, 500),
+                rng.random() < 0.5,
+            )
+            for _ in range(rng.randint(0, 6))
+        ]
+        commits = [
+            pack_commit(
+                f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02} 12:{rng.randint(0, 59):02}:00",
+                random_hex(rng, 40),
+                random_sentence(rng, rng.randint(2, 12)),
+                random_word(rng),
+            )
+            for _ in range(rng.randint(1, 10))
+        ]
+        responses = [
+            pack_login(token),
+            pack_validate_token(rng.random() < 0.9),
+            pack_branches(branches),
+            pack_view_issues(issues),
+            pack_view_pull_requests(pull_requests),
+            pack_commits(commits),
+            pack_project_dirs(
+                [f"{random_word(rng)}.py" for _ in range(rng.randint(1, 10))]
+            ),
+            pack_search_repo([f"{random_word(rng)}/{random_word(rng)}"]),
+            pack_error(rng.choice(["Invalid connection token", "File doesn't exist"])),
+            {**pack_view_file(rng.randint(30000, 40000), token), "fileSize": 1000},
+            {**pack_stream(rng.randint(1, 10**6)), "offset": 0, "fileSize": 10**6},
+            pack_not_modified(f"blob:{random_hex(rng, 40)}:0:1000"),
+        ]
+        requests = [
+            {"type": "validateConnection", "tokenForValidation": token},
+            {"type": "branches", "repo": repo, "connectionToken": token},
+            {"type": "viewIssues", "repo": repo, "connectionToken": token},
+            {"type": "viewPullRequests", "repo": repo, "connectionToken": token},
+            {
+                "type": "commits",
+                "repo": repo,
+                "connectionToken": token,
+                "branch": rng.choice(branches),
+                "page": rng.randint(0, 3),
+            },
+            {
+                "type": "projectDirectory",
+                "repo": repo,
+                "connectionToken": token,
+                "branch": rng.choice(branches),
+                "directory": random_word(rng),
+            },
+            {
+                "type": "viewFile",
+                "repo": repo,
+                "connectionToken": token,
+                "branch": rng.choice(branches),
+                "filePath": f"{random_word(rng)}.py",
+            },
+        ]
+        for (request_id, message) in enumerate([*requests, *responses]):
+            if rng.random() < 0.5:
+                message = {**message, "requestId": request_id}
+            messages.append(json.dumps(message).encode())
+    return messages
+
+
+def captured_messages(paths: List[str]) -> List[bytes]:
+    """
+    Parameters:
+        paths (List[str]): Files written by a server running with COMPRESSION_CAPTURE, one message per line.
+
+    Returns:
+        List[bytes]: The captured messages.
+    """
+    messages: List[bytes] = []
+    for path in paths:
+        with open(path, "rb") as f:
+            messages.extend(line.rstrip(b"\n") for line in f if line.strip())
+    return messages
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    version = int(sys.argv[1])
+    if os.path.exists(dictionary_path(version)):
+        print(f"Dictionary version {version} exists, retrain under a new version")
+        sys.exit(1)
+
+    samples = captured_messages(sys.argv[2:]) or synthetic_messages(20000)
+    dictionary = zstandard.train_dictionary(dictionary_size, samples)
+    os.makedirs(dictionary_dir, exist_ok=True)
+    with open(dictionary_path(version), "wb") as f:
+        f.write(dictionary.as_bytes())
+    print(
+        f"Trained dictionary version {version} on {len(samples)} messages,",
+        f"copy {dictionary_path(version)} to the client's dictionaries too",
+    )